@@ -1,13 +1,44 @@
-from fastapi import FastAPI
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 
+from config import LABS_DATA_DIR, PROFILING_TOKENS, RESPONSE_GZIP_MINIMUM_SIZE
+from health import check_readiness, init_readiness
+from instrumentation import HTTP_REQUEST_DURATION, render_metrics
+from logs import configure_logging, log_context, request_id_var
+from profiling import SamplingProfiler, is_profiling_token, save_profile
 from labs.routes import router as v1_routers
-from workers import celery_app
+from labs.github import close_github_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Keeps startup cheap: no network calls here. Clients connect lazily on
+    first use, and /readz reports whether the dependencies are reachable.
+    """
+    LABS_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    init_readiness()
+    yield
+    await close_github_client()
+
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="vLEM API",
     description="Vulnerability Lab Environment Management API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -18,14 +49,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if RESPONSE_GZIP_MINIMUM_SIZE > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_GZIP_MINIMUM_SIZE)
+
 app.include_router(v1_routers, prefix="/api")
 
 
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    """Record request latency per route template (not per concrete path)."""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status_code),
+        ).observe(time.perf_counter() - start)
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    Profiles requests carrying a profiling token in the X-Profile-Token
+    header. The response names the saved profile in X-Profile-ID; see
+    /api/lab/admin/profiles.
+    """
+    token = request.headers.get("X-Profile-Token")
+    # Reading profiles takes the same token; those requests are not profiled
+    if (
+        not PROFILING_TOKENS
+        or not is_profiling_token(token)
+        or request.url.path.startswith("/api/lab/admin/profiles")
+    ):
+        return await call_next(request)
+
+    profiler = SamplingProfiler().start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+    route = request.scope.get("route")
+    try:
+        profile_id = await asyncio.to_thread(
+            save_profile,
+            profiler,
+            "request",
+            f"{request.method} {getattr(route, 'path', request.url.path)}",
+            status=response.status_code,
+            request_id=request_id_var.get(),
+        )
+        response.headers["X-Profile-ID"] = profile_id
+    except OSError as e:
+        logger.warning(f"Could not save the profile of {request.url.path}: {e}")
+    return response
+
+
+@app.middleware("http")
+async def bind_request_id(request: Request, call_next):
+    """
+    Tags the request's log records with its X-Request-ID (generated when the
+    client sends none) and echoes it in the response.
+    """
+    request_id = request.headers.get("X-Request-ID", "")[:128] or uuid.uuid4().hex
+    with log_context(request_id=request_id):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     return {"message": "Welcome to the vLEM."}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
 @app.get("/healthz", summary="Health check endpoint", tags=["Health"])
 async def healthz():
     """
@@ -36,25 +145,13 @@ async def healthz():
 
 
 @app.get("/readz", summary="Readiness check endpoint", tags=["Health"])
-async def readz():
+async def readz(response: Response):
     """
     Readiness check endpoint to indicate if the application is ready to serve requests.
-    Returns a 200 OK status with a simple message.
+    Checks the database, the broker and the template source; returns 503 with
+    the failing checks if any of them is unavailable.
     """
-    return {"status": "ready"}
-
-
-@app.on_event("startup")
-async def startup_event():
-    """Connect to Redis on application startup (for FastAPI only)."""
-    # Celery workers handle their own Redis connection
-    # This is primarily for the FastAPI app to publish messages
-    print("FastAPI application startup: Initializing Celery connection.")
-    try:
-        # Ping broker to check connection
-        # Note: This ping attempts to connect to *any* worker. If no workers are up, it might fail.
-        # It's a basic check, a more robust system might use Celery's inspect.ping() on known workers.
-        celery_app.control.ping(timeout=1, destination=["celery@%h"])
-        print("Successfully connected to Celery broker (Redis).")
-    except Exception as e:
-        print(f"Failed to connect to Celery broker (Redis) on startup: {e}")
+    report = await check_readiness()
+    if report["status"] != "ready":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return report
@@ -0,0 +1,41 @@
+"""
+Compares two benchmark result files written by `benchmarks.run`.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument(
+        "--metric", default="p50_ms", help="Statistic to compare (e.g. p95_ms)"
+    )
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())
+    candidate = json.loads(args.candidate.read_text())
+    print(
+        f"{'benchmark':70s} {baseline['commit'] or '?':>10s} "
+        f"{candidate['commit'] or '?':>10s} {'change':>8s}"
+    )
+    for name in sorted(set(baseline["results"]) | set(candidate["results"])):
+        old = baseline["results"].get(name, {}).get(args.metric)
+        new = candidate["results"].get(name, {}).get(args.metric)
+        if old is None or new is None:
+            change = "n/a"
+        else:
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(
+            f"{name:70s} {'-' if old is None else f'{old:.2f}':>10s} "
+            f"{'-' if new is None else f'{new:.2f}':>10s} {change:>8s}"
+        )
+
+
+if __name__ == "__main__":
+    main()
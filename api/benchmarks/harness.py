@@ -0,0 +1,98 @@
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summary statistics (in milliseconds) of a list of durations in seconds."""
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def percentile(fraction: float) -> float:
+        position = (count - 1) * fraction
+        lower = int(position)
+        upper = min(lower + 1, count - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    total = sum(ordered)
+    return {
+        "n": count,
+        "mean_ms": total / count * 1000,
+        "p50_ms": percentile(0.5) * 1000,
+        "p95_ms": percentile(0.95) * 1000,
+        "p99_ms": percentile(0.99) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_sec": count / total if total else 0.0,
+    }
+
+
+def measure(fn: Callable[[], object], iterations: int, warmup: int = 1) -> dict:
+    """Times `iterations` calls of `fn` after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def measure_async(
+    fn: Callable[[], Awaitable[object]], iterations: int, warmup: int = 1
+) -> dict:
+    """Async counterpart of `measure`, run on the caller's event loop."""
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def git_revision(repo_dir: Path) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=repo_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(
+    results: dict, output: Optional[Path], repo_dir: Path, config: dict
+) -> Path:
+    """
+    Writes the results as JSON, tagged with the commit and environment, to
+    `output` (default: benchmarks/results/<commit>-<timestamp>.json).
+    """
+    revision = git_revision(repo_dir)
+    timestamp = datetime.now(timezone.utc)
+    document = {
+        "commit": revision,
+        "timestamp": timestamp.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    if output is None:
+        output = (
+            Path(__file__).parent
+            / "results"
+            / f"{revision or 'unknown'}-{timestamp:%Y%m%dT%H%M%S}.json"
+        )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(document, indent=2, sort_keys=True))
+    return output
@@ -0,0 +1,406 @@
+"""
+Concurrent load test: where does provisioning fall over?
+
+Run from the `api/` directory:
+
+    python -m benchmarks.loadtest --rates 0.5,1,2,4 --step-duration 60
+    python -m benchmarks.loadtest --rates 2 --workers 8 --flamegraph worker.svg
+
+Starts the API on a real HTTP port (uvicorn, in a thread) and an in-process
+Celery worker (threads pool) on an in-memory broker, with GitHub and Docker
+stubbed as in `benchmarks.run`. For each arrival rate it fires an open-loop
+(Poisson) mix of `POST /api/lab/templates/{name}/` and `GET /api/lab/`
+requests, then reports:
+
+- HTTP latency and error rate per request type,
+- queue wait vs service time of the provisions (from BuildStage rows),
+- DB connection pool usage (checked-out connections vs pool capacity),
+- completed provisions/minute, and the highest rate that was sustained.
+
+With --flamegraph, py-spy (if installed) records the whole process,
+including the worker threads, for the duration of the run.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.harness import summarize, write_results
+from benchmarks.run import configure_environment, reset_database
+from benchmarks.stubs import REPO_ROOT, github_transport
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--database-url", help="Default: temporary SQLite file")
+    parser.add_argument(
+        "--rates",
+        default="0.5,1,2,4",
+        help="Comma-separated provision arrival rates (per second), one step each",
+    )
+    parser.add_argument("--step-duration", type=float, default=30.0)
+    parser.add_argument(
+        "--list-ratio",
+        type=float,
+        default=4.0,
+        help="GET /api/lab requests fired per provision request",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Worker concurrency")
+    parser.add_argument("--template", default="bwapp")
+    parser.add_argument("--docker-delay", type=float, default=0.5)
+    parser.add_argument("--github-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds to wait for queued provisions after each step",
+    )
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=0.01,
+        help="Highest error rate a step may have to count as sustained",
+    )
+    parser.add_argument("--flamegraph", type=Path, help="Write a py-spy SVG here")
+    parser.add_argument("--output", type=Path, help="Path of the JSON results file")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(port: int):
+    import uvicorn
+    from app import app
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"
+        )
+    )
+    thread = threading.Thread(target=server.run, name="api", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def start_worker(concurrency: int):
+    from celery.worker import WorkController
+    from workers import celery_app
+
+    worker = WorkController(
+        app=celery_app,
+        pool_cls="threads",
+        concurrency=concurrency,
+        queues=["controller_queue"],
+        without_heartbeat=True,
+        without_mingle=True,
+        without_gossip=True,
+        loglevel="WARNING",
+    )
+    thread = threading.Thread(target=worker.start, name="celery-worker", daemon=True)
+    thread.start()
+    return worker, thread
+
+
+class PoolMonitor:
+    """Samples SQLAlchemy pool usage of the in-process engine."""
+
+    def __init__(self, interval: float = 0.1):
+        from db import engine
+
+        self.pool = engine.pool
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            checkedout = getattr(self.pool, "checkedout", None)
+            if checkedout is not None:
+                self.samples.append(checkedout())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        size = getattr(self.pool, "size", lambda: None)()
+        overflow = getattr(self.pool, "_max_overflow", 0)
+        capacity = size + max(overflow, 0) if size is not None else None
+        peak = max(self.samples, default=0)
+        return {
+            "pool_capacity": capacity,
+            "checked_out_peak": peak,
+            "checked_out_mean": (
+                sum(self.samples) / len(self.samples) if self.samples else 0.0
+            ),
+            "saturated_fraction": (
+                sum(1 for sample in self.samples if sample >= capacity)
+                / len(self.samples)
+                if capacity and self.samples
+                else 0.0
+            ),
+        }
+
+
+async def fire(
+    base_url: str, rate: float, duration: float, list_ratio: float, template: str
+) -> dict:
+    """Open-loop Poisson arrivals; requests never wait for each other."""
+    import httpx
+
+    records = {"create": [], "list": []}
+    uids = []
+    total_rate = rate * (1 + list_ratio)
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=30,
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+    ) as client:
+
+        async def request(kind: str):
+            start = time.perf_counter()
+            try:
+                if kind == "create":
+                    response = await client.post(f"/api/lab/templates/{template}/")
+                    if response.status_code == 200:
+                        uids.append(response.json()["uid"])
+                else:
+                    response = await client.get("/api/lab/", params={"limit": 20})
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            records[kind].append((time.perf_counter() - start, ok))
+
+        tasks = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            kind = "create" if random.random() < 1 / (1 + list_ratio) else "list"
+            tasks.append(asyncio.create_task(request(kind)))
+            await asyncio.sleep(random.expovariate(total_rate))
+        await asyncio.gather(*tasks)
+
+    report = {}
+    for kind, samples in records.items():
+        if not samples:
+            continue
+        errors = sum(1 for _, ok in samples if not ok)
+        report[kind] = {
+            "latency": summarize([latency for latency, _ in samples]),
+            "errors": errors,
+            "error_rate": errors / len(samples),
+        }
+    report["uids"] = uids
+    return report
+
+
+def wait_for_provisions(uids: List[str], timeout: float) -> dict:
+    """Waits until every lab left the queue, then collects stage timings."""
+    from db import SessionLocal
+    from labs.enum import LAB_BUILD_STATUS, PROVISION_STAGE
+    from labs.models import Build, BuildStage, Lab
+
+    terminal = {LAB_BUILD_STATUS.COMPLETED.value, LAB_BUILD_STATUS.FAILED.value}
+    deadline = time.time() + timeout
+    db = SessionLocal()
+    try:
+        while True:
+            statuses = dict(
+                db.query(Lab.uid, Lab.status).filter(Lab.uid.in_(uids)).all()
+            )
+            done = [uid for uid, status in statuses.items() if status in terminal]
+            if len(done) == len(uids) or time.time() > deadline:
+                break
+            db.rollback()
+            time.sleep(0.5)
+
+        builds = (
+            db.query(Build.id, Build.started_at, Build.finished_at)
+            .filter(Build.lab_uid.in_(uids))
+            .all()
+        )
+        stages = (
+            db.query(BuildStage.name, BuildStage.duration_seconds)
+            .join(Build, Build.id == BuildStage.build_id)
+            .filter(Build.lab_uid.in_(uids))
+            .all()
+        )
+    finally:
+        db.close()
+
+    queue_wait = [
+        duration
+        for name, duration in stages
+        if name == PROVISION_STAGE.QUEUE_WAIT.value and duration is not None
+    ]
+    service_time = [
+        (finished - started).total_seconds()
+        for _, started, finished in builds
+        if started and finished
+    ]
+    finished_at = [finished for _, _, finished in builds if finished]
+    return {
+        "submitted": len(uids),
+        "completed": sum(
+            1
+            for status in statuses.values()
+            if status == LAB_BUILD_STATUS.COMPLETED.value
+        ),
+        "failed": sum(
+            1 for status in statuses.values() if status == LAB_BUILD_STATUS.FAILED.value
+        ),
+        "unfinished": len(uids) - len(done),
+        "queue_wait": summarize(queue_wait) if queue_wait else None,
+        "service_time": summarize(service_time) if service_time else None,
+        "last_finished_at": max(finished_at) if finished_at else None,
+    }
+
+
+def start_flamegraph(output: Path, duration: float):
+    py_spy = shutil.which("py-spy")
+    if py_spy is None:
+        print("py-spy not found on PATH; skipping the flamegraph.")
+        return None
+
+    return subprocess.Popen(
+        [
+            py_spy,
+            "record",
+            "--pid",
+            str(os.getpid()),
+            "--output",
+            str(output),
+            "--duration",
+            str(int(duration) + 1),
+            "--threads",
+            "--idle",
+        ]
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    workdir = Path(tempfile.mkdtemp(prefix="vlem-load-"))
+    configure_environment(args, workdir)
+    os.environ.setdefault("WORKER_METRICS_PORT", "0")
+
+    import labs.github
+    from workers import celery_app
+
+    labs.github._github_transport = github_transport(latency=args.github_latency)
+    # API and worker share this process, so the in-memory broker connects them
+    celery_app.conf.broker_url = "memory://"
+    celery_app.conf.result_backend = "cache+memory://"
+
+    reset_database()
+    port = free_port()
+    server, _ = start_api(port)
+    worker, _ = start_worker(args.workers)
+    base_url = f"http://127.0.0.1:{port}"
+
+    rates = [float(rate) for rate in args.rates.split(",") if rate]
+    profiler = None
+    if args.flamegraph:
+        profiler = start_flamegraph(
+            args.flamegraph,
+            len(rates) * (args.step_duration + args.drain_timeout),
+        )
+
+    steps = []
+    try:
+        for rate in rates:
+            print(f"Step: {rate} provisions/s for {args.step_duration}s...")
+            monitor = PoolMonitor()
+            monitor.start()
+            started = time.time()
+            traffic = asyncio.run(
+                fire(
+                    base_url,
+                    rate,
+                    args.step_duration,
+                    args.list_ratio,
+                    args.template,
+                )
+            )
+            provisions = wait_for_provisions(traffic.pop("uids"), args.drain_timeout)
+            elapsed = time.time() - started
+            pool = monitor.stop()
+
+            throughput = provisions["completed"] / elapsed * 60
+            error_rate = max(
+                [
+                    traffic[kind]["error_rate"]
+                    for kind in ("create", "list")
+                    if kind in traffic
+                ]
+                + [
+                    (provisions["failed"] + provisions["unfinished"])
+                    / max(provisions["submitted"], 1)
+                ]
+            )
+            provisions.pop("last_finished_at")
+            step = {
+                "rate_per_second": rate,
+                "offered_per_minute": rate * 60,
+                "completed_per_minute": throughput,
+                "error_rate": error_rate,
+                "sustained": error_rate <= args.max_error_rate
+                and provisions["unfinished"] == 0,
+                "http": traffic,
+                "provisions": provisions,
+                "db_pool": pool,
+            }
+            steps.append(step)
+            print(
+                f"  completed/min={throughput:.1f} error_rate={error_rate:.3f} "
+                f"queue_wait_p95={(provisions['queue_wait'] or {}).get('p95_ms', 0):.0f}ms "
+                f"pool_peak={pool['checked_out_peak']}/{pool['pool_capacity']}"
+            )
+    finally:
+        if profiler is not None:
+            # py-spy writes the flamegraph when interrupted, not when terminated
+            profiler.send_signal(signal.SIGINT)
+            profiler.wait()
+        worker.stop(in_sighandler=False)
+        server.should_exit = True
+
+    sustained = [step for step in steps if step["sustained"]]
+    results = {
+        "steps": steps,
+        "max_sustainable_provisions_per_minute": max(
+            (step["completed_per_minute"] for step in sustained), default=0.0
+        ),
+    }
+    config = {
+        **vars(args),
+        "output": str(args.output) if args.output else None,
+        "flamegraph": str(args.flamegraph) if args.flamegraph else None,
+    }
+    output = write_results(results, args.output, REPO_ROOT, config)
+    print(
+        "Max sustainable provisions/minute: "
+        f"{results['max_sustainable_provisions_per_minute']:.1f}"
+    )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
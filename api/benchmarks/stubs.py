@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import os
+import stat
+from pathlib import Path
+
+import httpx
+
+from labs.constants import (
+    GITHUB_BRANCH,
+    GITHUB_RAW_BASE,
+    GITHUB_REPO_NAME,
+    GITHUB_REPO_OWNER,
+)
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+FAKE_DOCKER_SCRIPT = """#!/bin/sh
+# Stand-in for `docker` / `docker-compose` used by the benchmarks.
+case "$*" in
+  *version*) echo "Docker Compose version v2.99.0-benchmark"; exit 0 ;;
+esac
+echo "fake-docker: $*"
+case "$*" in
+  *build*|*" up "*|*" down"*) sleep "${FAKE_DOCKER_DELAY:-0.05}" ;;
+esac
+echo "fake-docker: done"
+"""
+
+
+def github_transport(repo_root: Path = REPO_ROOT, latency: float = 0.0):
+    """
+    An httpx.MockTransport that serves the raw-content, contents-API and
+    commits-API URLs used by labs.utils from the repository's own
+    `templates/` directory.
+    `latency` (seconds) is added to every response to mimic the network.
+    """
+    raw_prefix = f"/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/{GITHUB_BRANCH}/"
+    contents_prefix = f"/repos/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/contents/"
+    commits_path = f"/repos/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/commits"
+
+    def respond(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.url.host == "raw.githubusercontent.com" and path.startswith(
+            raw_prefix
+        ):
+            target = repo_root / path[len(raw_prefix) :]
+            if target.is_file():
+                return httpx.Response(200, content=target.read_bytes())
+
+        if request.url.host == "api.github.com" and path.startswith(contents_prefix):
+            relative = path[len(contents_prefix) :].strip("/")
+            target = repo_root / relative
+            if target.is_dir():
+                return httpx.Response(
+                    200,
+                    json=[
+                        {
+                            "name": entry.name,
+                            "path": f"{relative}/{entry.name}",
+                            "type": "dir" if entry.is_dir() else "file",
+                            "size": entry.stat().st_size,
+                            "download_url": (
+                                None
+                                if entry.is_dir()
+                                else f"{GITHUB_RAW_BASE}/{GITHUB_REPO_OWNER}/"
+                                f"{GITHUB_REPO_NAME}/{GITHUB_BRANCH}/{relative}/{entry.name}"
+                            ),
+                        }
+                        for entry in sorted(target.iterdir())
+                    ],
+                )
+
+        if request.url.host == "api.github.com" and path == commits_path:
+            # A stable "commit SHA" derived from the content of the directory
+            target = repo_root / request.url.params.get("path", "")
+            digest = hashlib.sha1()
+            for entry in sorted(target.rglob("*")):
+                if entry.is_file():
+                    digest.update(str(entry.relative_to(target)).encode())
+                    digest.update(entry.read_bytes())
+            sha = digest.hexdigest()
+            etag = f'"{sha}"'
+            if request.headers.get("if-none-match") == etag:
+                return httpx.Response(304, headers={"ETag": etag})
+            return httpx.Response(200, json=[{"sha": sha}], headers={"ETag": etag})
+
+        return httpx.Response(404, text="Not Found")
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        return respond(request)
+
+    return httpx.MockTransport(handler)
+
+
+def install_fake_docker(bin_dir: Path, delay: float) -> None:
+    """
+    Puts fake `docker` and `docker-compose` executables first on PATH. They
+    answer version checks and sleep `delay` seconds for build/up/down.
+    """
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name in ("docker", "docker-compose"):
+        executable = bin_dir / name
+        executable.write_text(FAKE_DOCKER_SCRIPT)
+        executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ["FAKE_DOCKER_DELAY"] = str(delay)
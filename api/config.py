@@ -1,4 +1,5 @@
 import os
+import socket
 from pathlib import Path
 
 # SQLite database URL
@@ -9,10 +10,315 @@ SQLALCHEMY_DATABASE_URL = os.getenv(
 # Directory for storing lab files
 LABS_DATA_DIR = Path(os.getenv("VLEM_TEMPLATES_DIR", "/var/lib/vlem/templates"))
 
-# Ensure LABS_DATA_DIR exists on startup
-if not LABS_DATA_DIR.exists():
-    os.makedirs(LABS_DATA_DIR)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-CELERY_BROKER_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-CELERY_RESULT_BACKEND = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_INCLUDE_MODULES = ["labs.tasks"]
+
+# Lab expiry defaults, used when neither the template nor the request sets them.
+# A value of 0 disables the corresponding limit.
+LAB_DEFAULT_TTL_MINUTES = int(os.getenv("LAB_DEFAULT_TTL_MINUTES", "240"))
+LAB_DEFAULT_IDLE_TIMEOUT_MINUTES = int(
+    os.getenv("LAB_DEFAULT_IDLE_TIMEOUT_MINUTES", "60")
+)
+
+# Build and start the lab's containers (`docker compose build` / `up -d`) when
+# provisioning. When off, provisioning stops once the template is downloaded
+# and validated, leaving the lab 'building', as before containers were
+# started; snapshots, resets and the reconciler then have nothing to act on.
+LAB_START_CONTAINERS = os.getenv("LAB_START_CONTAINERS", "true").lower() == "true"
+
+# Celery beat reaper for expired labs
+LAB_REAPER_INTERVAL_SECONDS = int(os.getenv("LAB_REAPER_INTERVAL_SECONDS", "60"))
+LAB_REAPER_BATCH_SIZE = int(os.getenv("LAB_REAPER_BATCH_SIZE", "50"))
+LAB_REAPER_MAX_BATCHES = int(os.getenv("LAB_REAPER_MAX_BATCHES", "10"))
+# A claimed lab is claimed again if its teardown has not finished by then
+LAB_TEARDOWN_LEASE_SECONDS = int(os.getenv("LAB_TEARDOWN_LEASE_SECONDS", "900"))
+
+# Celery beat reconciler of lab statuses against the containers on each node.
+# Labs changed within the grace period are left alone (a task may be working
+# on them); orphaned lab containers are only reported unless removal is on.
+LAB_RECONCILER_INTERVAL_SECONDS = int(
+    os.getenv("LAB_RECONCILER_INTERVAL_SECONDS", "300")
+)
+LAB_RECONCILER_GRACE_SECONDS = int(os.getenv("LAB_RECONCILER_GRACE_SECONDS", "120"))
+LAB_RECONCILER_REMOVE_ORPHANS = (
+    os.getenv("LAB_RECONCILER_REMOVE_ORPHANS", "false").lower() == "true"
+)
+
+# Per-lab container resource sampler (runs inside each Celery worker)
+LAB_METRICS_ENABLED = os.getenv("LAB_METRICS_ENABLED", "true").lower() == "true"
+CGROUP_ROOT = Path(os.getenv("CGROUP_ROOT", "/sys/fs/cgroup"))
+LAB_METRICS_SAMPLE_INTERVAL_SECONDS = float(
+    os.getenv("LAB_METRICS_SAMPLE_INTERVAL_SECONDS", "10")
+)
+LAB_METRICS_DISCOVERY_INTERVAL_SECONDS = float(
+    os.getenv("LAB_METRICS_DISCOVERY_INTERVAL_SECONDS", "30")
+)
+LAB_METRICS_PUBLISH_INTERVAL_SECONDS = float(
+    os.getenv("LAB_METRICS_PUBLISH_INTERVAL_SECONDS", "30")
+)
+# Number of samples kept per lab (360 samples at 10s = 1 hour)
+LAB_METRICS_BUFFER_SIZE = int(os.getenv("LAB_METRICS_BUFFER_SIZE", "360"))
+LAB_METRICS_MAX_POINTS = int(os.getenv("LAB_METRICS_MAX_POINTS", "120"))
+# Containers of a lab using at least this much CPU count as lab activity and
+# restart its idle timeout
+LAB_ACTIVITY_CPU_PERCENT = float(os.getenv("LAB_ACTIVITY_CPU_PERCENT", "5"))
+
+# Prometheus metrics
+# Port of the /metrics server started by each Celery worker (0 disables it).
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9808"))
+# Set when Celery runs with the prefork pool, so that every child process
+# writes its samples where the worker's metrics server can aggregate them.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Readiness checks (/readz)
+READINESS_CHECK_TIMEOUT_SECONDS = float(
+    os.getenv("READINESS_CHECK_TIMEOUT_SECONDS", "2")
+)
+# Probes within this window get the cached report instead of re-checking
+READINESS_CACHE_TTL_SECONDS = float(os.getenv("READINESS_CACHE_TTL_SECONDS", "5"))
+
+# Response cache (Redis) and ETags for lab listings
+LAB_LIST_CACHE_ENABLED = os.getenv("LAB_LIST_CACHE_ENABLED", "true").lower() == "true"
+LAB_LIST_CACHE_TTL_SECONDS = int(os.getenv("LAB_LIST_CACHE_TTL_SECONDS", "300"))
+
+# Gzip responses larger than this many bytes, if the client accepts it (0 disables)
+RESPONSE_GZIP_MINIMUM_SIZE = int(os.getenv("RESPONSE_GZIP_MINIMUM_SIZE", "1024"))
+
+# Serve GET /api/lab/summary from the lab_counters table (O(1) in the number
+# of labs) instead of a GROUP BY over the labs table.
+LAB_SUMMARY_FROM_COUNTERS = (
+    os.getenv("LAB_SUMMARY_FROM_COUNTERS", "true").lower() == "true"
+)
+
+# On-disk LRU cache of template logos, served by GET /api/lab/templates/{name}/logo
+LOGO_CACHE_DIR = Path(os.getenv("VLEM_LOGO_CACHE_DIR", "/var/lib/vlem/cache/logos"))
+LOGO_CACHE_MAX_BYTES = int(os.getenv("LOGO_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Largest single logo accepted from upstream
+LOGO_MAX_BYTES = int(os.getenv("LOGO_MAX_BYTES", str(2 * 1024 * 1024)))
+# How long a cached logo is served before it is revalidated upstream
+LOGO_REVALIDATE_SECONDS = int(os.getenv("LOGO_REVALIDATE_SECONDS", "3600"))
+# Cache-Control max-age sent to browsers
+LOGO_BROWSER_MAX_AGE_SECONDS = int(
+    os.getenv("LOGO_BROWSER_MAX_AGE_SECONDS", str(7 * 24 * 3600))
+)
+
+# How long the template catalog is served before the templates index is
+# re-fetched in the background
+TEMPLATE_CATALOG_REVALIDATE_SECONDS = int(
+    os.getenv("TEMPLATE_CATALOG_REVALIDATE_SECONDS", "60")
+)
+
+# Local store of pre-fetched templates, refreshed by the template sync task
+TEMPLATE_STORE_DIR = Path(
+    os.getenv("VLEM_TEMPLATE_STORE_DIR", "/var/lib/vlem/template-store")
+)
+# How often Celery beat checks the template repository for changes (0 disables)
+TEMPLATE_SYNC_INTERVAL_SECONDS = int(os.getenv("TEMPLATE_SYNC_INTERVAL_SECONDS", "300"))
+# Pull the images of every template after a change, so provisioning starts warm
+TEMPLATE_SYNC_PULL_IMAGES = (
+    os.getenv("TEMPLATE_SYNC_PULL_IMAGES", "true").lower() == "true"
+)
+# How long a replaced version of the store is kept, for provisions that may
+# still be copying from it
+TEMPLATE_STORE_RETENTION_SECONDS = int(
+    os.getenv("TEMPLATE_STORE_RETENTION_SECONDS", "3600")
+)
+
+# GitHub fetcher. Without a token GitHub allows 60 API requests per hour.
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN") or None
+GITHUB_RATE_LIMIT_PER_HOUR = int(
+    os.getenv("GITHUB_RATE_LIMIT_PER_HOUR", "5000" if GITHUB_TOKEN else "60")
+)
+# Requests that may be sent at once before the hourly rate applies
+GITHUB_RATE_LIMIT_BURST = int(os.getenv("GITHUB_RATE_LIMIT_BURST", "10"))
+# Longest a request waits for rate limit budget before falling back to the cache
+GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS = float(
+    os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS", "10")
+)
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "3"))
+GITHUB_RETRY_BASE_SECONDS = float(os.getenv("GITHUB_RETRY_BASE_SECONDS", "0.5"))
+GITHUB_RETRY_MAX_SECONDS = float(os.getenv("GITHUB_RETRY_MAX_SECONDS", "8"))
+# Consecutive failures that open the circuit, and how long it stays open
+GITHUB_CIRCUIT_FAILURE_THRESHOLD = int(
+    os.getenv("GITHUB_CIRCUIT_FAILURE_THRESHOLD", "5")
+)
+GITHUB_CIRCUIT_RESET_SECONDS = float(os.getenv("GITHUB_CIRCUIT_RESET_SECONDS", "30"))
+# How long fetched GitHub content is kept for conditional requests and fallback
+GITHUB_CACHE_TTL_SECONDS = int(os.getenv("GITHUB_CACHE_TTL_SECONDS", str(7 * 86400)))
+
+# Lab progress events (Redis Streams), one capped stream per lab plus a global one
+LAB_EVENTS_ENABLED = os.getenv("LAB_EVENTS_ENABLED", "true").lower() == "true"
+LAB_EVENTS_STREAM_MAXLEN = int(os.getenv("LAB_EVENTS_STREAM_MAXLEN", "500"))
+LAB_EVENTS_GLOBAL_STREAM_MAXLEN = int(
+    os.getenv("LAB_EVENTS_GLOBAL_STREAM_MAXLEN", "100000")
+)
+# Per-lab streams are dropped once a lab has been quiet this long
+LAB_EVENTS_STREAM_TTL_SECONDS = int(os.getenv("LAB_EVENTS_STREAM_TTL_SECONDS", "86400"))
+
+# Lab placement across worker nodes. Each worker announces itself with a
+# heartbeat and consumes its own queue ("node.<name>") besides controller_queue.
+# Run several workers with distinct VLEM_NODE_NAMEs to simulate several nodes.
+LAB_PLACEMENT_ENABLED = os.getenv("LAB_PLACEMENT_ENABLED", "true").lower() == "true"
+NODE_NAME = os.getenv("VLEM_NODE_NAME") or socket.gethostname()
+NODE_HEARTBEAT_INTERVAL_SECONDS = float(
+    os.getenv("NODE_HEARTBEAT_INTERVAL_SECONDS", "10")
+)
+# Nodes without a heartbeat for this long get no new labs
+NODE_HEARTBEAT_TTL_SECONDS = float(os.getenv("NODE_HEARTBEAT_TTL_SECONDS", "30"))
+NODE_MAX_LABS = int(os.getenv("NODE_MAX_LABS", "20"))
+# Host ports labs may publish on this node, as "<first>-<last>"
+NODE_PORT_RANGE = tuple(
+    int(port) for port in os.getenv("NODE_PORT_RANGE", "8000-8999").split("-", 1)
+)
+# Nodes with less available memory get no new labs
+NODE_MIN_FREE_MEMORY_BYTES = int(
+    os.getenv("NODE_MIN_FREE_MEMORY_BYTES", str(512 * 1024 * 1024))
+)
+# "least_loaded" spreads labs over nodes, "bin_packing" fills nodes one by one
+LAB_PLACEMENT_POLICY = os.getenv("LAB_PLACEMENT_POLICY", "least_loaded")
+# Score bonus of nodes that already hold the template and its images
+LAB_PLACEMENT_CACHE_AFFINITY = float(os.getenv("LAB_PLACEMENT_CACHE_AFFINITY", "0.3"))
+
+# Template images: services with a `build:` section are built once per content
+# hash of their build context and shared by all labs of the template.
+TEMPLATE_IMAGE_REPOSITORY = os.getenv("TEMPLATE_IMAGE_REPOSITORY", "vlem-templates")
+# Local BuildKit layer cache (--cache-from/--cache-to type=local)
+BUILD_CACHE_DIR = Path(
+    os.getenv("VLEM_BUILD_CACHE_DIR", "/var/lib/vlem/cache/buildkit")
+)
+# Buildx builder used for template images; created (docker-container driver,
+# which supports local cache export) if it does not exist
+BUILDX_BUILDER = os.getenv("BUILDX_BUILDER", "vlem")
+TEMPLATE_IMAGE_BUILD_TIMEOUT_SECONDS = int(
+    os.getenv("TEMPLATE_IMAGE_BUILD_TIMEOUT_SECONDS", "1800")
+)
+
+# Lab snapshots, taken right after the first successful start so a lab can be
+# reset by recreating its containers instead of provisioning it again
+LAB_SNAPSHOTS_ENABLED = os.getenv("LAB_SNAPSHOTS_ENABLED", "true").lower() == "true"
+LAB_SNAPSHOT_DIR = Path(os.getenv("VLEM_SNAPSHOT_DIR", "/var/lib/vlem/snapshots"))
+LAB_SNAPSHOT_REPOSITORY = os.getenv("LAB_SNAPSHOT_REPOSITORY", "vlem-snapshots")
+# Image used to archive and restore named volumes
+LAB_SNAPSHOT_HELPER_IMAGE = os.getenv("LAB_SNAPSHOT_HELPER_IMAGE", "alpine:3")
+# Celery beat cleanup of snapshots left behind by labs that are gone
+LAB_SNAPSHOT_GC_INTERVAL_SECONDS = int(
+    os.getenv("LAB_SNAPSHOT_GC_INTERVAL_SECONDS", "3600")
+)
+
+# Disk accounting of the node's vLEM directories. Above the high watermark
+# (percent of the filesystem holding LABS_DATA_DIR in use), cached template
+# data is evicted, least recently used first, down to the low watermark.
+DISK_HIGH_WATERMARK_PERCENT = float(os.getenv("DISK_HIGH_WATERMARK_PERCENT", "85"))
+DISK_LOW_WATERMARK_PERCENT = float(os.getenv("DISK_LOW_WATERMARK_PERCENT", "75"))
+DISK_MAINTENANCE_INTERVAL_SECONDS = int(
+    os.getenv("DISK_MAINTENANCE_INTERVAL_SECONDS", "600")
+)
+
+# Admission control of lab creation. Requests are rejected with 503 while the
+# provisioning queue is full or no node has capacity, and with 429 once a
+# client used up its quota; both with a Retry-After estimated from recent
+# throughput. Requests with a priority token (e.g. instructors) skip the
+# quota and capacity checks, may fill the queue up to a higher limit and are
+# enqueued ahead of standard provisions. A value of 0 disables a limit.
+ADMISSION_MAX_QUEUED_PROVISIONS = int(
+    os.getenv("ADMISSION_MAX_QUEUED_PROVISIONS", "500")
+)
+ADMISSION_PRIORITY_MAX_QUEUED_PROVISIONS = int(
+    os.getenv("ADMISSION_PRIORITY_MAX_QUEUED_PROVISIONS", "1000")
+)
+ADMISSION_CLIENT_QUOTA = int(os.getenv("ADMISSION_CLIENT_QUOTA", "0"))
+ADMISSION_CLIENT_QUOTA_WINDOW_SECONDS = int(
+    os.getenv("ADMISSION_CLIENT_QUOTA_WINDOW_SECONDS", "3600")
+)
+# Header identifying the client behind a trusted proxy (e.g. X-Forwarded-For);
+# the peer address is used when unset
+ADMISSION_CLIENT_ID_HEADER = os.getenv("ADMISSION_CLIENT_ID_HEADER", "")
+ADMISSION_PRIORITY_HEADER = os.getenv("ADMISSION_PRIORITY_HEADER", "X-Priority-Token")
+ADMISSION_PRIORITY_TOKENS = [
+    token.strip()
+    for token in os.getenv("ADMISSION_PRIORITY_TOKENS", "").split(",")
+    if token.strip()
+]
+# How long each API process reuses the queue depth, node capacity and
+# throughput it read, and the window the throughput is measured over
+ADMISSION_STATE_CACHE_SECONDS = float(os.getenv("ADMISSION_STATE_CACHE_SECONDS", "2"))
+ADMISSION_THROUGHPUT_WINDOW_SECONDS = int(
+    os.getenv("ADMISSION_THROUGHPUT_WINDOW_SECONDS", "600")
+)
+ADMISSION_DEFAULT_RETRY_AFTER_SECONDS = int(
+    os.getenv("ADMISSION_DEFAULT_RETRY_AFTER_SECONDS", "30")
+)
+ADMISSION_MAX_RETRY_AFTER_SECONDS = int(
+    os.getenv("ADMISSION_MAX_RETRY_AFTER_SECONDS", "600")
+)
+
+# Cancellation of provisions: how often a running provision checks its
+# cancellation flag, and how long a flag is kept
+LAB_CANCEL_POLL_INTERVAL_SECONDS = float(
+    os.getenv("LAB_CANCEL_POLL_INTERVAL_SECONDS", "0.5")
+)
+LAB_CANCEL_FLAG_TTL_SECONDS = int(os.getenv("LAB_CANCEL_FLAG_TTL_SECONDS", "86400"))
+
+# Logging: records are queued and written by a background thread, as JSON
+# lines ("json") or plain text ("text"). LOG_LEVELS sets per-module levels
+# and LOG_SAMPLING keeps only a fraction of a module's records below WARNING,
+# both as "module=value,..." (e.g. "labs.utils=WARNING", "labs.tasks=0.1").
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, _, level in (
+        item.partition("=")
+        # httpx logs every request at INFO, GitHub downloads included
+        for item in os.getenv("LOG_LEVELS", "httpx=WARNING").split(",")
+    )
+    if name.strip() and level.strip()
+}
+LOG_SAMPLING = {
+    name.strip(): float(rate)
+    for name, _, rate in (
+        item.partition("=") for item in os.getenv("LOG_SAMPLING", "").split(",")
+    )
+    if name.strip() and rate.strip()
+}
+# Records beyond this many waiting to be written are dropped, never waited on
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Opt-in profiling. An API request is profiled when it carries one of
+# PROFILING_TOKENS in the X-Profile-Token header (never in the URL, which ends
+# up in access logs); PROFILE_TASKS profiles every Nth run of the named Celery
+# tasks ("task_manager=20,reap_expired_labs=1"). Profiles are kept in
+# VLEM_PROFILE_DIR (at most PROFILE_MAX_FILES) and the slowest
+# PROFILE_INDEX_SIZE are listed by /api/lab/admin/profiles, which also
+# requires a token.
+PROFILING_TOKENS = [
+    token.strip()
+    for token in os.getenv("PROFILING_TOKENS", "").split(",")
+    if token.strip()
+]
+PROFILE_TASKS = {
+    name.strip(): int(every)
+    for name, _, every in (
+        item.partition("=") for item in os.getenv("PROFILE_TASKS", "").split(",")
+    )
+    if name.strip() and every.strip()
+}
+PROFILE_DIR = Path(os.getenv("VLEM_PROFILE_DIR", "/var/lib/vlem/profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_INDEX_SIZE = int(os.getenv("PROFILE_INDEX_SIZE", "100"))
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(
+    os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", "0.005")
+)
+
+# Build logs are range-partitioned by day (1) or week (7) on PostgreSQL, so
+# retention drops whole partitions instead of deleting rows. Partitions are
+# created BUILD_LOG_PARTITIONS_AHEAD ahead by a periodic task.
+BUILD_LOG_PARTITION_DAYS = int(os.getenv("BUILD_LOG_PARTITION_DAYS", "1"))
+BUILD_LOG_PARTITIONS_AHEAD = int(os.getenv("BUILD_LOG_PARTITIONS_AHEAD", "7"))
+BUILD_LOG_RETENTION_DAYS = int(os.getenv("BUILD_LOG_RETENTION_DAYS", "30"))
+BUILD_LOG_MAINTENANCE_INTERVAL_SECONDS = int(
+    os.getenv("BUILD_LOG_MAINTENANCE_INTERVAL_SECONDS", "3600")
+)
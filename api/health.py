@@ -0,0 +1,89 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from config import READINESS_CHECK_TIMEOUT_SECONDS, READINESS_CACHE_TTL_SECONDS
+from db import engine
+from redis_client import get_redis
+from labs.utils import check_template_source
+
+_cached_report: Optional[dict] = None
+_cached_at = 0.0
+_refresh_lock: Optional[asyncio.Lock] = None
+
+
+def init_readiness() -> None:
+    """Creates the refresh lock inside the running event loop (app lifespan)."""
+    global _refresh_lock
+    _refresh_lock = asyncio.Lock()
+
+
+def _check_database() -> None:
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def _check_broker() -> None:
+    # The Celery broker is the same Redis instance
+    get_redis().ping()
+
+
+async def _run_check(check: Callable[[], Awaitable[None]]) -> dict:
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), timeout=READINESS_CHECK_TIMEOUT_SECONDS)
+        result = {"status": "ok"}
+    except asyncio.TimeoutError:
+        result = {
+            "status": "error",
+            "error": f"timed out after {READINESS_CHECK_TIMEOUT_SECONDS}s",
+        }
+    except Exception as e:
+        result = {"status": "error", "error": str(e)}
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+async def _collect_report() -> dict:
+    checks: Dict[str, Callable[[], Awaitable[None]]] = {
+        "database": lambda: asyncio.to_thread(_check_database),
+        "broker": lambda: asyncio.to_thread(_check_broker),
+        "template_source": check_template_source,
+    }
+    results = await asyncio.gather(*(_run_check(check) for check in checks.values()))
+    report = dict(zip(checks, results))
+    return {
+        "status": (
+            "ready"
+            if all(result["status"] == "ok" for result in results)
+            else "not_ready"
+        ),
+        "checks": report,
+        "checked_at": time.time(),
+    }
+
+
+async def check_readiness() -> dict:
+    """
+    Checks the database, the broker and the template source concurrently.
+    The report is cached for READINESS_CACHE_TTL_SECONDS so that frequent
+    probes stay cheap, and concurrent probes share a single refresh.
+    """
+    global _cached_report, _cached_at
+
+    if _cached_report and time.monotonic() - _cached_at < READINESS_CACHE_TTL_SECONDS:
+        return _cached_report
+
+    if _refresh_lock is None:
+        init_readiness()
+    async with _refresh_lock:
+        if (
+            _cached_report
+            and time.monotonic() - _cached_at < READINESS_CACHE_TTL_SECONDS
+        ):
+            return _cached_report
+        _cached_report = await _collect_report()
+        _cached_at = time.monotonic()
+        return _cached_report
@@ -1,5 +1,6 @@
 import json
 import base64
+from datetime import datetime, timezone
 
 
 def encode_base64(data: str) -> str:
@@ -22,4 +23,17 @@ def read_json(file_path: str) -> dict:
     except FileNotFoundError:
         raise FileNotFoundError(f"File '{file_path}' not found.")
     except json.JSONDecodeError:
-        raise ValueError(f"File '{file_path}' is not valid JSON.")
\ No newline at end of file
+        raise ValueError(f"File '{file_path}' is not valid JSON.")
+
+
+def utcnow() -> datetime:
+    """
+    Returns the current UTC time as a naive datetime, matching how the
+    DateTime columns are stored.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def utcfromtimestamp(timestamp: float) -> datetime:
+    """Converts epoch seconds to a naive UTC datetime."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
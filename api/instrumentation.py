@@ -0,0 +1,148 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+from config import PROMETHEUS_MULTIPROC_DIR
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "vlem_http_request_duration_seconds",
+    "Latency of HTTP requests handled by the API, per route template.",
+    ["method", "route", "status"],
+)
+
+PROVISION_STAGE_DURATION = Histogram(
+    "vlem_provision_stage_duration_seconds",
+    "Duration of each lab provisioning stage.",
+    ["stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+
+GITHUB_FETCH_DURATION = Histogram(
+    "vlem_github_fetch_duration_seconds",
+    "Latency of requests to GitHub, by kind of request and response status.",
+    ["kind", "status"],
+)
+
+GITHUB_FETCH_BYTES = Histogram(
+    "vlem_github_fetch_response_bytes",
+    "Size of successful GitHub response bodies.",
+    ["kind"],
+    buckets=BYTES_BUCKETS,
+)
+
+GITHUB_FETCH_RESULTS = Counter(
+    "vlem_github_fetch_results_total",
+    "Outcome of GitHub fetches: fetched, not_modified (served from cache after "
+    "a 304), stale (served from cache after a failure) or failed.",
+    ["kind", "result"],
+)
+
+TEMPLATE_IMAGE_BUILDS = Counter(
+    "vlem_template_image_builds_total",
+    "Template service images needed by provisions: built, cached (build "
+    "skipped, image of the same content hash exists) or failed.",
+    ["template", "result"],
+)
+
+LAB_STATUS_TRANSITIONS = Counter(
+    "vlem_lab_status_transitions_total",
+    "Lab status transitions, by LAB_BUILD_STATUS.",
+    ["from_status", "to_status"],
+)
+
+LAB_LIST_CACHE_REQUESTS = Counter(
+    "vlem_lab_list_cache_requests_total",
+    "Lab listing requests by cache result (hit, miss, not_modified or bypass).",
+    ["result"],
+)
+
+LAB_RECONCILER_DRIFT = Counter(
+    "vlem_lab_reconciler_drift_total",
+    "Drift found by the lab reconciler: lost (lab marked running without "
+    "running containers), orphaned (lab containers without a live lab) or "
+    "orphan_removed.",
+    ["kind"],
+)
+
+DISK_EVICTIONS = Counter(
+    "vlem_disk_evictions_total",
+    "Cached template data evicted above the disk high watermark, by kind "
+    "(template or build_cache).",
+    ["kind"],
+)
+
+LAB_ADMISSIONS = Counter(
+    "vlem_lab_admissions_total",
+    "Lab creation requests by lane (standard or priority) and admission result "
+    "(admitted, quota, queue_full or no_capacity).",
+    ["lane", "result"],
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "vlem_log_records_dropped_total",
+    "Log records not written, by reason (sampled out, or queue_full when the "
+    "log writer falls behind).",
+    ["reason"],
+)
+
+LAB_CANCELLATION_DURATION = Histogram(
+    "vlem_lab_cancellation_seconds",
+    "Time from a cancel request to the provision stopping and freeing its "
+    "worker, by where the provision was (queued or running).",
+    ["phase"],
+    buckets=STAGE_BUCKETS,
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Times a provisioning stage and records whether it raised."""
+    outcome = "success"
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        outcome = "failure"
+        raise
+    finally:
+        PROVISION_STAGE_DURATION.labels(stage=stage, outcome=outcome).observe(
+            time.perf_counter() - start
+        )
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """Returns the registry to expose, aggregating across processes if configured."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> tuple:
+    """Renders the metrics in the Prometheus text format, with its content type."""
+    return generate_latest(get_metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int) -> None:
+    """Serves /metrics on `port` from a background thread (used by Celery workers)."""
+    start_http_server(port, registry=get_metrics_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drops the live gauges of a finished worker child in multiprocess mode."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
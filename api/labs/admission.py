@@ -0,0 +1,274 @@
+import hmac
+import logging
+import math
+import time
+import threading
+from typing import Optional
+
+import redis
+from fastapi import HTTPException, Request, status
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from redis_client import get_redis
+from config import (
+    ADMISSION_CLIENT_ID_HEADER,
+    ADMISSION_CLIENT_QUOTA,
+    ADMISSION_CLIENT_QUOTA_WINDOW_SECONDS,
+    ADMISSION_DEFAULT_RETRY_AFTER_SECONDS,
+    ADMISSION_MAX_QUEUED_PROVISIONS,
+    ADMISSION_MAX_RETRY_AFTER_SECONDS,
+    ADMISSION_PRIORITY_HEADER,
+    ADMISSION_PRIORITY_MAX_QUEUED_PROVISIONS,
+    ADMISSION_PRIORITY_TOKENS,
+    ADMISSION_STATE_CACHE_SECONDS,
+    ADMISSION_THROUGHPUT_WINDOW_SECONDS,
+    LAB_PLACEMENT_ENABLED,
+)
+from instrumentation import LAB_ADMISSIONS
+from labs.enum import LAB_BUILD_STATUS
+from labs.models import LabCounter
+from labs.scheduler import list_nodes
+from labs.constants import (
+    ADMISSION_DECISIONS_KEY,
+    ADMISSION_FINISHED_KEY_PREFIX,
+    ADMISSION_QUOTA_KEY_PREFIX,
+    PRIORITY_PROVISION_TASK_PRIORITY,
+    PROVISION_TASK_PRIORITY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Queue depth, node capacity and throughput last read by this process. It is
+# replaced as a whole on refresh, never emptied: admissions run in worker
+# threads and may hold the previous one.
+_state: Optional[dict] = None
+# Guards the counts admissions add to _state until its next refresh
+_state_lock = threading.Lock()
+
+
+def record_provision_finished(now: Optional[float] = None) -> None:
+    """Counts a finished provision in its minute, for the throughput estimate."""
+    key = f"{ADMISSION_FINISHED_KEY_PREFIX}{int((now or time.time()) // 60)}"
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, ADMISSION_THROUGHPUT_WINDOW_SECONDS + 120)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record the provision throughput: {e}")
+
+
+def _read_throughput(now: float) -> Optional[float]:
+    """Provisions finished per second over the last complete minutes."""
+    minutes = max(ADMISSION_THROUGHPUT_WINDOW_SECONDS // 60, 1)
+    current = int(now // 60)
+    counts = get_redis().mget(
+        [
+            f"{ADMISSION_FINISHED_KEY_PREFIX}{minute}"
+            for minute in range(current - minutes, current)
+        ]
+    )
+    return sum(int(count or 0) for count in counts) / (minutes * 60)
+
+
+def _read_state(db: Session, now: float) -> dict:
+    queued = (
+        db.query(func.coalesce(func.sum(LabCounter.count), 0))
+        .filter(LabCounter.status == LAB_BUILD_STATUS.QUEUED.value)
+        .scalar()
+    )
+    state = {
+        "queued": int(queued),
+        "free_slots": None,
+        "throughput_per_second": None,
+        "updated_at": now,
+    }
+    try:
+        state["throughput_per_second"] = _read_throughput(now)
+        if LAB_PLACEMENT_ENABLED:
+            nodes = [node for node in list_nodes(now) if node["alive"]]
+            if nodes:
+                state["free_slots"] = sum(
+                    max(node["max_labs"] - node["labs"] - node["reserved"], 0)
+                    for node in nodes
+                )
+    except redis.RedisError as e:
+        logger.warning(f"Admission control without throughput and capacity: {e}")
+    return state
+
+
+def get_admission_state(db: Session) -> dict:
+    """
+    Returns the number of queued provisions, the free lab slots of the live
+    nodes (None when unknown) and the recent provisioning throughput. They are
+    read at most every ADMISSION_STATE_CACHE_SECONDS per process, from the lab
+    counters and Redis, never by inspecting the broker.
+    """
+    global _state
+
+    now = time.time()
+    state = _state
+    if state is None or now - state["updated_at"] >= ADMISSION_STATE_CACHE_SECONDS:
+        state = _state = _read_state(db, now)
+    return state
+
+
+def estimate_wait_seconds(queued: int, throughput: Optional[float]) -> Optional[float]:
+    """Time for `queued` provisions to start at the recent throughput, if known."""
+    if not throughput:
+        return None
+    return queued / throughput
+
+
+def _retry_after(wait_seconds: Optional[float]) -> int:
+    if wait_seconds is None:
+        return ADMISSION_DEFAULT_RETRY_AFTER_SECONDS
+    return min(max(math.ceil(wait_seconds), 1), ADMISSION_MAX_RETRY_AFTER_SECONDS)
+
+
+def _client_id(request: Request) -> str:
+    if ADMISSION_CLIENT_ID_HEADER:
+        value = request.headers.get(ADMISSION_CLIENT_ID_HEADER, "")
+        # X-Forwarded-For style headers: the first entry is the client
+        if value.split(",")[0].strip():
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def is_priority_request(request: Request) -> bool:
+    token = request.headers.get(ADMISSION_PRIORITY_HEADER)
+    return bool(token) and any(
+        hmac.compare_digest(token, priority_token)
+        for priority_token in ADMISSION_PRIORITY_TOKENS
+    )
+
+
+def _consume_client_quota(client: str) -> tuple:
+    """Counts a request against the client's quota window; returns (count, ttl)."""
+    key = f"{ADMISSION_QUOTA_KEY_PREFIX}{client}"
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.set(key, 0, ex=ADMISSION_CLIENT_QUOTA_WINDOW_SECONDS, nx=True)
+    pipe.incr(key)
+    pipe.ttl(key)
+    _, count, ttl = pipe.execute()
+    return count, ttl
+
+
+def _count_decision(lane: str, result: str) -> None:
+    LAB_ADMISSIONS.labels(lane=lane, result=result).inc()
+    try:
+        get_redis().hincrby(ADMISSION_DECISIONS_KEY, f"{lane}:{result}", 1)
+    except redis.RedisError:
+        pass
+
+
+def _reject(
+    lane: str, result: str, status_code: int, retry_after: int, detail: str
+) -> None:
+    _count_decision(lane, result)
+    raise HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def admit_lab_request(db: Session, request: Request) -> dict:
+    """
+    Decides whether a lab creation request is admitted. Returns the lane, the
+    Celery priority to enqueue the provision with and the estimated wait.
+
+    Raises:
+        HTTPException: 429 when the client used up its quota, 503 when the
+            queue is full or no node has capacity; both with Retry-After
+    """
+    priority = is_priority_request(request)
+    lane = "priority" if priority else "standard"
+    try:
+        state = get_admission_state(db)
+    except SQLAlchemyError as e:
+        # Admission control never takes lab creation down with it
+        logger.warning(f"Admission state unavailable, admitting: {e}")
+        db.rollback()
+        state = {"queued": 0, "free_slots": None, "throughput_per_second": None}
+    throughput = state["throughput_per_second"]
+
+    limit = (
+        ADMISSION_PRIORITY_MAX_QUEUED_PROVISIONS
+        if priority
+        else ADMISSION_MAX_QUEUED_PROVISIONS
+    )
+    if limit and state["queued"] >= limit:
+        _reject(
+            lane,
+            "queue_full",
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            _retry_after(
+                estimate_wait_seconds(state["queued"] - limit + 1, throughput)
+            ),
+            f"Too many labs waiting to be provisioned ({state['queued']}).",
+        )
+    if not priority and state["free_slots"] == 0:
+        _reject(
+            lane,
+            "no_capacity",
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            ADMISSION_DEFAULT_RETRY_AFTER_SECONDS,
+            "No worker node has capacity for another lab.",
+        )
+
+    # Checked last, so requests rejected for capacity do not use up quota
+    if not priority and ADMISSION_CLIENT_QUOTA:
+        try:
+            count, ttl = _consume_client_quota(_client_id(request))
+        except redis.RedisError as e:
+            logger.warning(f"Client quotas unavailable: {e}")
+            count, ttl = 0, 0
+        if count > ADMISSION_CLIENT_QUOTA:
+            _reject(
+                lane,
+                "quota",
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                max(ttl, 1),
+                f"Lab creation quota of {ADMISSION_CLIENT_QUOTA} per "
+                f"{ADMISSION_CLIENT_QUOTA_WINDOW_SECONDS}s exceeded.",
+            )
+
+    wait = estimate_wait_seconds(state["queued"], throughput)
+    # Count this provision until the next read, so a burst cannot overshoot
+    with _state_lock:
+        state["queued"] += 1
+        if state["free_slots"]:
+            state["free_slots"] -= 1
+    _count_decision(lane, "admitted")
+    return {
+        "lane": lane,
+        "priority": (
+            PRIORITY_PROVISION_TASK_PRIORITY if priority else PROVISION_TASK_PRIORITY
+        ),
+        "estimated_wait_seconds": wait,
+    }
+
+
+def get_admission_stats(db: Session) -> dict:
+    """Admission state, limits and decision counts (all API processes)."""
+    state = get_admission_state(db)
+    decisions = {
+        field: int(count)
+        for field, count in get_redis().hgetall(ADMISSION_DECISIONS_KEY).items()
+    }
+    throughput = state["throughput_per_second"]
+    return {
+        "queued": state["queued"],
+        "free_slots": state["free_slots"],
+        "throughput_per_minute": throughput * 60 if throughput is not None else None,
+        "estimated_wait_seconds": estimate_wait_seconds(state["queued"], throughput),
+        "max_queued": ADMISSION_MAX_QUEUED_PROVISIONS,
+        "priority_max_queued": ADMISSION_PRIORITY_MAX_QUEUED_PROVISIONS,
+        "client_quota": ADMISSION_CLIENT_QUOTA,
+        "client_quota_window_seconds": ADMISSION_CLIENT_QUOTA_WINDOW_SECONDS,
+        "decisions": decisions,
+        "updated_at": state["updated_at"],
+    }
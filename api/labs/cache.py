@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import json
+import time
+from typing import Optional
+
+import redis
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from redis_client import get_redis
+from config import LAB_LIST_CACHE_ENABLED, LAB_LIST_CACHE_TTL_SECONDS
+from .constants import LABS_VERSION_KEY, LAB_LIST_CACHE_KEY_PREFIX
+from .models import Lab
+
+logger = logging.getLogger(__name__)
+
+_LABS_CHANGED = "labs_changed"
+
+
+def _initial_version() -> int:
+    # Start from a timestamp rather than 0, so ETags handed out before Redis
+    # lost the counter can never match again.
+    return int(time.time() * 1000)
+
+
+def get_labs_version(redis_client: redis.Redis) -> int:
+    version = redis_client.get(LABS_VERSION_KEY)
+    if version is None:
+        redis_client.set(LABS_VERSION_KEY, _initial_version(), nx=True)
+        version = redis_client.get(LABS_VERSION_KEY)
+    return int(version)
+
+
+def bump_labs_version(redis_client: redis.Redis) -> int:
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(LABS_VERSION_KEY, _initial_version(), nx=True)
+    pipe.incr(LABS_VERSION_KEY)
+    return pipe.execute()[-1]
+
+
+def lab_list_etag(version: int) -> str:
+    return f'W/"labs-{version}"'
+
+
+def lab_list_cache_key(version: int, params: dict) -> str:
+    """
+    Cache key of one listing query. `params` must already be normalized
+    (defaults applied); older versions simply stop being read and expire.
+    """
+    digest = hashlib.sha1(
+        json.dumps(params, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{LAB_LIST_CACHE_KEY_PREFIX}{version}:{digest}"
+
+
+def get_cached_lab_list(redis_client: redis.Redis, key: str) -> Optional[str]:
+    """Returns the cached JSON body of a listing, ready to be sent as is."""
+    return redis_client.get(key)
+
+
+def set_cached_lab_list(redis_client: redis.Redis, key: str, body: bytes) -> None:
+    redis_client.set(key, body, ex=LAB_LIST_CACHE_TTL_SECONDS)
+
+
+def mark_labs_changed(db: Session) -> None:
+    """
+    Flags the session so the labs version is bumped once it commits.
+    Needed for bulk updates, which bypass the ORM events below.
+    """
+    db.info[_LABS_CHANGED] = True
+
+
+@event.listens_for(Lab, "after_insert")
+@event.listens_for(Lab, "after_update")
+@event.listens_for(Lab, "after_delete")
+def _on_lab_changed(mapper, connection, target):
+    db = object_session(target)
+    if db is not None:
+        mark_labs_changed(db)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_version_after_commit(db: Session):
+    # Bump only once the change is visible to other sessions, so a listing
+    # cached under the new version can never hold the old rows.
+    if not db.info.pop(_LABS_CHANGED, False) or not LAB_LIST_CACHE_ENABLED:
+        return
+    try:
+        bump_labs_version(get_redis())
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump the labs version: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_changes_after_rollback(db: Session):
+    db.info.pop(_LABS_CHANGED, None)
@@ -0,0 +1,155 @@
+import os
+import logging
+import time
+import signal
+import asyncio
+import subprocess
+from typing import Awaitable, Iterable, List, Optional, TypeVar
+
+import redis
+
+from redis_client import get_redis
+from config import LAB_CANCEL_FLAG_TTL_SECONDS, LAB_CANCEL_POLL_INTERVAL_SECONDS
+from labs.constants import LAB_CANCEL_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LabCancelled(Exception):
+    """Raised inside a provision once its lab was asked to be cancelled."""
+
+    def __init__(self, uid: str):
+        super().__init__(f"Lab {uid} was cancelled.")
+        self.uid = uid
+
+
+def _cancel_key(uid: str) -> str:
+    return f"{LAB_CANCEL_KEY_PREFIX}{uid}"
+
+
+def request_lab_cancellation(uids: Iterable[str]) -> float:
+    """
+    Flags labs as cancelled; their provisions stop at the next check. The flag
+    holds the time of the request, to measure how long stopping takes.
+    """
+    requested_at = time.time()
+    pipe = get_redis().pipeline(transaction=False)
+    for uid in uids:
+        pipe.set(_cancel_key(uid), requested_at, ex=LAB_CANCEL_FLAG_TTL_SECONDS)
+    pipe.execute()
+    return requested_at
+
+
+def cancellation_requested_at(uid: str) -> Optional[float]:
+    """When the lab was asked to be cancelled, or None. Fails open."""
+    try:
+        value = get_redis().get(_cancel_key(uid))
+    except redis.RedisError as e:
+        logger.warning(f"Could not check cancellation of lab {uid}: {e}")
+        return None
+    return float(value) if value is not None else None
+
+
+def raise_if_cancelled(uid: Optional[str]) -> None:
+    if uid is not None and cancellation_requested_at(uid) is not None:
+        raise LabCancelled(uid)
+
+
+def clear_lab_cancellation(uid: str) -> None:
+    try:
+        get_redis().delete(_cancel_key(uid))
+    except redis.RedisError as e:
+        logger.warning(f"Could not clear cancellation of lab {uid}: {e}")
+
+
+def _kill_group(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_cancellable_process(
+    command: List[str],
+    uid: Optional[str],
+    timeout: float,
+    cwd: Optional[str] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Like `subprocess.run(..., capture_output=True, text=True, check=True)`,
+    but checks the lab's cancellation flag while the command runs and kills
+    the command as soon as it is set. Without `uid` it simply runs.
+
+    Raises:
+        LabCancelled: When the lab was cancelled meanwhile
+        subprocess.CalledProcessError / subprocess.TimeoutExpired: As `run`
+    """
+    if uid is None:
+        return subprocess.run(
+            command,
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=timeout,
+        )
+
+    deadline = time.monotonic() + timeout
+    with subprocess.Popen(
+        command,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        # Own process group, so killing it also stops e.g. the compose plugin
+        start_new_session=True,
+    ) as process:
+        while True:
+            try:
+                stdout, stderr = process.communicate(
+                    timeout=min(
+                        LAB_CANCEL_POLL_INTERVAL_SECONDS,
+                        max(deadline - time.monotonic(), 0),
+                    )
+                )
+                break
+            except subprocess.TimeoutExpired:
+                if cancellation_requested_at(uid) is not None:
+                    _kill_group(process)
+                    process.communicate()
+                    raise LabCancelled(uid)
+                if time.monotonic() >= deadline:
+                    _kill_group(process)
+                    stdout, stderr = process.communicate()
+                    raise subprocess.TimeoutExpired(
+                        command, timeout, output=stdout, stderr=stderr
+                    )
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(
+            process.returncode, command, output=stdout, stderr=stderr
+        )
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+async def run_cancellable(awaitable: Awaitable[T], uid: str) -> T:
+    """
+    Awaits `awaitable` (e.g. a download) while checking the lab's cancellation
+    flag; when it is set, the work is cancelled and LabCancelled raised.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=LAB_CANCEL_POLL_INTERVAL_SECONDS
+            )
+            if done:
+                return task.result()
+            if cancellation_requested_at(uid) is not None:
+                raise LabCancelled(uid)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,182 @@
+import re
+import time
+import asyncio
+import logging
+import hashlib
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from config import TEMPLATE_CATALOG_REVALIDATE_SECONDS
+from labs.schemas import TemplateResponse
+from labs.utils import fetch_template_index_content, parse_template_index
+
+logger = logging.getLogger(__name__)
+
+_token_re = re.compile(r"[a-z0-9]+")
+
+# Weight of a query term found in each field, used to rank the results
+FIELD_WEIGHTS = {"name": 4, "title": 3, "category": 2, "description": 1}
+
+
+def tokenize(text: str) -> List[str]:
+    return _token_re.findall(text.lower())
+
+
+class TemplateCatalog:
+    """
+    Inverted index over the templates of one version of the templates index.
+    Built once per version; lookups only touch the postings of the query terms.
+    """
+
+    def __init__(self, version: str, templates_data: list):
+        self.version = version
+        self.templates: List[TemplateResponse] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._by_category: Dict[str, List[int]] = {}
+        self._by_name: Dict[str, int] = {}
+
+        for template_info in templates_data:
+            if not isinstance(template_info, dict) or "name" not in template_info:
+                logger.warning(
+                    f"Skipping malformed template entry in index: {template_info}"
+                )
+                continue
+
+            doc_id = len(self.templates)
+            template = TemplateResponse(
+                name=template_info["name"],
+                title=template_info.get("title", template_info["name"]),
+                description=template_info.get("description")
+                or f"Template for {template_info['name']}",
+                logo=template_info.get("logo", "default_icon.png"),
+                category=template_info.get("category", ""),
+            )
+            self.templates.append(template)
+            self._by_name[template.name] = doc_id
+            self._by_category.setdefault(template.category.lower(), []).append(doc_id)
+
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in set(tokenize(getattr(template, field))):
+                    postings = self._postings.setdefault(token, {})
+                    postings[doc_id] = postings.get(doc_id, 0) + weight
+
+        # Sorted vocabulary, so the last query term can be matched as a prefix
+        self._vocabulary = sorted(self._postings)
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def get(self, name: str) -> Optional[TemplateResponse]:
+        doc_id = self._by_name.get(name)
+        return self.templates[doc_id] if doc_id is not None else None
+
+    def _prefix_postings(self, prefix: str) -> Dict[int, int]:
+        scores: Dict[int, int] = {}
+        start = bisect_left(self._vocabulary, prefix)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            for doc_id, weight in self._postings[token].items():
+                scores[doc_id] = max(scores.get(doc_id, 0), weight)
+        return scores
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        category: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[int, List[TemplateResponse]]:
+        """
+        Returns (total matches, page of templates).
+        Every query term must match (the last one as a prefix, for
+        search-as-you-type); results are ranked by field weight, then name.
+        Without a query, the templates keep the order of the index file.
+        """
+        terms = tokenize(query or "")
+        doc_ids: Optional[List[int]] = None
+
+        if terms:
+            scores: Optional[Dict[int, int]] = None
+            for position, term in enumerate(terms):
+                if position == len(terms) - 1:
+                    postings = self._prefix_postings(term)
+                else:
+                    postings = self._postings.get(term, {})
+                if scores is None:
+                    scores = dict(postings)
+                else:
+                    scores = {
+                        doc_id: score + postings[doc_id]
+                        for doc_id, score in scores.items()
+                        if doc_id in postings
+                    }
+                if not scores:
+                    break
+            doc_ids = sorted(
+                scores,
+                key=lambda doc_id: (-scores[doc_id], self.templates[doc_id].name),
+            )
+
+        if category is not None:
+            in_category = self._by_category.get(category.lower(), [])
+            if doc_ids is None:
+                doc_ids = in_category
+            else:
+                allowed = set(in_category)
+                doc_ids = [doc_id for doc_id in doc_ids if doc_id in allowed]
+
+        if doc_ids is None:
+            matches = self.templates
+        else:
+            matches = [self.templates[doc_id] for doc_id in doc_ids]
+
+        end = None if limit is None else offset + limit
+        return len(matches), matches[offset:end]
+
+
+_catalog: Optional[TemplateCatalog] = None
+_catalog_checked_at = 0.0
+_refresh_task: Optional[asyncio.Task] = None
+
+
+async def _refresh_catalog() -> None:
+    """
+    Fetches the templates index. It is only re-parsed and re-indexed when its
+    content changed.
+    """
+    global _catalog, _catalog_checked_at
+
+    index_content = await fetch_template_index_content()
+    version = hashlib.sha1(index_content.encode("utf-8")).hexdigest()
+    if _catalog is None or _catalog.version != version:
+        _catalog = TemplateCatalog(version, parse_template_index(index_content))
+    _catalog_checked_at = time.monotonic()
+
+
+def _log_refresh_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Could not refresh the template catalog: {task.exception()}")
+
+
+def _start_refresh() -> asyncio.Task:
+    # A single refresh at a time, however many requests find the catalog stale
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_catalog())
+        _refresh_task.add_done_callback(_log_refresh_failure)
+    return _refresh_task
+
+
+async def get_template_catalog() -> TemplateCatalog:
+    """
+    Returns the catalog of the current templates index.
+    Only the first call waits for GitHub. Afterwards the cached catalog is
+    served, and once it is older than TEMPLATE_CATALOG_REVALIDATE_SECONDS the
+    index is re-fetched (conditionally) in the background.
+    """
+    if _catalog is None:
+        await _start_refresh()
+    elif time.monotonic() - _catalog_checked_at >= TEMPLATE_CATALOG_REVALIDATE_SECONDS:
+        _start_refresh()
+    return _catalog
@@ -4,4 +4,65 @@ GITHUB_REPO_OWNER = "crackedngineer"
 GITHUB_REPO_NAME = "vLEM"
 GITHUB_BRANCH = "master"
 GITHUB_TEMPLATES_INDEX_FILE = "templates/metadata.json"
-GITHUB_TEMPLATES_BASE_PATH = "templates"
\ No newline at end of file
+GITHUB_TEMPLATES_BASE_PATH = "templates"
+
+# Docker Compose labels every container with its project name; labs are
+# started with the lab uid as project name ("<template>-<12 hex chars>").
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+LAB_UID_PATTERN = r"^[a-z0-9][a-z0-9_.-]*-[0-9a-f]{12}$"
+
+# Redis keys for the per-lab resource sampler
+LAB_METRICS_KEY_PREFIX = "vlem:metrics:lab:"
+HOST_METRICS_KEY = "vlem:metrics:hosts"
+# Last time each lab was seen active (sorted set, scored by timestamp)
+LAB_ACTIVITY_KEY = "vlem:metrics:activity"
+
+# Redis keys for the lab listing cache. The version is bumped whenever a lab
+# is inserted or changes, and cached listings are keyed by it.
+LABS_VERSION_KEY = "vlem:labs:version"
+LAB_LIST_CACHE_KEY_PREFIX = "vlem:labs:list:"
+
+# Columns selected by the lab listing, in the order of LabResponse's fields
+LAB_LIST_COLUMNS = ("uid", "name", "description", "status", "expires_at")
+
+# Redis keys of the template sync task (state shown by the admin endpoint)
+TEMPLATE_SYNC_STATE_KEY = "vlem:templates:sync"
+TEMPLATE_SYNC_LOCK_KEY = "vlem:templates:sync:lock"
+
+# Redis keys of the GitHub fetcher (response cache, shared rate limit budget)
+GITHUB_CACHE_KEY_PREFIX = "vlem:github:cache:"
+GITHUB_RATE_LIMIT_BUCKET_KEY = "vlem:github:bucket"
+GITHUB_RATE_LIMIT_BLOCKED_UNTIL_KEY = "vlem:github:blocked_until"
+
+# Redis Streams of lab progress events
+LAB_EVENTS_STREAM_KEY = "vlem:events:labs"
+LAB_EVENTS_STREAM_KEY_PREFIX = "vlem:events:lab:"
+
+# Redis keys of the placement scheduler (node heartbeats, placements since
+# each node's last heartbeat) and the prefix of the per-node Celery queues
+NODES_KEY = "vlem:nodes"
+NODE_RESERVATIONS_KEY = "vlem:nodes:reserved"
+NODE_QUEUE_PREFIX = "node."
+
+# Redis hashes of the disk accounting: size and last use of every lab
+# directory and cached template entry ("<node>|<kind>|<name>"), and the
+# filesystem usage last seen on each node
+DISK_INDEX_KEY = "vlem:disk:index"
+DISK_FILESYSTEMS_KEY = "vlem:disk:filesystems"
+
+# Redis keys of the admission control: per-client quota counters, provisions
+# finished per minute (throughput) and admission decision counts
+ADMISSION_QUOTA_KEY_PREFIX = "vlem:admission:quota:"
+ADMISSION_FINISHED_KEY_PREFIX = "vlem:admission:finished:"
+ADMISSION_DECISIONS_KEY = "vlem:admission:decisions"
+
+# Celery (Redis broker) priorities of provisions: lower runs first
+PROVISION_TASK_PRIORITY = 6
+PRIORITY_PROVISION_TASK_PRIORITY = 0
+
+# Redis keys flagging labs whose provision was asked to be cancelled
+LAB_CANCEL_KEY_PREFIX = "vlem:cancel:lab:"
+
+# Redis sorted set of captured profiles by duration, and their summaries
+PROFILE_INDEX_KEY = "vlem:profiles:index"
+PROFILE_SUMMARIES_KEY = "vlem:profiles:summaries"
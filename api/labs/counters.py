@@ -0,0 +1,94 @@
+from typing import Dict, Tuple
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .models import Lab, LabCounter
+
+_insert_by_dialect = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+
+def _apply_counter_deltas(
+    connection: Connection, deltas: Dict[Tuple[str, str], int]
+) -> None:
+    """Upserts `count += delta` for each (template_name, status)."""
+    table = LabCounter.__table__
+    insert = _insert_by_dialect.get(connection.dialect.name)
+    for (template_name, status), delta in deltas.items():
+        if not delta:
+            continue
+        if insert is not None:
+            statement = insert(table).values(
+                template_name=template_name, status=status, count=delta
+            )
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[table.c.template_name, table.c.status],
+                    set_={"count": table.c.count + delta},
+                )
+            )
+            continue
+
+        # Other dialects: update, then insert if the row does not exist yet
+        result = connection.execute(
+            table.update()
+            .where(table.c.template_name == template_name)
+            .where(table.c.status == status)
+            .values(count=table.c.count + delta)
+        )
+        if result.rowcount == 0:
+            connection.execute(
+                table.insert().values(
+                    template_name=template_name, status=status, count=delta
+                )
+            )
+
+
+@event.listens_for(Lab, "after_insert")
+def _count_inserted_lab(mapper, connection, target):
+    _apply_counter_deltas(connection, {(target.name, target.status): 1})
+
+
+@event.listens_for(Lab, "after_update")
+def _count_status_transition(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.has_changes() or not history.deleted:
+        return
+    # The counters run in the same transaction as the transition itself
+    _apply_counter_deltas(
+        connection,
+        {
+            (target.name, history.deleted[0]): -1,
+            (target.name, target.status): 1,
+        },
+    )
+
+
+@event.listens_for(Lab, "after_delete")
+def _count_deleted_lab(mapper, connection, target):
+    _apply_counter_deltas(connection, {(target.name, target.status): -1})
+
+
+def rebuild_lab_counters(db: Session) -> None:
+    """
+    Recomputes every counter from the 'labs' table, e.g. after rows were
+    written in bulk (bulk statements bypass the ORM events above).
+    """
+    db.query(LabCounter).delete(synchronize_session=False)
+    rows = (
+        db.query(Lab.name, Lab.status, func.count())
+        .group_by(Lab.name, Lab.status)
+        .all()
+    )
+    if rows:
+        db.execute(
+            LabCounter.__table__.insert(),
+            [
+                {"template_name": name, "status": status, "count": count}
+                for name, status, count in rows
+            ],
+        )
+    db.commit()
@@ -0,0 +1,177 @@
+import os
+import logging
+import json
+import time
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from redis_client import get_redis
+from config import (
+    DISK_HIGH_WATERMARK_PERCENT,
+    DISK_LOW_WATERMARK_PERCENT,
+    LABS_DATA_DIR,
+    NODE_NAME,
+)
+from labs.enum import DISK_USAGE_KIND
+from labs.constants import DISK_INDEX_KEY, DISK_FILESYSTEMS_KEY
+
+logger = logging.getLogger(__name__)
+
+
+def directory_size(path: Path) -> int:
+    """Bytes allocated on disk for a directory tree (like `du`), without following links."""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+            total += getattr(stat, "st_blocks", 0) * 512 or stat.st_size
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(Path(entry.path))
+        except OSError:
+            continue
+    return total
+
+
+def _field(kind: DISK_USAGE_KIND, name: str, node: str) -> str:
+    return f"{node}|{kind.value}|{name}"
+
+
+def record_disk_usage(
+    kind: DISK_USAGE_KIND,
+    name: str,
+    path: Path,
+    size_bytes: Optional[int] = None,
+    node: str = NODE_NAME,
+) -> int:
+    """
+    Sizes one entry (a lab directory, a cached template, ...) and stores it in
+    the disk index as just used. Only that entry's directory is walked, never
+    the whole data directory. Returns the size.
+    """
+    size_bytes = directory_size(path) if size_bytes is None else size_bytes
+    entry = {"bytes": size_bytes, "path": str(path), "last_used": time.time()}
+    try:
+        get_redis().hset(DISK_INDEX_KEY, _field(kind, name, node), json.dumps(entry))
+    except redis.RedisError as e:
+        logger.warning(f"Could not record disk usage of {kind.value} '{name}': {e}")
+    return size_bytes
+
+
+def touch_disk_usage(kind: DISK_USAGE_KIND, name: str, node: str = NODE_NAME) -> None:
+    """Marks an indexed entry as just used, for LRU eviction."""
+    field = _field(kind, name, node)
+    try:
+        redis_client = get_redis()
+        payload = redis_client.hget(DISK_INDEX_KEY, field)
+        if payload is None:
+            return
+        entry = json.loads(payload)
+        entry["last_used"] = time.time()
+        redis_client.hset(DISK_INDEX_KEY, field, json.dumps(entry))
+    except redis.RedisError as e:
+        logger.warning(f"Could not touch disk usage of {kind.value} '{name}': {e}")
+
+
+def forget_disk_usage(kind: DISK_USAGE_KIND, name: str, node: str = NODE_NAME) -> None:
+    try:
+        get_redis().hdel(DISK_INDEX_KEY, _field(kind, name, node))
+    except redis.RedisError as e:
+        logger.warning(f"Could not forget disk usage of {kind.value} '{name}': {e}")
+
+
+def forget_disk_usage_entries(
+    keys: List[Tuple[DISK_USAGE_KIND, str]], node: str = NODE_NAME
+) -> None:
+    if keys:
+        get_redis().hdel(
+            DISK_INDEX_KEY, *(_field(kind, name, node) for kind, name in keys)
+        )
+
+
+def replace_disk_usage(
+    kind: DISK_USAGE_KIND, paths: Dict[str, Path], node: str = NODE_NAME
+) -> None:
+    """Replaces every indexed entry of `kind` with the directories in `paths`."""
+    try:
+        forget_disk_usage_entries(
+            [key for key in list_node_disk_entries(node) if key[0] == kind], node
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Could not reset disk usage of {kind.value} entries: {e}")
+    for name, path in paths.items():
+        record_disk_usage(kind, name, path, node=node)
+
+
+def list_node_disk_entries(node: str) -> Dict[Tuple[DISK_USAGE_KIND, str], dict]:
+    """Indexed entries of a node by (kind, name): bytes, path and last use."""
+    entries = {}
+    for field, payload in get_redis().hgetall(DISK_INDEX_KEY).items():
+        entry_node, kind, name = field.split("|", 2)
+        if entry_node == node:
+            entries[(DISK_USAGE_KIND(kind), name)] = json.loads(payload)
+    return entries
+
+
+def filesystem_usage(path: Path = LABS_DATA_DIR) -> dict:
+    usage = shutil.disk_usage(path if path.exists() else path.anchor)
+    return {
+        "total_bytes": usage.total,
+        "used_bytes": usage.used,
+        "free_bytes": usage.free,
+        "used_percent": usage.used / usage.total * 100 if usage.total else 0.0,
+    }
+
+
+def publish_filesystem_usage(node: str = NODE_NAME) -> dict:
+    usage = {**filesystem_usage(), "updated_at": time.time()}
+    get_redis().hset(DISK_FILESYSTEMS_KEY, node, json.dumps(usage))
+    return usage
+
+
+def get_disk_usage(limit: int = 50) -> List[dict]:
+    """
+    Disk usage of every node from the index: totals per kind, the filesystem
+    usage last published, and its largest `limit` entries.
+    """
+    redis_client = get_redis()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(DISK_INDEX_KEY)
+    pipe.hgetall(DISK_FILESYSTEMS_KEY)
+    index, filesystems = pipe.execute()
+
+    nodes: Dict[str, dict] = {}
+    for field, payload in index.items():
+        node, kind, name = field.split("|", 2)
+        entry = json.loads(payload)
+        usage = nodes.setdefault(
+            node, {"node": node, "total_bytes": 0, "by_kind": {}, "entries": []}
+        )
+        usage["total_bytes"] += entry["bytes"]
+        usage["by_kind"][kind] = usage["by_kind"].get(kind, 0) + entry["bytes"]
+        usage["entries"].append(
+            {
+                "kind": kind,
+                "name": name,
+                "bytes": entry["bytes"],
+                "last_used": entry["last_used"],
+            }
+        )
+    for node, payload in filesystems.items():
+        nodes.setdefault(
+            node, {"node": node, "total_bytes": 0, "by_kind": {}, "entries": []}
+        )["filesystem"] = json.loads(payload)
+
+    for usage in nodes.values():
+        usage["entries"] = sorted(
+            usage["entries"], key=lambda entry: entry["bytes"], reverse=True
+        )[:limit]
+        usage["high_watermark_percent"] = DISK_HIGH_WATERMARK_PERCENT
+        usage["low_watermark_percent"] = DISK_LOW_WATERMARK_PERCENT
+    return [nodes[node] for node in sorted(nodes)]
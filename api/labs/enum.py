@@ -13,7 +13,33 @@ class LAB_BUILD_STATUS(str, Enum):
     BUILDING = "building"
     COMPLETED = "completed"
     FAILED = "failed"
+    EXPIRED = "expired"
+    RESETTING = "resetting"
+    CANCELLED = "cancelled"
 
 class LAB_TASK_TYPE(str, Enum):
     PROVISION = "provision"
-    CONTROL = "control"
\ No newline at end of file
+    CONTROL = "control"
+    TEARDOWN = "teardown"
+    RESET = "reset"
+
+class PROVISION_STAGE(str, Enum):
+    QUEUE_WAIT = "queue_wait"
+    TEMPLATE_DOWNLOAD = "template_download"
+    COMPOSE_VALIDATION = "compose_validation"
+    BUILD = "build"
+    START = "start"
+    SNAPSHOT = "snapshot"
+    RESET = "reset"
+
+class LAB_EVENT_TYPE(str, Enum):
+    BUILD_STARTED = "build_started"
+    STAGE_STARTED = "stage_started"
+    STAGE_FINISHED = "stage_finished"
+    BUILD_FINISHED = "build_finished"
+
+class DISK_USAGE_KIND(str, Enum):
+    LAB = "lab"
+    SNAPSHOT = "snapshot"
+    TEMPLATE = "template"
+    BUILD_CACHE = "build_cache"
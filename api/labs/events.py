@@ -0,0 +1,139 @@
+import time
+import logging
+from typing import Dict, List, Optional
+
+import redis
+
+from redis_client import get_redis
+from config import (
+    LAB_EVENTS_ENABLED,
+    LAB_EVENTS_STREAM_MAXLEN,
+    LAB_EVENTS_GLOBAL_STREAM_MAXLEN,
+    LAB_EVENTS_STREAM_TTL_SECONDS,
+)
+from labs.enum import LAB_EVENT_TYPE, PROVISION_STAGE
+from labs.constants import LAB_EVENTS_STREAM_KEY, LAB_EVENTS_STREAM_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Overall provisioning progress (percent) when each stage starts and ends.
+# The build dominates the duration of a provision.
+STAGE_PROGRESS = {
+    PROVISION_STAGE.QUEUE_WAIT: (0, 5),
+    PROVISION_STAGE.TEMPLATE_DOWNLOAD: (5, 20),
+    PROVISION_STAGE.COMPOSE_VALIDATION: (20, 25),
+    PROVISION_STAGE.BUILD: (25, 85),
+    PROVISION_STAGE.START: (85, 95),
+    PROVISION_STAGE.SNAPSHOT: (95, 100),
+    # A reset is a run of its own
+    PROVISION_STAGE.RESET: (0, 100),
+}
+
+_INT_FIELDS = ("percent", "bytes")
+_FLOAT_FIELDS = ("ts", "duration_seconds")
+
+
+def lab_events_stream_key(uid: str) -> str:
+    return f"{LAB_EVENTS_STREAM_KEY_PREFIX}{uid}"
+
+
+def publish_lab_event(uid: str, event: LAB_EVENT_TYPE, **fields) -> Optional[str]:
+    """
+    Appends a progress event to the lab's stream and to the global stream,
+    both capped (approximately) at their max length.
+    Fields that are None are left out. Returns the ID of the event in the lab's
+    stream, or None if events are disabled or Redis is unavailable: progress
+    reporting never fails the task that reports it.
+    """
+    if not LAB_EVENTS_ENABLED:
+        return None
+
+    entry = {"uid": uid, "event": event.value, "ts": time.time()}
+    entry.update({key: value for key, value in fields.items() if value is not None})
+
+    stream_key = lab_events_stream_key(uid)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.xadd(stream_key, entry, maxlen=LAB_EVENTS_STREAM_MAXLEN, approximate=True)
+        pipe.expire(stream_key, LAB_EVENTS_STREAM_TTL_SECONDS)
+        pipe.xadd(
+            LAB_EVENTS_STREAM_KEY,
+            entry,
+            maxlen=LAB_EVENTS_GLOBAL_STREAM_MAXLEN,
+            approximate=True,
+        )
+        return pipe.execute()[0]
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish '{event.value}' event for lab {uid}: {e}")
+        return None
+
+
+def _decode_event(event_id: str, entry: Dict[str, str]) -> dict:
+    event = {"id": event_id, **entry}
+    for field in _INT_FIELDS:
+        if field in event:
+            event[field] = int(event[field])
+    for field in _FLOAT_FIELDS:
+        if field in event:
+            event[field] = float(event[field])
+    return event
+
+
+def get_lab_events(
+    uid: str, after: Optional[str] = None, limit: int = 100
+) -> List[dict]:
+    """
+    Returns the events of a lab in order, starting after the event ID `after`
+    (exclusive), so clients can poll with the ID of the last event they saw.
+    """
+    start = f"({after}" if after else "-"
+    return [
+        _decode_event(event_id, entry)
+        for event_id, entry in get_redis().xrange(
+            lab_events_stream_key(uid), min=start, count=limit
+        )
+    ]
+
+
+def ensure_consumer_group(
+    group: str, stream: str = LAB_EVENTS_STREAM_KEY, start_id: str = "$"
+) -> None:
+    """
+    Creates a consumer group on an event stream (and the stream, if missing).
+    By default the group only receives events published from now on.
+    """
+    try:
+        get_redis().xgroup_create(stream, group, id=start_id, mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def read_lab_events(
+    group: str,
+    consumer: str,
+    stream: str = LAB_EVENTS_STREAM_KEY,
+    count: int = 100,
+    block_ms: Optional[int] = None,
+) -> List[dict]:
+    """
+    Reads events not yet delivered to any consumer of `group`. Events stay
+    pending until acknowledged with `ack_lab_events`, so a consumer that
+    crashes does not lose them.
+    """
+    response = get_redis().xreadgroup(
+        group, consumer, {stream: ">"}, count=count, block=block_ms
+    )
+    return [
+        _decode_event(event_id, entry)
+        for _, entries in response or []
+        for event_id, entry in entries
+    ]
+
+
+def ack_lab_events(
+    group: str, event_ids: List[str], stream: str = LAB_EVENTS_STREAM_KEY
+) -> int:
+    if not event_ids:
+        return 0
+    return get_redis().xack(stream, group, *event_ids)
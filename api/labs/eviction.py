@@ -0,0 +1,162 @@
+import os
+import logging
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import redis
+from sqlalchemy.orm import Session
+
+from config import (
+    BUILD_CACHE_DIR,
+    DISK_HIGH_WATERMARK_PERCENT,
+    DISK_LOW_WATERMARK_PERCENT,
+    LAB_SNAPSHOT_DIR,
+    LABS_DATA_DIR,
+    NODE_NAME,
+)
+from instrumentation import DISK_EVICTIONS
+from labs.enum import DISK_USAGE_KIND, LAB_BUILD_STATUS
+from labs.models import Lab
+from labs.prefetch import get_stored_template_dir, list_stored_templates
+from labs.images import build_cache_lock
+from labs.disk import (
+    filesystem_usage,
+    forget_disk_usage,
+    forget_disk_usage_entries,
+    list_node_disk_entries,
+    record_disk_usage,
+)
+from labs.constants import LAB_UID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Cached data that can be fetched or rebuilt again; lab data never is evicted
+EVICTABLE_KINDS = (DISK_USAGE_KIND.TEMPLATE, DISK_USAGE_KIND.BUILD_CACHE)
+
+_lab_uid_re = re.compile(LAB_UID_PATTERN)
+
+
+def _present_entries() -> Dict[Tuple[DISK_USAGE_KIND, str], Path]:
+    """Entries currently on this node's disk, from a listing of each root only."""
+    present = {}
+    roots = (
+        (DISK_USAGE_KIND.LAB, LABS_DATA_DIR),
+        (DISK_USAGE_KIND.SNAPSHOT, LAB_SNAPSHOT_DIR),
+        (DISK_USAGE_KIND.BUILD_CACHE, BUILD_CACHE_DIR),
+    )
+    for kind, root in roots:
+        try:
+            for entry in os.scandir(root):
+                if entry.is_dir(follow_symlinks=False):
+                    present[(kind, entry.name)] = Path(entry.path)
+        except OSError:
+            continue
+    for template_name in list_stored_templates()[1]:
+        template_dir = get_stored_template_dir(template_name)
+        if template_dir is not None:
+            present[(DISK_USAGE_KIND.TEMPLATE, template_name)] = template_dir
+    return present
+
+
+def refresh_disk_index(node: str = NODE_NAME) -> Dict[str, int]:
+    """
+    Brings the node's disk index in line with its disk: drops entries whose
+    directory is gone and sizes directories missing from the index (all of
+    them, the first time). Entries already indexed are not walked again.
+    """
+    indexed = list_node_disk_entries(node)
+    present = _present_entries()
+    gone = [key for key in indexed if key not in present]
+    added = [key for key in present if key not in indexed]
+
+    forget_disk_usage_entries(gone, node)
+    for kind, name in added:
+        record_disk_usage(kind, name, present[(kind, name)], node=node)
+    return {"removed": len(gone), "added": len(added)}
+
+
+def remove_stale_lab_dirs(db: Session, node: str = NODE_NAME) -> List[str]:
+    """
+    Removes the directories of labs that expired or no longer exist, which a
+    failed teardown can leave behind. One listing and one query.
+    """
+    try:
+        uids = [
+            entry.name
+            for entry in os.scandir(LABS_DATA_DIR)
+            if entry.is_dir(follow_symlinks=False) and _lab_uid_re.match(entry.name)
+        ]
+    except OSError:
+        return []
+    if not uids:
+        return []
+    live = {
+        uid
+        for (uid,) in db.query(Lab.uid).filter(
+            Lab.uid.in_(uids), Lab.status != LAB_BUILD_STATUS.EXPIRED.value
+        )
+    }
+    stale = sorted(uid for uid in uids if uid not in live)
+    for uid in stale:
+        shutil.rmtree(LABS_DATA_DIR / uid, ignore_errors=True)
+        forget_disk_usage(DISK_USAGE_KIND.LAB, uid, node)
+    if stale:
+        logger.info(f"Disk: Removed {len(stale)} stale lab directories on {node}.")
+    return stale
+
+
+def _evict(kind: DISK_USAGE_KIND, path: Path) -> None:
+    if kind == DISK_USAGE_KIND.BUILD_CACHE:
+        # Waits for a build using this cache to finish
+        with build_cache_lock(path):
+            shutil.rmtree(path, ignore_errors=True)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def evict_cached_template_data(
+    node: str = NODE_NAME,
+    high_watermark: float = DISK_HIGH_WATERMARK_PERCENT,
+    low_watermark: float = DISK_LOW_WATERMARK_PERCENT,
+) -> List[dict]:
+    """
+    When the filesystem is above the high watermark, evicts cached templates
+    and build caches, least recently used first, until it is below the low
+    watermark or nothing evictable is left. Evicted templates are downloaded
+    again and evicted build caches rebuilt on their next use.
+    """
+    if filesystem_usage()["used_percent"] < high_watermark:
+        return []
+    candidates = sorted(
+        (
+            (entry["last_used"], kind, name, entry)
+            for (kind, name), entry in list_node_disk_entries(node).items()
+            if kind in EVICTABLE_KINDS
+        ),
+        key=lambda candidate: candidate[0],
+    )
+
+    evicted = []
+    for _, kind, name, entry in candidates:
+        if filesystem_usage()["used_percent"] <= low_watermark:
+            break
+        _evict(kind, Path(entry["path"]))
+        forget_disk_usage(kind, name, node)
+        DISK_EVICTIONS.labels(kind=kind.value).inc()
+        evicted.append({"kind": kind.value, "name": name, "bytes": entry["bytes"]})
+    if evicted:
+        logger.info(
+            f"Disk: Evicted {len(evicted)} cached entries "
+            f"({sum(entry['bytes'] for entry in evicted)} bytes) on {node}."
+        )
+    return evicted
+
+
+def ensure_disk_space() -> None:
+    """Cheap check before provisioning: evicts cached data above the watermark."""
+    try:
+        evict_cached_template_data()
+    except (OSError, redis.RedisError) as e:
+        logger.warning(f"Could not free disk space: {e}")
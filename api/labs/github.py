@@ -0,0 +1,418 @@
+import time
+import logging
+import random
+import asyncio
+import hashlib
+from typing import Dict, Optional
+
+import httpx
+import redis
+
+from redis_client import get_redis
+from config import (
+    GITHUB_TOKEN,
+    GITHUB_RATE_LIMIT_PER_HOUR,
+    GITHUB_RATE_LIMIT_BURST,
+    GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS,
+    GITHUB_MAX_RETRIES,
+    GITHUB_RETRY_BASE_SECONDS,
+    GITHUB_RETRY_MAX_SECONDS,
+    GITHUB_CIRCUIT_FAILURE_THRESHOLD,
+    GITHUB_CIRCUIT_RESET_SECONDS,
+    GITHUB_CACHE_TTL_SECONDS,
+)
+from instrumentation import (
+    GITHUB_FETCH_DURATION,
+    GITHUB_FETCH_BYTES,
+    GITHUB_FETCH_RESULTS,
+)
+from .constants import (
+    GITHUB_API_BASE,
+    GITHUB_CACHE_KEY_PREFIX,
+    GITHUB_RATE_LIMIT_BUCKET_KEY,
+    GITHUB_RATE_LIMIT_BLOCKED_UNTIL_KEY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Takes one token from the shared bucket. Returns 0 when a token was taken,
+# otherwise the number of seconds until one is available.
+_TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], 7200)
+return tostring(wait)
+"""
+
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+# The token is only ever sent to GitHub itself, never to e.g. external logo hosts
+GITHUB_HOSTS = {"api.github.com", "raw.githubusercontent.com", "github.com"}
+
+_github_client: Optional[httpx.AsyncClient] = None
+_github_client_loop: Optional[asyncio.AbstractEventLoop] = None
+# Transport of the client; replaced by the offline benchmarks
+_github_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def get_github_client() -> httpx.AsyncClient:
+    """
+    Returns the shared GitHub client, creating it on first use.
+    Celery tasks run every coroutine in a new event loop (asyncio.run), and
+    pooled connections cannot outlive their loop, so each loop gets its own.
+    """
+    global _github_client, _github_client_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if _github_client is None or (
+        _github_client_loop is not None and _github_client_loop is not loop
+    ):
+        _github_client = httpx.AsyncClient(transport=_github_transport)
+        _github_client_loop = loop
+    return _github_client
+
+
+async def close_github_client() -> None:
+    global _github_client, _github_client_loop
+    if _github_client is not None:
+        await _github_client.aclose()
+        _github_client = None
+        _github_client_loop = None
+
+
+class GitHubUnavailableError(httpx.RequestError):
+    """Raised when GitHub is not called at all: open circuit or no rate limit budget."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures; while open, calls
+    fail fast for `reset_seconds`, then a single trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Gives back a call allowed by `allow` that was never made."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+circuit_breaker = CircuitBreaker(
+    GITHUB_CIRCUIT_FAILURE_THRESHOLD, GITHUB_CIRCUIT_RESET_SECONDS
+)
+# Other hosts (e.g. external logo hosts) each get their own breaker, so one
+# broken host never blocks the calls that need GitHub
+_host_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(host: str) -> CircuitBreaker:
+    if host in GITHUB_HOSTS:
+        return circuit_breaker
+    breaker = _host_breakers.get(host)
+    if breaker is None:
+        breaker = _host_breakers[host] = CircuitBreaker(
+            GITHUB_CIRCUIT_FAILURE_THRESHOLD, GITHUB_CIRCUIT_RESET_SECONDS
+        )
+    return breaker
+
+
+def observe_github_fetch(
+    kind: str, response: Optional[httpx.Response], start: float
+) -> None:
+    """Records latency (and size, on success) of a GitHub request."""
+    status_label = str(response.status_code) if response is not None else "error"
+    GITHUB_FETCH_DURATION.labels(kind=kind, status=status_label).observe(
+        time.perf_counter() - start
+    )
+    if response is not None and response.is_success:
+        GITHUB_FETCH_BYTES.labels(kind=kind).observe(len(response.content))
+
+
+def _counts_against_quota(url: str) -> bool:
+    # Only the REST API is metered; raw.githubusercontent.com is not
+    return url.startswith(GITHUB_API_BASE)
+
+
+def _rate_limit_wait(redis_client: redis.Redis, rate: float, now: float) -> float:
+    """Takes a token from the bucket; returns 0, or how long to wait for one."""
+    blocked_until = float(redis_client.get(GITHUB_RATE_LIMIT_BLOCKED_UNTIL_KEY) or 0)
+    if blocked_until > now:
+        return blocked_until - now
+    return max(
+        float(
+            redis_client.eval(
+                _TAKE_TOKEN_SCRIPT,
+                1,
+                GITHUB_RATE_LIMIT_BUCKET_KEY,
+                rate,
+                GITHUB_RATE_LIMIT_BURST,
+                now,
+            )
+        ),
+        0.0,
+    )
+
+
+async def _acquire_rate_limit_budget(redis_client: redis.Redis) -> None:
+    """
+    Waits for a token of the rate limit bucket shared by every API and worker
+    process, refilled at 90% of GITHUB_RATE_LIMIT_PER_HOUR. Also waits out a
+    quota reset announced by GitHub. Raises GitHubUnavailableError if that
+    would take longer than GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS.
+    """
+    rate = GITHUB_RATE_LIMIT_PER_HOUR * 0.9 / 3600
+    deadline = time.time() + GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS
+    while True:
+        now = time.time()
+        # Redis calls run in a thread, off the event loop of the API
+        wait = await asyncio.to_thread(_rate_limit_wait, redis_client, rate, now)
+        if wait <= 0:
+            return
+        if now + wait > deadline:
+            raise GitHubUnavailableError(
+                f"GitHub rate limit budget exhausted; next request possible in {wait:.0f}s"
+            )
+        await asyncio.sleep(wait)
+
+
+def _record_rate_limit(redis_client: redis.Redis, response: httpx.Response) -> None:
+    remaining = response.headers.get("x-ratelimit-remaining")
+    reset = response.headers.get("x-ratelimit-reset")
+    if remaining == "0" and reset:
+        # Nobody calls the API again until GitHub resets the quota
+        redis_client.set(
+            GITHUB_RATE_LIMIT_BLOCKED_UNTIL_KEY,
+            reset,
+            exat=int(reset) + 1,
+        )
+    if response.status_code == 304:
+        # 304 responses to conditional requests do not count against the quota
+        redis_client.hincrbyfloat(GITHUB_RATE_LIMIT_BUCKET_KEY, "tokens", 1)
+
+
+def _is_rate_limited(response: httpx.Response) -> bool:
+    return response.status_code == 429 or (
+        response.status_code == 403
+        and response.headers.get("x-ratelimit-remaining") == "0"
+    )
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Exponential backoff with full jitter, honouring Retry-After if present."""
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(
+        0, min(GITHUB_RETRY_MAX_SECONDS, GITHUB_RETRY_BASE_SECONDS * 2**attempt)
+    )
+
+
+def _cache_key(url: str, params: Optional[dict]) -> str:
+    request_url = str(httpx.URL(url, params=params))
+    return GITHUB_CACHE_KEY_PREFIX + hashlib.sha1(request_url.encode()).hexdigest()
+
+
+def _cached_response(
+    cached: dict, url: str, params: Optional[dict], source: str
+) -> httpx.Response:
+    return httpx.Response(
+        200,
+        text=cached["body"],
+        headers={
+            "content-type": cached.get("content_type", "text/plain"),
+            "etag": cached.get("etag", ""),
+            "x-vlem-cache": source,
+        },
+        request=httpx.Request("GET", url, params=params),
+    )
+
+
+def _store_response(
+    redis_client: redis.Redis, cache_key: str, response: httpx.Response
+) -> None:
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(
+        cache_key,
+        mapping={
+            "etag": response.headers["etag"],
+            "body": response.text,
+            "content_type": response.headers.get("content-type", "text/plain"),
+        },
+    )
+    pipe.expire(cache_key, GITHUB_CACHE_TTL_SECONDS)
+    pipe.execute()
+
+
+async def github_get(
+    url: str,
+    kind: str,
+    params: Optional[dict] = None,
+    headers: Optional[dict] = None,
+    use_cache: bool = True,
+) -> httpx.Response:
+    """
+    GET a GitHub URL through the shared fetch layer:
+    - authenticates with GITHUB_TOKEN when set,
+    - sends If-None-Match with the ETag of the cached copy, and answers a 304
+      from that copy (without spending rate limit budget),
+    - keeps API requests within a global token bucket and GitHub's reset time,
+    - retries network errors, 5xx and rate limit responses with jittered
+      exponential backoff,
+    - fails fast while the circuit breaker is open,
+    - falls back to the cached copy (even if stale) when all of that fails.
+    Authentication, retries and the GitHub circuit breaker only apply to
+    GITHUB_HOSTS; any other host (e.g. a logo host) is called once, behind a
+    circuit breaker of its own.
+    Redis calls run in a worker thread, so they never block the event loop.
+    Non-retryable error responses (e.g. 404) are returned as is. Callers that
+    keep their own copy (e.g. binary logos) pass `use_cache=False` and their
+    own conditional `headers`.
+    """
+    redis_client = get_redis()
+    cache_key = _cache_key(url, params)
+    cached = {}
+    if use_cache:
+        try:
+            cached = await asyncio.to_thread(redis_client.hgetall, cache_key)
+        except redis.RedisError as e:
+            logger.warning(f"GitHub response cache unavailable: {e}")
+
+    host = httpx.URL(url).host
+    is_github = host in GITHUB_HOSTS
+    breaker = breaker_for(host)
+    max_retries = GITHUB_MAX_RETRIES if is_github else 0
+
+    request_headers = {"Accept-Encoding": "gzip"}
+    if GITHUB_TOKEN and is_github:
+        request_headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    if cached.get("etag"):
+        request_headers["If-None-Match"] = cached["etag"]
+    request_headers.update(headers or {})
+
+    last_error: Optional[Exception] = None
+    for attempt in range(max_retries + 1):
+        if not breaker.allow():
+            last_error = GitHubUnavailableError(
+                f"Circuit breaker for {host} is open after {breaker.failures} consecutive failures"
+            )
+            break
+
+        metered = _counts_against_quota(url)
+        try:
+            if metered:
+                await _acquire_rate_limit_budget(redis_client)
+        except GitHubUnavailableError as e:
+            # GitHub was not called, so this says nothing about its health
+            breaker.release()
+            last_error = e
+            break
+        except redis.RedisError as e:
+            # Without Redis there is no shared budget; go ahead and rely on retries
+            logger.warning(f"GitHub rate limiter unavailable: {e}")
+
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await get_github_client().get(
+                url, params=params, headers=request_headers, follow_redirects=True
+            )
+        except httpx.RequestError as e:
+            last_error = e
+        observe_github_fetch(kind, response, start)
+
+        if response is not None:
+            if metered:
+                try:
+                    await asyncio.to_thread(_record_rate_limit, redis_client, response)
+                except redis.RedisError:
+                    pass
+
+            if response.status_code == 304 and cached:
+                breaker.record_success()
+                GITHUB_FETCH_RESULTS.labels(kind=kind, result="not_modified").inc()
+                return _cached_response(cached, url, params, "revalidated")
+
+            if response.status_code not in RETRY_STATUS_CODES and not _is_rate_limited(
+                response
+            ):
+                breaker.record_success()
+                if response.is_success and use_cache and response.headers.get("etag"):
+                    try:
+                        await asyncio.to_thread(
+                            _store_response, redis_client, cache_key, response
+                        )
+                    except redis.RedisError:
+                        pass
+                GITHUB_FETCH_RESULTS.labels(kind=kind, result="fetched").inc()
+                return response
+
+            last_error = httpx.HTTPStatusError(
+                f"GitHub responded {response.status_code} for {url}",
+                request=response.request,
+                response=response,
+            )
+
+        breaker.record_failure()
+        if attempt < max_retries:
+            delay = _retry_delay(attempt, response)
+            if delay > GITHUB_RETRY_MAX_SECONDS:
+                # e.g. a rate limit reset far in the future: stop retrying
+                break
+            await asyncio.sleep(delay)
+
+    if cached.get("body") is not None:
+        logger.warning(f"Serving cached GitHub content for {url}: {last_error}")
+        GITHUB_FETCH_RESULTS.labels(kind=kind, result="stale").inc()
+        return _cached_response(cached, url, params, "stale")
+
+    GITHUB_FETCH_RESULTS.labels(kind=kind, result="failed").inc()
+    if isinstance(last_error, httpx.HTTPStatusError):
+        return last_error.response
+    raise last_error
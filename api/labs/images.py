@@ -0,0 +1,248 @@
+import json
+import logging
+import fcntl
+import hashlib
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import yaml
+from fastapi import HTTPException, status
+
+from config import (
+    BUILD_CACHE_DIR,
+    BUILDX_BUILDER,
+    TEMPLATE_IMAGE_REPOSITORY,
+    TEMPLATE_IMAGE_BUILD_TIMEOUT_SECONDS,
+)
+from instrumentation import TEMPLATE_IMAGE_BUILDS
+from labs.enum import DISK_USAGE_KIND
+from labs.disk import record_disk_usage, touch_disk_usage
+from labs.cancellation import run_cancellable_process
+
+logger = logging.getLogger(__name__)
+
+# Characters allowed in an image name component
+_TAG_CHARS = set("abcdefghijklmnopqrstuvwxyz0123456789_.-")
+
+
+def _normalize_build(build) -> dict:
+    """The `build:` of a compose service, in its long form."""
+    if isinstance(build, str):
+        return {"context": build}
+    return dict(build or {})
+
+
+def build_context_digest(context_dir: Path, build: dict) -> str:
+    """
+    Content hash of a build: every file of the context (path and bytes) plus
+    the build options. Identical templates hash the same on every node.
+    """
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            {key: build.get(key) for key in ("dockerfile", "args", "target")},
+            sort_keys=True,
+        ).encode()
+    )
+    for path in sorted(context_dir.rglob("*")):
+        if not path.is_file():
+            continue
+        digest.update(path.relative_to(context_dir).as_posix().encode())
+        digest.update(b"\0")
+        digest.update(path.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def template_image_tag(template_name: str, service_name: str, digest: str) -> str:
+    name = "".join(
+        char if char in _TAG_CHARS else "-"
+        for char in f"{template_name}-{service_name}".lower()
+    )
+    return f"{TEMPLATE_IMAGE_REPOSITORY}/{name}:{digest[:16]}"
+
+
+def image_exists(tag: str) -> bool:
+    result = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", tag],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    return result.returncode == 0
+
+
+@lru_cache(maxsize=1)
+def _ensure_builder() -> str:
+    """
+    Returns the buildx builder, creating it on first use. The default `docker`
+    driver cannot export a local cache, so a `docker-container` one is used.
+    """
+    inspect = subprocess.run(
+        ["docker", "buildx", "inspect", BUILDX_BUILDER],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    if inspect.returncode != 0:
+        subprocess.run(
+            [
+                "docker",
+                "buildx",
+                "create",
+                "--name",
+                BUILDX_BUILDER,
+                "--driver",
+                "docker-container",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=60,
+        )
+    return BUILDX_BUILDER
+
+
+@contextmanager
+def build_cache_lock(cache_dir: Path):
+    """
+    Serializes builds sharing a cache directory on this node, so concurrent
+    provisions of a template build its image once and never write the same
+    cache at the same time. Eviction takes it too before removing a cache.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir.with_name(f"{cache_dir.name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_image(
+    tag: str,
+    context_dir: Path,
+    build: dict,
+    cache_dir: Path,
+    cancel_uid: Optional[str] = None,
+) -> None:
+    """
+    Builds and loads an image with BuildKit, reading and updating the layer
+    cache in `cache_dir`, so a changed template only rebuilds changed layers.
+    The build is killed if the lab `cancel_uid` is cancelled meanwhile.
+    """
+    command = [
+        "docker",
+        "buildx",
+        "build",
+        "--builder",
+        _ensure_builder(),
+        "--load",
+        "--tag",
+        tag,
+        "--cache-from",
+        f"type=local,src={cache_dir}",
+        "--cache-to",
+        f"type=local,dest={cache_dir},mode=max",
+    ]
+    if build.get("dockerfile"):
+        command += ["--file", str(context_dir / build["dockerfile"])]
+    if build.get("target"):
+        command += ["--target", build["target"]]
+    args = build.get("args") or {}
+    if isinstance(args, list):
+        args = dict(arg.split("=", 1) for arg in args if "=" in arg)
+    for key, value in args.items():
+        command += ["--build-arg", f"{key}={value}"]
+    command.append(str(context_dir))
+
+    run_cancellable_process(command, cancel_uid, TEMPLATE_IMAGE_BUILD_TIMEOUT_SECONDS)
+
+
+def build_template_images(
+    template_name: str,
+    lab_dir: str,
+    docker_compose_content: str,
+    cache_root: Path = BUILD_CACHE_DIR,
+    cancel_uid: Optional[str] = None,
+) -> tuple:
+    """
+    Builds the image of every service of a template with a local `build:`
+    section, unless an image with the same content hash already exists, and
+    rewrites the lab's compose.yml to use those images instead of building.
+    Returns (new compose content, {"built": n, "cached": n}).
+
+    Raises:
+        HTTPException: When a build fails or times out
+        LabCancelled: When the lab `cancel_uid` was cancelled meanwhile
+    """
+    compose = yaml.safe_load(docker_compose_content) or {}
+    services = compose.get("services") or {}
+    counts = {"built": 0, "cached": 0}
+
+    for service_name, service in services.items():
+        if not isinstance(service, dict) or "build" not in service:
+            continue
+        build = _normalize_build(service["build"])
+        context = build.get("context") or "."
+        if "://" in context or context.startswith("git@"):
+            # Remote contexts are left to `docker compose build`
+            continue
+        context_dir = (Path(lab_dir) / context).resolve()
+
+        tag = template_image_tag(
+            template_name, service_name, build_context_digest(context_dir, build)
+        )
+        cache_dir = cache_root / tag.split("/", 1)[1].split(":", 1)[0]
+        try:
+            with build_cache_lock(cache_dir):
+                if image_exists(tag):
+                    counts["cached"] += 1
+                    touch_disk_usage(DISK_USAGE_KIND.BUILD_CACHE, cache_dir.name)
+                    TEMPLATE_IMAGE_BUILDS.labels(
+                        template=template_name, result="cached"
+                    ).inc()
+                else:
+                    logger.info(f"Task: Building image {tag} for '{template_name}'...")
+                    build_image(tag, context_dir, build, cache_dir, cancel_uid)
+                    record_disk_usage(
+                        DISK_USAGE_KIND.BUILD_CACHE, cache_dir.name, cache_dir
+                    )
+                    counts["built"] += 1
+                    TEMPLATE_IMAGE_BUILDS.labels(
+                        template=template_name, result="built"
+                    ).inc()
+        except subprocess.CalledProcessError as e:
+            TEMPLATE_IMAGE_BUILDS.labels(template=template_name, result="failed").inc()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Build of image {tag} failed with exit code {e.returncode}: {e.stderr}",
+            )
+        except subprocess.TimeoutExpired:
+            TEMPLATE_IMAGE_BUILDS.labels(template=template_name, result="failed").inc()
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=f"Build of image {tag} timed out after {TEMPLATE_IMAGE_BUILD_TIMEOUT_SECONDS} seconds.",
+            )
+
+        service["image"] = tag
+        del service["build"]
+
+    if counts["built"] or counts["cached"]:
+        docker_compose_content = yaml.safe_dump(compose, sort_keys=False)
+        Path(lab_dir, "compose.yml").write_text(
+            docker_compose_content, encoding="utf-8"
+        )
+    return docker_compose_content, counts
+
+
+def needs_compose_build(docker_compose_content: str) -> bool:
+    """Whether any service still has a `build:` section (e.g. a remote context)."""
+    services = (yaml.safe_load(docker_compose_content) or {}).get("services") or {}
+    return any(
+        isinstance(service, dict) and "build" in service
+        for service in services.values()
+    )
@@ -0,0 +1,240 @@
+import os
+import logging
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+import httpx
+from fastapi import HTTPException, status
+
+from config import (
+    LOGO_CACHE_DIR,
+    LOGO_CACHE_MAX_BYTES,
+    LOGO_MAX_BYTES,
+    LOGO_REVALIDATE_SECONDS,
+)
+from .constants import (
+    GITHUB_RAW_BASE,
+    GITHUB_BRANCH,
+    GITHUB_REPO_OWNER,
+    GITHUB_REPO_NAME,
+    GITHUB_TEMPLATES_BASE_PATH,
+)
+from .github import github_get
+
+logger = logging.getLogger(__name__)
+
+
+class LogoCache:
+    """
+    Size-bounded, least-recently-used cache of logo files on disk.
+    Each entry is a `<key>` data file plus a `<key>.json` metadata file; the
+    LRU order is kept in memory and rebuilt from the files' mtimes on start.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: Optional[OrderedDict] = None
+        self._total_bytes = 0
+
+    def _load(self) -> OrderedDict:
+        if self._entries is not None:
+            return self._entries
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+                used_at = (self.directory / meta_path.stem).stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            found.append((used_at, meta_path.stem, meta))
+
+        self._entries = OrderedDict(
+            (key, meta) for _, key, meta in sorted(found, key=lambda item: item[0])
+        )
+        self._total_bytes = sum(meta["size"] for meta in self._entries.values())
+        return self._entries
+
+    def path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the metadata of a cached logo and marks it as recently used."""
+        entries = self._load()
+        meta = entries.get(key)
+        if meta is None:
+            return None
+        entries.move_to_end(key)
+        try:
+            # The mtime persists the LRU order across restarts
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            self._drop(key)
+            return None
+        return meta
+
+    def put(self, key: str, content: bytes, meta: dict) -> dict:
+        entries = self._load()
+        meta = {**meta, "size": len(content)}
+
+        # Write to temporary files first, so readers never see partial files
+        data_path = self.path(key)
+        meta_path = self.directory / f"{key}.json"
+        for path, payload in (
+            (data_path, content),
+            (meta_path, json.dumps(meta).encode()),
+        ):
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            tmp_path.write_bytes(payload)
+            os.replace(tmp_path, path)
+
+        previous = entries.pop(key, None)
+        if previous is not None:
+            self._total_bytes -= previous["size"]
+        entries[key] = meta
+        self._total_bytes += meta["size"]
+        self._evict()
+        return meta
+
+    def update(self, key: str, **changes) -> dict:
+        """Updates the metadata of an entry, e.g. after a 304 revalidation."""
+        meta = {**self._load()[key], **changes}
+        self._entries[key] = meta
+        (self.directory / f"{key}.json").write_text(json.dumps(meta))
+        return meta
+
+    def _drop(self, key: str) -> None:
+        meta = self._entries.pop(key, None)
+        if meta is not None:
+            self._total_bytes -= meta["size"]
+        for path in (self.path(key), self.directory / f"{key}.json"):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        # Never evict the entry that was just written
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+
+logo_cache = LogoCache(LOGO_CACHE_DIR, LOGO_CACHE_MAX_BYTES)
+_fetch_locks: Dict[str, asyncio.Lock] = {}
+
+
+def resolve_logo_url(template_name: str, logo: Optional[str]) -> Optional[str]:
+    """
+    Absolute URL of a template logo. Relative paths are resolved against the
+    template's directory in the GitHub repository.
+    """
+    if not logo:
+        return None
+    if logo.startswith(("http://", "https://")):
+        return logo
+    return (
+        f"{GITHUB_RAW_BASE}/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/{GITHUB_BRANCH}/"
+        f"{GITHUB_TEMPLATES_BASE_PATH}/{template_name}/{logo.lstrip('/')}"
+    )
+
+
+async def _fetch_upstream(url: str, cached: Optional[dict]) -> Optional[httpx.Response]:
+    headers = {}
+    if cached is not None:
+        if cached.get("upstream_etag"):
+            headers["If-None-Match"] = cached["upstream_etag"]
+        if cached.get("upstream_last_modified"):
+            headers["If-Modified-Since"] = cached["upstream_last_modified"]
+
+    response = await github_get(url, "logo", headers=headers, use_cache=False)
+    if response.status_code == status.HTTP_304_NOT_MODIFIED and cached is not None:
+        return None
+    response.raise_for_status()
+    return response
+
+
+async def get_cached_logo(url: str) -> dict:
+    """
+    Returns the cache metadata of the logo at `url`, fetching it on a miss and
+    revalidating it upstream (conditional request) once it is older than
+    LOGO_REVALIDATE_SECONDS. A stale copy is served if upstream is unreachable.
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    cached = logo_cache.get(key)
+    if (
+        cached is not None
+        and time.time() - cached["fetched_at"] < LOGO_REVALIDATE_SECONDS
+    ):
+        return {**cached, "key": key}
+
+    # One upstream request per logo, however many clients ask at once
+    lock = _fetch_locks.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            return await _refresh_logo(url, key)
+    finally:
+        # Requests already waiting keep the lock and then find the logo cached
+        if _fetch_locks.get(key) is lock:
+            del _fetch_locks[key]
+
+
+async def _refresh_logo(url: str, key: str) -> dict:
+    """Fetches or revalidates the logo at `url`; runs under its fetch lock."""
+    cached = logo_cache.get(key)
+    if (
+        cached is not None
+        and time.time() - cached["fetched_at"] < LOGO_REVALIDATE_SECONDS
+    ):
+        return {**cached, "key": key}
+
+    try:
+        response = await _fetch_upstream(url, cached)
+    except (httpx.HTTPError, httpx.InvalidURL) as e:
+        if cached is not None:
+            logger.warning(f"Serving stale logo for {url}, revalidation failed: {e}")
+            return {**cached, "key": key}
+        status_code = (
+            status.HTTP_404_NOT_FOUND
+            if isinstance(e, httpx.HTTPStatusError)
+            and e.response.status_code == status.HTTP_404_NOT_FOUND
+            else status.HTTP_502_BAD_GATEWAY
+        )
+        raise HTTPException(
+            status_code=status_code, detail=f"Failed to fetch logo from {url}: {e}"
+        )
+
+    if response is None:
+        return {**logo_cache.update(key, fetched_at=time.time()), "key": key}
+
+    content_type = response.headers.get("content-type", "").split(";")[0].strip()
+    if not content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Logo at {url} is not an image (Content-Type: '{content_type}').",
+        )
+    if len(response.content) > LOGO_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Logo at {url} exceeds {LOGO_MAX_BYTES} bytes.",
+        )
+
+    meta = logo_cache.put(
+        key,
+        response.content,
+        {
+            "url": url,
+            "content_type": content_type,
+            "etag": f'"{hashlib.sha256(response.content).hexdigest()[:32]}"',
+            "upstream_etag": response.headers.get("etag"),
+            "upstream_last_modified": response.headers.get("last-modified"),
+            "fetched_at": time.time(),
+        },
+    )
+    return {**meta, "key": key}
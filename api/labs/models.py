@@ -1,5 +1,17 @@
-from sqlalchemy import Column, String, Text, Boolean, ForeignKey
+from sqlalchemy import (
+    Column,
+    String,
+    Text,
+    Boolean,
+    ForeignKey,
+    Integer,
+    BigInteger,
+    DateTime,
+    Float,
+    Index,
+)
 from db import Base
+from helpers import utcnow
 from labs.enum import LAB_BUILD_STATUS
 from base.models import TimestampMixin
 
@@ -12,7 +24,7 @@ class Lab(TimestampMixin, Base):
 
     __tablename__ = "labs"
 
-    id = Column(
+    uid = Column(
         String, primary_key=True, index=True, doc="Unique identifier for the lab"
     )
     name = Column(String, nullable=False, doc="Name of the lab")
@@ -22,6 +34,32 @@ class Lab(TimestampMixin, Base):
         nullable=False,
         doc="Current status of the lab",
     )
+    ttl_minutes = Column(
+        Integer, nullable=True, doc="Maximum lifetime of the lab in minutes"
+    )
+    idle_timeout_minutes = Column(
+        Integer, nullable=True, doc="Minutes without activity before the lab expires"
+    )
+    deadline_at = Column(
+        DateTime, nullable=True, doc="Hard deadline derived from the lab TTL"
+    )
+    expires_at = Column(
+        DateTime,
+        nullable=True,
+        index=True,
+        doc="Effective expiry (earliest of the TTL deadline and the idle timeout)",
+    )
+    teardown_claimed_at = Column(
+        DateTime,
+        nullable=True,
+        doc="When the reaper claimed the expired lab for teardown",
+    )
+    host = Column(
+        String,
+        nullable=True,
+        index=True,
+        doc="Worker node the lab is placed on; its tasks go to that node's queue",
+    )
 
     def __repr__(self):
         return f"<Lab(uid='{self.uid}', name='{self.name}')>"
@@ -33,41 +71,165 @@ class Lab(TimestampMixin, Base):
             "name": self.name,
             "description": self.description,
             "status": self.status,
+            "expires_at": self.expires_at,
         }
 
 
+class LabCounter(Base):
+    """
+    Number of labs per template and status, kept up to date on every insert
+    and status transition (see labs/counters.py) so the summary endpoint
+    does not have to scan the 'labs' table.
+    Maps to the 'lab_counters' table in the database.
+    """
+
+    __tablename__ = "lab_counters"
+
+    template_name = Column(String, primary_key=True, doc="Template of the labs")
+    status = Column(String, primary_key=True, doc="Status of the labs")
+    count = Column(BigInteger, nullable=False, default=0, doc="Number of labs")
+
+    def __repr__(self):
+        return f"<LabCounter(template_name='{self.template_name}', status='{self.status}', count={self.count})>"
+
+
+class LabSnapshot(TimestampMixin, Base):
+    """
+    Snapshot of a lab right after its first successful start: one committed
+    image per service and one archive per named volume, on the lab's host.
+    Maps to the 'lab_snapshots' table in the database.
+    """
+
+    __tablename__ = "lab_snapshots"
+
+    lab_uid = Column(
+        String, ForeignKey("labs.uid"), primary_key=True, doc="UID of the lab"
+    )
+    host = Column(
+        String, nullable=True, index=True, doc="Node holding the images and archives"
+    )
+    images = Column(
+        Text, nullable=False, doc="JSON object mapping each service to its image"
+    )
+    volumes = Column(
+        Text,
+        nullable=False,
+        doc="JSON object mapping each volume name to its archive path",
+    )
+    size_bytes = Column(
+        BigInteger,
+        nullable=True,
+        doc="Storage used: container layers committed plus volume archives",
+    )
+
+    def __repr__(self):
+        return f"<LabSnapshot(lab_uid='{self.lab_uid}', host='{self.host}')>"
+
+
 class Build(TimestampMixin, Base):
     """
-    SQLAlchemy ORM model for storing build logs associated with a lab.
-    Maps to the 'build_logs' table in the database.
+    SQLAlchemy ORM model for one provisioning run of a lab.
+    Maps to the 'builds' table in the database.
     """
 
     __tablename__ = "builds"
 
     id = Column(
-        String, primary_key=True, index=True, doc="Unique identifier for the log"
+        String, primary_key=True, index=True, doc="Unique identifier for the build"
+    )
+    lab_uid = Column(
+        String, ForeignKey("labs.uid"), index=True, doc="UID of the associated lab"
+    )
+    template_name = Column(
+        String, nullable=True, index=True, doc="Template the lab was built from"
     )
-    lab_uid = Column(String, ForeignKey("labs.uid"), doc="UID of the associated lab")
     status = Column(
         String,
         nullable=False,
         doc="Current status of the build",
     )
+    started_at = Column(DateTime, nullable=True, doc="When the build started")
+    finished_at = Column(DateTime, nullable=True, doc="When the build finished")
+    duration_seconds = Column(Float, nullable=True, doc="Wall time of the build")
 
     def __repr__(self):
-        return f"<BuildLogs(id='{self.id}', lab_uid='{self.lab_uid}')>"
-    
+        return f"<Build(id='{self.id}', lab_uid='{self.lab_uid}')>"
+
+
 class BuildStage(TimestampMixin, Base):
+    """
+    SQLAlchemy ORM model for one step of a build (see PROVISION_STAGE).
+    Maps to the 'build_stages' table in the database.
+    """
+
     __tablename__ = "build_stages"
+
+    id = Column(
+        String, primary_key=True, index=True, doc="Unique identifier for the stage"
+    )
     name = Column(String, nullable=False, doc="Name of the Build Stage")
-    build_id = Column(String, ForeignKey("build_stages.uid"), doc="UID of the associated lab")
+    build_id = Column(
+        String, ForeignKey("builds.id"), index=True, doc="ID of the associated build"
+    )
     status = Column(
         String,
         nullable=False,
         doc="Current status of the build stage",
     )
+    started_at = Column(DateTime, nullable=True, doc="When the stage started")
+    finished_at = Column(DateTime, nullable=True, doc="When the stage finished")
+    duration_seconds = Column(Float, nullable=True, doc="Wall time of the stage")
+    bytes_transferred = Column(
+        BigInteger, nullable=True, doc="Bytes downloaded or written by the stage"
+    )
+    error = Column(Text, nullable=True, doc="Error message if the stage failed")
+
+    def __repr__(self):
+        return f"<BuildStage(id='{self.id}', name='{self.name}')>"
+
+
+class Log(Base):
+    """
+    SQLAlchemy ORM model for one chunk of output of a build stage.
+    Maps to the 'logs' table in the database. On PostgreSQL it is range
+    partitioned by `logged_at` (see labs/partitions.py), so old logs are
+    removed by dropping partitions.
+    """
 
-class Log(TimestampMixin, Base):
     __tablename__ = "logs"
-    build_stage_id = Column(String, ForeignKey("build_stages.uid"), doc="UID of the associated lab")
-    content =  Column(Text, nullable=False, doc="Content of the build log")
+    __table_args__ = (
+        # Covers the per-lab listing, so it is answered from the index alone
+        Index(
+            "ix_logs_lab_uid_logged_at",
+            "lab_uid",
+            "logged_at",
+            postgresql_include=["id", "build_id", "build_stage_id", "is_error"],
+        ),
+        Index("ix_logs_build_id_logged_at", "build_id", "logged_at"),
+        {"postgresql_partition_by": "RANGE (logged_at)"},
+    )
+
+    id = Column(String, primary_key=True, doc="Unique identifier for the log")
+    # Part of the primary key: PostgreSQL requires the partition key in it
+    logged_at = Column(
+        DateTime, primary_key=True, default=utcnow, doc="When the output was logged"
+    )
+    lab_uid = Column(
+        String, ForeignKey("labs.uid"), nullable=False, doc="UID of the associated lab"
+    )
+    build_id = Column(
+        String, ForeignKey("builds.id"), nullable=True, doc="ID of the associated build"
+    )
+    build_stage_id = Column(
+        String,
+        ForeignKey("build_stages.id"),
+        nullable=True,
+        doc="ID of the associated build stage",
+    )
+    is_error = Column(
+        Boolean, nullable=False, default=False, doc="Whether the output is an error"
+    )
+    content = Column(Text, nullable=False, doc="Content of the build log")
+
+    def __repr__(self):
+        return f"<Log(id='{self.id}', lab_uid='{self.lab_uid}')>"
@@ -0,0 +1,128 @@
+import re
+import logging
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from helpers import utcnow
+from config import (
+    BUILD_LOG_PARTITION_DAYS,
+    BUILD_LOG_PARTITIONS_AHEAD,
+    BUILD_LOG_RETENTION_DAYS,
+)
+
+logger = logging.getLogger(__name__)
+
+LOG_TABLE = "logs"
+DEFAULT_LOG_PARTITION = f"{LOG_TABLE}_default"
+
+_bound_re = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def _is_postgresql(bind) -> bool:
+    # `bind` is a Session (tasks) or a Connection (migrations)
+    dialect = getattr(bind, "dialect", None) or bind.get_bind().dialect
+    return dialect.name == "postgresql"
+
+
+def partition_start(day: date) -> date:
+    """First day of the partition holding `day`; weekly partitions start on Mondays."""
+    ordinal = day.toordinal()
+    return date.fromordinal(ordinal - (ordinal - 1) % BUILD_LOG_PARTITION_DAYS)
+
+
+def list_log_partitions(bind) -> List[Tuple[str, date, date]]:
+    """The range partitions of the logs table as (name, start, end), by start."""
+    rows = bind.execute(
+        text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:table AS regclass)"
+        ),
+        {"table": LOG_TABLE},
+    ).all()
+    partitions = []
+    for name, bound in rows:
+        match = _bound_re.search(bound)
+        if match:
+            start, end = (
+                datetime.fromisoformat(value).date() for value in match.groups()
+            )
+            partitions.append((name, start, end))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_log_partitions(bind, now: Optional[datetime] = None) -> List[str]:
+    """
+    Creates the partitions of the logs table from the current one up to
+    BUILD_LOG_PARTITIONS_AHEAD ahead, so inserts never land in the default
+    partition. Ranges already covered are skipped, so changing the partition
+    length only affects new partitions. Returns the names created; does
+    nothing on databases other than PostgreSQL.
+    """
+    if not _is_postgresql(bind):
+        return []
+    existing = [(start, end) for _, start, end in list_log_partitions(bind)]
+    cursor = partition_start((now or utcnow()).date())
+    horizon = cursor + timedelta(
+        days=BUILD_LOG_PARTITION_DAYS * (BUILD_LOG_PARTITIONS_AHEAD + 1)
+    )
+    created = []
+    while cursor < horizon:
+        covering = [end for start, end in existing if start <= cursor < end]
+        if covering:
+            cursor = covering[0]
+            continue
+        end = min(
+            [cursor + timedelta(days=BUILD_LOG_PARTITION_DAYS)]
+            + [start for start, _ in existing if start > cursor]
+        )
+        name = f"{LOG_TABLE}_p{cursor:%Y%m%d}"
+        try:
+            # A savepoint, so one failure does not abort the other partitions
+            with bind.begin_nested():
+                bind.execute(
+                    text(
+                        f"CREATE TABLE {name} PARTITION OF {LOG_TABLE} "
+                        f"FOR VALUES FROM ('{cursor.isoformat()}') "
+                        f"TO ('{end.isoformat()}')"
+                    )
+                )
+            created.append(name)
+        except SQLAlchemyError as e:
+            # E.g. rows for this range already went to the default partition
+            logger.error(f"Build logs: Could not create partition {name}: {e}")
+        cursor = end
+    return created
+
+
+def drop_expired_log_partitions(bind, now: Optional[datetime] = None) -> List[str]:
+    """
+    Drops the partitions of the logs table older than BUILD_LOG_RETENTION_DAYS:
+    a quick catalog change, unlike deleting their rows, which bloats the table
+    and holds row locks. The default partition (normally empty) is pruned
+    with a DELETE. Without PostgreSQL, old rows are deleted. Returns the names
+    of the partitions dropped.
+    """
+    cutoff = (now or utcnow()) - timedelta(days=BUILD_LOG_RETENTION_DAYS)
+    if not _is_postgresql(bind):
+        bind.execute(
+            text(f"DELETE FROM {LOG_TABLE} WHERE logged_at < :cutoff"),
+            {"cutoff": cutoff},
+        )
+        return []
+
+    dropped = []
+    for name, _, end in list_log_partitions(bind):
+        if end > cutoff.date():
+            break
+        bind.execute(text(f"ALTER TABLE {LOG_TABLE} DETACH PARTITION {name}"))
+        bind.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    bind.execute(
+        text(f"DELETE FROM {DEFAULT_LOG_PARTITION} WHERE logged_at < :cutoff"),
+        {"cutoff": cutoff},
+    )
+    return dropped
@@ -0,0 +1,284 @@
+import os
+import logging
+import json
+import time
+import shutil
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+import yaml
+
+from redis_client import get_redis
+from config import (
+    TEMPLATE_STORE_DIR,
+    TEMPLATE_STORE_RETENTION_SECONDS,
+    TEMPLATE_SYNC_PULL_IMAGES,
+)
+from .constants import TEMPLATE_SYNC_STATE_KEY, TEMPLATE_SYNC_LOCK_KEY
+from .enum import DISK_USAGE_KIND
+from .disk import replace_disk_usage
+from .utils import (
+    download_github_template_files,
+    fetch_template_metadata_list,
+    fetch_templates_revision,
+    run_docker_compose_command,
+)
+
+logger = logging.getLogger(__name__)
+
+# Name of the file in the store that holds the SHA of the current version
+CURRENT_VERSION_FILE = "CURRENT"
+COMPOSE_FILE_NAME = "compose.yml"
+# Upper bound of a sync, after which a crashed sync no longer blocks the next one
+SYNC_LOCK_TIMEOUT_SECONDS = 3600
+
+
+def _current_version(store_dir: Path = TEMPLATE_STORE_DIR) -> Optional[str]:
+    try:
+        return (store_dir / CURRENT_VERSION_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_stored_template_dir(
+    template_name: str, store_dir: Path = TEMPLATE_STORE_DIR
+) -> Optional[Path]:
+    """
+    Directory of a template in the current version of the local store, or
+    None when the template has not been pre-fetched.
+    """
+    version = _current_version(store_dir)
+    if version is None:
+        return None
+    template_dir = store_dir / version / template_name
+    if (template_dir / COMPOSE_FILE_NAME).is_file():
+        return template_dir
+    return None
+
+
+def list_stored_templates(store_dir: Path = TEMPLATE_STORE_DIR) -> tuple:
+    """Returns (current version, names of the templates it holds)."""
+    version = _current_version(store_dir)
+    if version is None:
+        return None, []
+    return version, sorted(
+        entry.name
+        for entry in (store_dir / version).iterdir()
+        if (entry / COMPOSE_FILE_NAME).is_file()
+    )
+
+
+def copy_stored_template(template_dir: Path, target_dir: str) -> int:
+    """Copies a pre-fetched template into a lab directory; returns the bytes copied."""
+    shutil.copytree(template_dir, target_dir, dirs_exist_ok=True)
+    return sum(
+        path.stat().st_size for path in template_dir.rglob("*") if path.is_file()
+    )
+
+
+def get_template_sync_state() -> dict:
+    state = get_redis().hgetall(TEMPLATE_SYNC_STATE_KEY)
+    for field in ("templates", "images_pulled", "images_failed"):
+        if field in state:
+            state[field] = int(state[field])
+    for field in (
+        "last_checked_at",
+        "last_changed_at",
+        "last_synced_at",
+        "duration_seconds",
+    ):
+        if field in state:
+            state[field] = float(state[field])
+    if "failed_templates" in state:
+        state["failed_templates"] = json.loads(state["failed_templates"])
+    return state
+
+
+async def _fetch_changes(store_dir: Path, force: bool) -> tuple:
+    """
+    Checks the templates revision and, if it differs from the store's current
+    version (or with `force`), downloads every template into a staging
+    directory. Runs in a single event loop, so the shared GitHub client is
+    only ever used from one loop per sync.
+    Returns (sha, etag, templates or None if unchanged).
+    """
+    sha, etag = await fetch_templates_revision()
+
+    if not force and sha == _current_version(store_dir):
+        return sha, etag, None
+
+    templates = [
+        template
+        for template in await fetch_template_metadata_list()
+        if isinstance(template, dict) and "name" in template
+    ]
+    staging_dir = store_dir / f".{sha}.partial"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    staging_dir.mkdir(parents=True)
+    for template in templates:
+        await download_github_template_files(
+            template["name"], str(staging_dir / template["name"])
+        )
+    return sha, etag, templates
+
+
+def _retire_version(version_dir: Path, target: Optional[Path] = None) -> None:
+    """
+    Marks a version that is no longer current as replaced now: its mtime
+    starts the retention period. Optionally moves it to `target` first.
+    """
+    try:
+        if target is not None:
+            os.rename(version_dir, target)
+            version_dir = target
+        os.utime(version_dir)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_retired_versions(current: str, store_dir: Path) -> None:
+    """
+    Removes the versions replaced more than TEMPLATE_STORE_RETENTION_SECONDS
+    ago. Provisions that read CURRENT before it changed may still be copying
+    from a more recently replaced version.
+    """
+    cutoff = time.time() - TEMPLATE_STORE_RETENTION_SECONDS
+    for entry in store_dir.iterdir():
+        if (
+            entry.is_dir()
+            and entry.name != current
+            and not entry.name.startswith(".")
+            and entry.stat().st_mtime < cutoff
+        ):
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def _materialize(version: str, templates: list, store_dir: Path) -> dict:
+    """
+    Validates and parses the compose file of every downloaded template and
+    pre-pulls its images, then publishes the staging directory as the
+    current version.
+    """
+    staging_dir = store_dir / f".{version}.partial"
+    result = {"templates": 0, "images_pulled": 0, "images_failed": 0}
+    failed_templates = []
+    for template in templates:
+        template_dir = staging_dir / template["name"]
+        compose_path = template_dir / COMPOSE_FILE_NAME
+        try:
+            compose_content = compose_path.read_text(encoding="utf-8")
+            services = (yaml.safe_load(compose_content) or {}).get("services") or {}
+        except (OSError, yaml.YAMLError) as e:
+            logger.warning(
+                f"Template sync: Skipping '{template['name']}', invalid compose file: {e}"
+            )
+            shutil.rmtree(template_dir, ignore_errors=True)
+            failed_templates.append(template["name"])
+            continue
+        result["templates"] += 1
+
+        images = sorted(
+            {service["image"] for service in services.values() if "image" in service}
+        )
+        if not TEMPLATE_SYNC_PULL_IMAGES or not images:
+            continue
+        try:
+            run_docker_compose_command(
+                compose_content,
+                ["pull", "--ignore-buildable", "--quiet"],
+                timeout=1800,
+                working_dir=str(template_dir),
+            )
+            result["images_pulled"] += len(images)
+        except Exception as e:
+            # A missing image only makes the first provision slower
+            logger.error(
+                f"Template sync: Failed to pull images of '{template['name']}': {e}"
+            )
+            result["images_failed"] += len(images)
+
+    previous_version = _current_version(store_dir)
+    version_dir = store_dir / version
+    if version_dir.exists():
+        # Forced re-sync of a version: set the old copy aside like a replaced
+        # version, a provision may be copying from it
+        _retire_version(version_dir, store_dir / f"{version}.{time.time_ns()}")
+    os.rename(staging_dir, version_dir)
+
+    current_tmp = store_dir / f".{CURRENT_VERSION_FILE}.tmp"
+    current_tmp.write_text(version)
+    os.replace(current_tmp, store_dir / CURRENT_VERSION_FILE)
+
+    if previous_version is not None and previous_version != version:
+        _retire_version(store_dir / previous_version)
+    _remove_retired_versions(version, store_dir)
+    replace_disk_usage(
+        DISK_USAGE_KIND.TEMPLATE,
+        {
+            entry.name: entry
+            for entry in version_dir.iterdir()
+            if (entry / COMPOSE_FILE_NAME).is_file()
+        },
+    )
+
+    result["failed_templates"] = failed_templates
+    return result
+
+
+def sync_template_store(
+    force: bool = False, store_dir: Path = TEMPLATE_STORE_DIR
+) -> dict:
+    """
+    Checks the template repository for changes and, when the templates changed
+    (or with `force`), materializes all of them into the local store.
+    Only one sync runs at a time; the state is kept in Redis for the admin API.
+    """
+    redis_client = get_redis()
+    if not redis_client.set(
+        TEMPLATE_SYNC_LOCK_KEY, os.getpid(), nx=True, ex=SYNC_LOCK_TIMEOUT_SECONDS
+    ):
+        logger.warning("Template sync: Another sync is already running, skipping.")
+        return get_template_sync_state()
+
+    started = time.time()
+    try:
+        sha, etag, templates = asyncio.run(_fetch_changes(store_dir, force))
+
+        updates = {"last_checked_at": started, "status": "unchanged", "error": ""}
+        if etag:
+            updates["etag"] = etag
+        if templates is not None:
+            logger.info(
+                f"Template sync: Templates changed (revision {sha}), refreshing the store..."
+            )
+            result = _materialize(sha, templates, store_dir)
+            updates.update(
+                {
+                    "status": "synced",
+                    "sha": sha,
+                    "last_changed_at": started,
+                    "last_synced_at": time.time(),
+                    "duration_seconds": time.time() - started,
+                    "templates": result["templates"],
+                    "images_pulled": result["images_pulled"],
+                    "images_failed": result["images_failed"],
+                    "failed_templates": json.dumps(result["failed_templates"]),
+                }
+            )
+            logger.info(f"Template sync: Store refreshed to revision {sha}: {result}")
+        redis_client.hset(TEMPLATE_SYNC_STATE_KEY, mapping=updates)
+    except Exception as e:
+        logger.error(f"Template sync: Failed: {e}")
+        redis_client.hset(
+            TEMPLATE_SYNC_STATE_KEY,
+            mapping={
+                "last_checked_at": started,
+                "status": "failed",
+                "error": str(getattr(e, "detail", e)),
+            },
+        )
+    finally:
+        redis_client.delete(TEMPLATE_SYNC_LOCK_KEY)
+
+    return get_template_sync_state()
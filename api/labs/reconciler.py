@@ -0,0 +1,197 @@
+import re
+import logging
+import subprocess
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from config import (
+    LAB_RECONCILER_GRACE_SECONDS,
+    LAB_RECONCILER_REMOVE_ORPHANS,
+    NODE_NAME,
+)
+from instrumentation import LAB_RECONCILER_DRIFT
+from labs.enum import LAB_BUILD_STATUS
+from labs.models import Lab
+from labs.services import set_lab_status
+from labs.constants import COMPOSE_PROJECT_LABEL, LAB_UID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+_lab_uid_re = re.compile(LAB_UID_PATTERN)
+
+
+def _list_labeled(kind: str, fields: str) -> List[List[str]]:
+    """
+    Lists the containers, networks or volumes (`kind`) of every compose
+    project on this host in a single call; each row ends with the project.
+    """
+    result = subprocess.run(
+        ["docker", kind, "ls"]
+        + (["--all", "--no-trunc"] if kind == "container" else [])
+        + [
+            "--filter",
+            f"label={COMPOSE_PROJECT_LABEL}",
+            "--format",
+            f'{fields} {{{{.Label "{COMPOSE_PROJECT_LABEL}"}}}}',
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+    return [
+        parts
+        for parts in (line.split() for line in result.stdout.splitlines())
+        if len(parts) == fields.count("{{") + 1 and _lab_uid_re.match(parts[-1])
+    ]
+
+
+def list_lab_container_states() -> Dict[str, Dict[str, List[str]]]:
+    """
+    Maps each lab (compose project) on this host to its container IDs by state
+    ("running", "exited", ...), stopped containers included, using a single
+    labeled `docker ps --all` call.
+    """
+    labs: Dict[str, Dict[str, List[str]]] = {}
+    for container_id, state, uid in _list_labeled("container", "{{.ID}} {{.State}}"):
+        labs.setdefault(uid, {}).setdefault(state, []).append(container_id)
+    return labs
+
+
+def _remove(kind: str, names: List[str]) -> None:
+    if not names:
+        return
+    command = ["docker", kind, "rm"] + (
+        ["--force", "--volumes"] if kind == "container" else []
+    )
+    result = subprocess.run(
+        command + names, capture_output=True, text=True, timeout=300
+    )
+    if result.returncode != 0:
+        # Some may be gone already (e.g. torn down meanwhile); the rest is removed
+        logger.warning(
+            f"Reconciler: Could not remove some {kind}s: {result.stderr.strip()}"
+        )
+
+
+def remove_lab_resources(
+    uids: Iterable[str], containers: Dict[str, Dict[str, List[str]]]
+) -> None:
+    """
+    Removes the containers, networks and named volumes of the given labs with
+    a constant number of Docker calls, however many labs there are.
+    """
+    uids = set(uids)
+    _remove(
+        "container",
+        [
+            container_id
+            for uid in uids
+            for container_ids in containers.get(uid, {}).values()
+            for container_id in container_ids
+        ],
+    )
+    for kind in ("network", "volume"):
+        _remove(
+            kind,
+            [name for name, uid in _list_labeled(kind, "{{.Name}}") if uid in uids],
+        )
+
+
+def database_now(db: Session) -> datetime:
+    """
+    The database's current time, as `func.now()` stores it in the naive
+    `updated_at` columns: in the database's time zone, which may not be UTC.
+    """
+    # PostgreSQL returns an aware datetime in the session time zone
+    return db.query(func.now()).scalar().replace(tzinfo=None)
+
+
+def reconcile_node(
+    db: Session, node: str = NODE_NAME, now: Optional[datetime] = None
+) -> dict:
+    """
+    Compares the labs placed on this node with the containers actually on it:
+    one `docker ps` and one query, whatever the number of labs.
+
+    - Completed labs without a running container are marked failed (lost).
+    - Lab containers whose lab is expired, cancelled or unknown are orphaned;
+      they are reported, and removed when LAB_RECONCILER_REMOVE_ORPHANS is set.
+
+    Labs changed within LAB_RECONCILER_GRACE_SECONDS are skipped, since a task
+    may be changing their containers right now. `now` is on the database's
+    clock, like `updated_at`.
+    """
+    now = now or database_now(db)
+    containers = list_lab_container_states()
+    labs = (
+        db.query(Lab)
+        .filter(
+            or_(
+                and_(
+                    Lab.host == node,
+                    Lab.status == LAB_BUILD_STATUS.COMPLETED.value,
+                ),
+                Lab.uid.in_(list(containers)),
+            )
+        )
+        .all()
+    )
+    by_uid = {lab.uid: lab for lab in labs}
+    cutoff = now - timedelta(seconds=LAB_RECONCILER_GRACE_SECONDS)
+
+    def settled(lab: Lab) -> bool:
+        return lab.updated_at is None or lab.updated_at <= cutoff
+
+    lost = [
+        lab
+        for lab in labs
+        if lab.host == node
+        and lab.status == LAB_BUILD_STATUS.COMPLETED.value
+        and not containers.get(lab.uid, {}).get("running")
+        and settled(lab)
+    ]
+    orphaned = sorted(
+        uid
+        for uid in containers
+        if uid not in by_uid
+        or (
+            by_uid[uid].status
+            in (LAB_BUILD_STATUS.EXPIRED.value, LAB_BUILD_STATUS.CANCELLED.value)
+            and settled(by_uid[uid])
+        )
+    )
+
+    lost_uids = sorted(str(lab.uid) for lab in lost)
+    if lost:
+        for lab in lost:
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
+        db.commit()
+        LAB_RECONCILER_DRIFT.labels(kind="lost").inc(len(lost))
+        logger.error(
+            f"Reconciler: Marked {len(lost)} lab(s) without running containers "
+            f"on {node} as failed: {', '.join(lost_uids)}"
+        )
+
+    removed = False
+    if orphaned:
+        LAB_RECONCILER_DRIFT.labels(kind="orphaned").inc(len(orphaned))
+        logger.info(
+            f"Reconciler: {len(orphaned)} orphaned lab(s) on {node}: "
+            f"{', '.join(orphaned)}"
+        )
+        if LAB_RECONCILER_REMOVE_ORPHANS:
+            remove_lab_resources(orphaned, containers)
+            LAB_RECONCILER_DRIFT.labels(kind="orphan_removed").inc(len(orphaned))
+            removed = True
+
+    return {
+        "node": node,
+        "labs_with_containers": len(containers),
+        "lost": lost_uids,
+        "orphaned": orphaned,
+        "orphans_removed": removed,
+    }
@@ -1,62 +1,129 @@
 import os
+import asyncio
+import logging
+import json
+import time
 import httpx
+import redis
+import orjson
 from typing import List, Optional
 from fastapi import Query
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Depends,
+    Header,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import FileResponse
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
 
 from db import get_db
+from redis_client import get_redis
+from config import (
+    LAB_LIST_CACHE_ENABLED,
+    LOGO_BROWSER_MAX_AGE_SECONDS,
+    TEMPLATE_SYNC_INTERVAL_SECONDS,
+    LAB_METRICS_MAX_POINTS,
+    LAB_METRICS_PUBLISH_INTERVAL_SECONDS,
+)
+from instrumentation import LAB_LIST_CACHE_REQUESTS, LAB_STATUS_TRANSITIONS
+from profiling import is_profiling_token, list_slowest_profiles, load_profile
 from labs.schemas import (
+    AdmissionStatsResponse,
+    CancelLabsRequest,
+    CancelLabsResponse,
     CreateLabResponse,
     TemplateResponse,
     LabResponse,
+    LabExpiryResponse,
+    LabSummaryResponse,
+    LabMetricsResponse,
+    HostMetricsResponse,
+    BuildResponse,
+    BuildStageResponse,
+    LabEventResponse,
+    NodeResponse,
+    NodeDiskUsageResponse,
+    ProfileResponse,
+    ProfileSummaryResponse,
+    TemplateBuildStatsResponse,
+    TemplateSyncResponse,
+)
+from labs.models import Lab, LabSnapshot
+from labs.services import (
+    CANCELLABLE_LAB_STATUSES,
+    cancel_lab_provisions,
+    resolve_lab_lifetime,
+    init_lab_expiry,
+    extend_lab_expiry,
+    set_lab_status,
+    lab_summary,
+    list_lab_builds,
+    template_build_stats,
+)
+from labs.tasks import dispatch_lab_task, sync_template_store_task
+from labs.scheduler import list_nodes, place_lab
+from labs.prefetch import get_template_sync_state
+from labs.events import get_lab_events
+from labs.disk import get_disk_usage
+from labs.admission import admit_lab_request, get_admission_stats
+from labs.catalog import get_template_catalog
+from labs.logos import (
+    get_cached_logo,
+    logo_cache,
+    resolve_logo_url,
+)
+from labs.cache import (
+    get_labs_version,
+    lab_list_etag,
+    lab_list_cache_key,
+    get_cached_lab_list,
+    set_cached_lab_list,
 )
-from labs.models import Lab
-from labs.tasks import lab_task_manager
 from labs.constants import (
+    LAB_LIST_COLUMNS,
     GITHUB_REPO_OWNER,
     GITHUB_REPO_NAME,
     GITHUB_TEMPLATES_INDEX_FILE,
+    HOST_METRICS_KEY,
+    LAB_METRICS_KEY_PREFIX,
 )
+from labs.sampler import downsample_series, SAMPLE_FIELDS
 from labs.enum import LAB_BUILD_STATUS, LAB_TASK_TYPE
-from labs.utils import (
-    fetch_template_metadata_list,
-    fetch_template_details,
-)
+from labs.utils import fetch_template_details
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/lab")
 
 
 @router.get("/templates", response_model=List[TemplateResponse])
-async def list_templates():
+async def list_templates(
+    response: Response,
+    q: Optional[str] = Query(None, description="Search name, title and description"),
+    category: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+):
     """
-    Lists all available pre-made lab templates by fetching a central metadata file from GitHub.
+    Lists the available pre-made lab templates from the central metadata file on GitHub.
+    Supports full-text search (`q`), `category` filtering and pagination; the
+    total number of matches is returned in the `X-Total-Count` header.
     """
 
-    templates = []
     try:
-        # Use the API-specific fetcher
-        template_list = await fetch_template_metadata_list()
-
-        for template_info in template_list:
-            if not isinstance(template_info, dict) or "name" not in template_info:
-                print(
-                    f"Warning: Skipping malformed template entry in index: {template_info}"
-                )
-                continue
-
-            templates.append(
-                TemplateResponse(
-                    name=template_info["name"],
-                    title=template_info.get("title", template_info["name"]),
-                    description=template_info.get("description")
-                    or f"Template for {template_info['name']}",
-                    logo=template_info.get("logo", "default_icon.png"),
-                    category=template_info.get("category", ""),
-                )
-            )
+        catalog = await get_template_catalog()
+        total, templates = catalog.search(
+            query=q, category=category, limit=limit, offset=offset
+        )
 
+    except HTTPException:
+        raise
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             raise HTTPException(
@@ -78,50 +145,120 @@ async def list_templates():
             detail=f"An unexpected error occurred while listing templates: {e}",
         )
 
-    if not templates:
+    if not len(catalog):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"No lab templates found in GitHub repository '{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}' via index file '{GITHUB_TEMPLATES_INDEX_FILE}'.",
         )
 
+    response.headers["X-Total-Count"] = str(total)
     return templates
 
 
+@router.get("/templates/{template_name}/logo", response_class=FileResponse)
+async def get_template_logo(template_name: str, request: Request):
+    """
+    Serves the logo of a template from the local logo cache, so browsers never
+    fetch it from upstream. Cached logos are revalidated upstream with
+    conditional requests; browsers get a long-lived Cache-Control and an ETag.
+    """
+    catalog = await get_template_catalog()
+    template = catalog.get(template_name)
+    if template is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Template '{template_name}' not found.",
+        )
+
+    logo_url = resolve_logo_url(template.name, template.logo)
+    if logo_url is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Template '{template_name}' has no logo.",
+        )
+
+    logo = await get_cached_logo(logo_url)
+    headers = {
+        "ETag": logo["etag"],
+        "Cache-Control": f"public, max-age={LOGO_BROWSER_MAX_AGE_SECONDS}",
+        # Logos may be SVG: never let them run scripts or be sniffed as HTML
+        "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if logo["etag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(
+        logo_cache.path(logo["key"]), media_type=logo["content_type"], headers=headers
+    )
+
+
 @router.post("/templates/{template_name}/", response_model=CreateLabResponse)
-async def create_lab_from_template(template_name: str, db: Session = Depends(get_db)):
+async def create_lab_from_template(
+    template_name: str,
+    request: Request,
+    ttl_minutes: Optional[int] = Query(None, ge=0),
+    idle_timeout_minutes: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db),
+):
     """
     Creates a new lab environment from a specified pre-made template by downloading it from GitHub.
+    `ttl_minutes` and `idle_timeout_minutes` override the template's expiry defaults (0 disables).
+    Rejected with 429 or 503 (and Retry-After) when admission control is over a limit.
     """
-
     lab_name = template_name
     lab_description = f"Provisioning {template_name}..."
 
     try:
         # check if the template exists in the metadata
-        print(f"Fetching metadata for template '{template_name}'")
+        logger.debug(f"Fetching metadata for template '{template_name}'")
 
         template_details = await fetch_template_details(template_name)
+        # Only requests for an existing template count against the limits
+        admission = await asyncio.to_thread(admit_lab_request, db, request)
 
         uid = f"{template_details['name']}-{os.urandom(6).hex()}"
+        ttl, idle_timeout = resolve_lab_lifetime(
+            template_details, ttl_minutes, idle_timeout_minutes
+        )
+        host = await asyncio.to_thread(place_lab, template_details["name"])
         new_lab = Lab(
             **{
                 "uid": uid,
                 "name": lab_name,
                 "description": lab_description,
                 "status": LAB_BUILD_STATUS.QUEUED.value,
+                "ttl_minutes": ttl,
+                "idle_timeout_minutes": idle_timeout,
+                "host": host,
             }
         )
+        init_lab_expiry(new_lab)
         db.add(new_lab)
         db.commit()
         db.refresh(new_lab)
 
-        lab_task_manager.delay(uid, type=LAB_TASK_TYPE.PROVISION)
+        LAB_STATUS_TRANSITIONS.labels(
+            from_status="none", to_status=LAB_BUILD_STATUS.QUEUED.value
+        ).inc()
+
+        await asyncio.to_thread(
+            dispatch_lab_task,
+            uid,
+            LAB_TASK_TYPE.PROVISION,
+            host,
+            priority=admission["priority"],
+            enqueued_at=time.time(),
+        )
 
         return CreateLabResponse(
             message=f"Lab creation from template '{template_name}' accepted. Building and starting in background.",
             uid=uid,
             status="accepted",
+            estimated_wait_seconds=admission["estimated_wait_seconds"],
         )
+    except HTTPException:
+        raise
     except OperationalError as e:
         db.rollback()
         raise HTTPException(
@@ -138,6 +275,7 @@ async def create_lab_from_template(template_name: str, db: Session = Depends(get
 
 @router.get("/", response_model=List[LabResponse])
 async def list_labs(
+    request: Request,
     name: Optional[str] = Query(None),
     lab_status: Optional[str] = Query(None, alias="status"),
     sort_by: str = Query("created_at", pattern="^(created_at|updated_at)$"),
@@ -146,8 +284,65 @@ async def list_labs(
     offset: int = Query(0, ge=0),
     db: Session = Depends(get_db),
 ):
+    """
+    Lists labs with filtering, sorting and pagination.
+    Responses carry an ETag derived from the labs version, which changes
+    whenever a lab is created or updated; `If-None-Match` gets a 304 without
+    touching the database, and repeated queries are served from Redis.
+    """
+    redis_client = get_redis() if LAB_LIST_CACHE_ENABLED else None
+    version = cache_key = None
+    if redis_client is not None:
+        try:
+            version = await asyncio.to_thread(get_labs_version, redis_client)
+            etag = lab_list_etag(version)
+            if etag in request.headers.get("if-none-match", ""):
+                LAB_LIST_CACHE_REQUESTS.labels(result="not_modified").inc()
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+                )
+
+            cache_key = lab_list_cache_key(
+                version,
+                {
+                    "name": name or None,
+                    "status": lab_status or None,
+                    "sort_by": sort_by,
+                    "sort_order": sort_order,
+                    "limit": limit,
+                    "offset": offset,
+                },
+            )
+            cached = await asyncio.to_thread(
+                get_cached_lab_list, redis_client, cache_key
+            )
+            if cached is not None:
+                LAB_LIST_CACHE_REQUESTS.labels(result="hit").inc()
+                return Response(
+                    content=cached,
+                    media_type="application/json",
+                    headers={"ETag": etag},
+                )
+        except redis.RedisError as e:
+            logger.warning(f"Lab list cache unavailable: {e}")
+            version = cache_key = None
+    LAB_LIST_CACHE_REQUESTS.labels(
+        result="miss" if cache_key is not None else "bypass"
+    ).inc()
+
     try:
-        query = db.query(Lab)
+        # Select only the columns of LabResponse: no ORM entities to hydrate.
+        # The description is optional on labs but a string in LabResponse.
+        query = db.query(
+            *(
+                (
+                    func.coalesce(Lab.description, "").label(column)
+                    if column == "description"
+                    else getattr(Lab, column)
+                )
+                for column in LAB_LIST_COLUMNS
+            )
+        )
 
         # Filters
         if name:
@@ -163,17 +358,11 @@ async def list_labs(
             query = query.order_by(sort_column.asc())
 
         # Pagination
-        labs = query.offset(offset).limit(limit).all()
+        rows = query.offset(offset).limit(limit).all()
 
-        return [
-            LabResponse(
-                uid=str(lab.uid),
-                name=str(lab.name),
-                description=str(lab.description),
-                status=str(lab.status),
-            )
-            for lab in labs
-        ]
+        # The rows already match LabResponse, so they are serialized directly
+        # instead of being validated into models and then re-validated.
+        body = orjson.dumps([dict(zip(LAB_LIST_COLUMNS, row)) for row in rows])
 
     except OperationalError as e:
         raise HTTPException(
@@ -185,3 +374,531 @@ async def list_labs(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An unexpected error occurred when listing labs: {e}",
         )
+
+    if cache_key is not None:
+        try:
+            await asyncio.to_thread(set_cached_lab_list, redis_client, cache_key, body)
+        except redis.RedisError as e:
+            logger.warning(f"Could not cache lab list: {e}")
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": lab_list_etag(version)} if version is not None else None,
+    )
+
+
+@router.get("/summary", response_model=LabSummaryResponse)
+async def get_lab_summary(db: Session = Depends(get_db)):
+    """
+    Returns the number of labs per status and per template, for the dashboard header.
+    """
+    try:
+        return LabSummaryResponse(**lab_summary(db))
+    except OperationalError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error when summarizing labs: {e}",
+        )
+
+
+@router.post("/{uid}/extend", response_model=LabExpiryResponse)
+async def extend_lab(
+    uid: str,
+    minutes: int = Query(60, ge=1, le=24 * 60),
+    db: Session = Depends(get_db),
+):
+    """
+    Pushes out the expiry deadline of a lab by `minutes` and resets its idle timeout.
+    """
+    try:
+        lab = db.query(Lab).filter(Lab.uid == uid).first()
+        if not lab:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Lab '{uid}' not found.",
+            )
+        if lab.status == LAB_BUILD_STATUS.EXPIRED.value:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Lab '{uid}' has already expired and been torn down.",
+            )
+
+        extend_lab_expiry(lab, minutes)
+        db.commit()
+        db.refresh(lab)
+
+        return LabExpiryResponse(
+            uid=str(lab.uid),
+            ttl_minutes=lab.ttl_minutes,
+            idle_timeout_minutes=lab.idle_timeout_minutes,
+            deadline_at=lab.deadline_at,
+            expires_at=lab.expires_at,
+        )
+    except HTTPException:
+        raise
+    except OperationalError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error while extending lab '{uid}': {e}",
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred while extending lab '{uid}': {e}",
+        )
+
+
+@router.post(
+    "/{uid}/reset",
+    response_model=CreateLabResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def reset_lab(uid: str, db: Session = Depends(get_db)):
+    """
+    Resets a lab to its state right after provisioning, from the snapshot taken
+    then. Much faster than creating a new lab: nothing is downloaded or built.
+    Also recovers a lab whose previous reset failed.
+    """
+    try:
+        # Lock the row until the commit, so that concurrent resets of the same
+        # lab see RESETTING and only one reset task is dispatched
+        lab = db.query(Lab).filter(Lab.uid == uid).with_for_update().first()
+        if not lab:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Lab '{uid}' not found.",
+            )
+        if lab.status not in (
+            LAB_BUILD_STATUS.COMPLETED.value,
+            LAB_BUILD_STATUS.FAILED.value,
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Lab '{uid}' is {lab.status} and cannot be reset.",
+            )
+        if db.get(LabSnapshot, uid) is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Lab '{uid}' has no snapshot to reset to.",
+            )
+
+        set_lab_status(lab, LAB_BUILD_STATUS.RESETTING)
+        host = lab.host
+        db.commit()
+
+        await asyncio.to_thread(dispatch_lab_task, uid, LAB_TASK_TYPE.RESET, host)
+
+        return CreateLabResponse(
+            message=f"Reset of lab '{uid}' accepted. Restoring its snapshot in background.",
+            uid=uid,
+            status="accepted",
+        )
+    except HTTPException:
+        raise
+    except OperationalError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error while resetting lab '{uid}': {e}",
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred while resetting lab '{uid}': {e}",
+        )
+
+
+@router.post(
+    "/{uid}/cancel",
+    response_model=CancelLabsResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def cancel_lab(uid: str, db: Session = Depends(get_db)):
+    """
+    Cancels the provision of a lab. A queued lab is cancelled at once; a lab
+    being provisioned stops within a poll interval, and whatever it started
+    (containers, lab directory) is removed.
+    """
+    try:
+        # Locked until the commit, so a provision cannot complete between the
+        # status check and the cancel request (see provision_lab_task)
+        lab = db.query(Lab).filter(Lab.uid == uid).with_for_update().first()
+        if not lab:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Lab '{uid}' not found.",
+            )
+        if lab.status not in CANCELLABLE_LAB_STATUSES:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Lab '{uid}' is {lab.status} and cannot be cancelled.",
+            )
+
+        result = await asyncio.to_thread(cancel_lab_provisions, [lab])
+        db.commit()
+        return CancelLabsResponse(**result)
+    except HTTPException:
+        raise
+    except OperationalError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error while cancelling lab '{uid}': {e}",
+        )
+    except redis.RedisError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Could not cancel lab '{uid}', Redis is unavailable: {e}",
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred while cancelling lab '{uid}': {e}",
+        )
+
+
+@router.post(
+    "/cancel",
+    response_model=CancelLabsResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def cancel_labs(body: CancelLabsRequest, db: Session = Depends(get_db)):
+    """
+    Cancels the provisions of the given labs and/or of every lab of a template
+    being provisioned, with one query, one Redis round trip and one commit.
+    Labs not being provisioned are returned as skipped.
+    """
+    if not body.uids and not body.template_name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Give the uids of the labs to cancel, or a template_name.",
+        )
+    try:
+        filters = []
+        if body.uids:
+            filters.append(Lab.uid.in_(body.uids))
+        if body.template_name:
+            # Labs are named after their template
+            filters.append(
+                (Lab.name == body.template_name)
+                & Lab.status.in_(CANCELLABLE_LAB_STATUSES)
+            )
+        # Locked until the commit, like in cancel_lab; in uid order, so that
+        # concurrent bulk cancels do not deadlock
+        labs = (
+            db.query(Lab)
+            .filter(or_(*filters))
+            .order_by(Lab.uid)
+            .with_for_update()
+            .all()
+        )
+
+        result = await asyncio.to_thread(cancel_lab_provisions, labs)
+        db.commit()
+        found = {str(lab.uid) for lab in labs}
+        result["skipped"] += [uid for uid in body.uids if uid not in found]
+        return CancelLabsResponse(**result)
+    except OperationalError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error while cancelling labs: {e}",
+        )
+    except redis.RedisError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Could not cancel labs, Redis is unavailable: {e}",
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred while cancelling labs: {e}",
+        )
+
+
+@router.get("/metrics/hosts", response_model=List[HostMetricsResponse])
+async def list_host_metrics():
+    """
+    Returns the resource totals reported by the sampler of every worker host.
+    Hosts that stopped reporting are left out.
+    """
+    try:
+        hosts = await asyncio.to_thread(get_redis().hgetall, HOST_METRICS_KEY)
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Metrics store unavailable: {e}",
+        )
+
+    stale_before = time.time() - LAB_METRICS_PUBLISH_INTERVAL_SECONDS * 3
+    summaries = [json.loads(summary) for summary in hosts.values()]
+    return [
+        HostMetricsResponse(**summary)
+        for summary in sorted(summaries, key=lambda summary: summary["host"])
+        if summary["updated_at"] >= stale_before
+    ]
+
+
+@router.get("/{uid}/metrics", response_model=LabMetricsResponse)
+async def get_lab_metrics(
+    uid: str,
+    points: int = Query(LAB_METRICS_MAX_POINTS, ge=1, le=LAB_METRICS_MAX_POINTS),
+):
+    """
+    Returns the downsampled CPU, memory and IO series of a lab's containers,
+    as published by the sampler on the lab's worker host.
+    """
+    try:
+        payload = await asyncio.to_thread(
+            get_redis().get, f"{LAB_METRICS_KEY_PREFIX}{uid}"
+        )
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Metrics store unavailable: {e}",
+        )
+
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No metrics available for lab '{uid}'.",
+        )
+
+    metrics = json.loads(payload)
+    series = downsample_series(
+        {field: metrics[field] for field in SAMPLE_FIELDS}, points
+    )
+    return LabMetricsResponse(
+        uid=metrics["uid"],
+        host=metrics["host"],
+        interval_seconds=metrics["interval_seconds"],
+        **series,
+    )
+
+
+@router.get(
+    "/templates/{template_name}/build-stats", response_model=TemplateBuildStatsResponse
+)
+async def get_template_build_stats(
+    template_name: str,
+    limit: int = Query(200, ge=1, le=5000),
+    db: Session = Depends(get_db),
+):
+    """
+    Returns p50/p95 duration per provisioning stage over the latest `limit`
+    builds of a template, to track provisioning performance over time.
+    """
+    try:
+        return TemplateBuildStatsResponse(
+            **template_build_stats(db, template_name, limit)
+        )
+    except OperationalError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error when computing build stats: {e}",
+        )
+
+
+@router.get("/{uid}/builds", response_model=List[BuildResponse])
+async def list_builds(
+    uid: str,
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Lists the latest builds of a lab with the timing of each stage, newest first.
+    """
+    try:
+        return [
+            BuildResponse(
+                id=str(entry["build"].id),
+                lab_uid=str(entry["build"].lab_uid),
+                template_name=entry["build"].template_name,
+                status=str(entry["build"].status),
+                started_at=entry["build"].started_at,
+                finished_at=entry["build"].finished_at,
+                duration_seconds=entry["build"].duration_seconds,
+                stages=[
+                    BuildStageResponse.model_validate(stage)
+                    for stage in entry["stages"]
+                ],
+            )
+            for entry in list_lab_builds(db, uid, limit)
+        ]
+    except OperationalError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error when listing builds: {e}",
+        )
+
+
+@router.get("/{uid}/events", response_model=List[LabEventResponse])
+async def list_lab_events(
+    uid: str,
+    after: Optional[str] = Query(
+        None, description="ID of the last event seen; only newer events are returned."
+    ),
+    limit: int = Query(100, ge=1, le=500),
+):
+    """
+    Lists the provisioning progress events of a lab (stage start/end, percent,
+    bytes, errors), oldest first. Served from Redis, so clients can poll with
+    `after` without touching the database.
+    """
+    try:
+        return await asyncio.to_thread(get_lab_events, uid, after=after, limit=limit)
+    except redis.ResponseError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid event ID: '{after}'.",
+        )
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Lab events unavailable: {e}",
+        )
+
+
+@router.get("/admin/nodes", response_model=List[NodeResponse])
+async def list_worker_nodes():
+    """
+    Lists the worker nodes labs are placed on, with the capacity announced in
+    their last heartbeat and the labs placed on them since.
+    """
+    try:
+        return await asyncio.to_thread(list_nodes)
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Node state unavailable: {e}",
+        )
+
+
+@router.get("/admin/disk", response_model=List[NodeDiskUsageResponse])
+async def get_node_disk_usage(limit: int = Query(50, ge=0, le=1000)):
+    """
+    Disk usage of every node from the disk index: bytes per lab directory,
+    snapshot, cached template and build cache (largest `limit` entries), totals
+    per kind, and the filesystem usage against the eviction watermarks.
+    """
+    try:
+        return await asyncio.to_thread(get_disk_usage, limit)
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Disk usage unavailable: {e}",
+        )
+
+
+@router.get("/admin/admission", response_model=AdmissionStatsResponse)
+async def get_admission_status(db: Session = Depends(get_db)):
+    """
+    Returns the state behind lab admission control: queued provisions, free
+    node capacity, recent throughput and estimated wait, the configured
+    limits, and the admitted/rejected counts per lane and result.
+    """
+    try:
+        return await asyncio.to_thread(get_admission_stats, db)
+    except OperationalError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database connection error while reading admission state: {e}",
+        )
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Admission stats unavailable: {e}",
+        )
+
+
+def require_profiling_token(
+    token: Optional[str] = Header(None, alias="X-Profile-Token")
+):
+    """
+    Profiles expose stacks, lab uids and paths: only holders of one of
+    PROFILING_TOKENS may read them.
+    """
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="A profiling token is required in the X-Profile-Token header.",
+        )
+    if not is_profiling_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid profiling token.",
+        )
+
+
+@router.get(
+    "/admin/profiles",
+    response_model=List[ProfileSummaryResponse],
+    dependencies=[Depends(require_profiling_token)],
+)
+async def get_profiles(limit: int = Query(20, ge=1, le=500)):
+    """
+    Lists the slowest profiled runs (API requests and Celery tasks) of every
+    node, slowest first. Profiling is opt-in: see PROFILING_TOKENS and
+    PROFILE_TASKS in config. Requires a profiling token in X-Profile-Token.
+    """
+    try:
+        return await asyncio.to_thread(list_slowest_profiles, limit)
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Profile index unavailable: {e}",
+        )
+
+
+@router.get(
+    "/admin/profiles/{profile_id}",
+    response_model=ProfileResponse,
+    dependencies=[Depends(require_profiling_token)],
+)
+async def get_profile(profile_id: str):
+    """
+    Returns a profile saved on this node: its hottest functions and its folded
+    stacks, which flame graph tools read as they are.
+    """
+    profile = await asyncio.to_thread(load_profile, profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Profile '{profile_id}' not found on this node.",
+        )
+    return profile
+
+
+@router.get("/admin/template-sync", response_model=TemplateSyncResponse)
+async def get_template_sync_status():
+    """
+    Returns the state of the template store sync: the synced revision, when
+    the repository was last checked and refreshed, and the refresh cadence.
+    """
+    try:
+        state = await asyncio.to_thread(get_template_sync_state)
+    except redis.RedisError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Template sync state unavailable: {e}",
+        )
+    state.pop("etag", None)
+    return TemplateSyncResponse(
+        **state, interval_seconds=TEMPLATE_SYNC_INTERVAL_SECONDS
+    )
+
+
+@router.post("/admin/template-sync", status_code=status.HTTP_202_ACCEPTED)
+async def trigger_template_sync():
+    """
+    Schedules an immediate, forced refresh of the template store.
+    """
+    await asyncio.to_thread(sync_template_store_task.delay, force=True)
+    return {"message": "Template sync scheduled.", "status": "accepted"}
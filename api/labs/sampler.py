@@ -0,0 +1,373 @@
+import os
+import logging
+import re
+import json
+import array
+import threading
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from redis_client import get_redis
+from config import (
+    CGROUP_ROOT,
+    LAB_ACTIVITY_CPU_PERCENT,
+    LAB_METRICS_BUFFER_SIZE,
+    LAB_METRICS_DISCOVERY_INTERVAL_SECONDS,
+    LAB_METRICS_MAX_POINTS,
+    LAB_METRICS_PUBLISH_INTERVAL_SECONDS,
+    LAB_METRICS_SAMPLE_INTERVAL_SECONDS,
+    NODE_NAME,
+)
+from .constants import (
+    COMPOSE_PROJECT_LABEL,
+    HOST_METRICS_KEY,
+    LAB_ACTIVITY_KEY,
+    LAB_METRICS_KEY_PREFIX,
+    LAB_UID_PATTERN,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_FIELDS = (
+    "timestamps",
+    "cpu_percent",
+    "memory_bytes",
+    "io_read_bps",
+    "io_write_bps",
+)
+
+_lab_uid_re = re.compile(LAB_UID_PATTERN)
+
+
+def downsample_series(
+    series: Dict[str, List[float]], max_points: int
+) -> Dict[str, List[float]]:
+    """
+    Reduces every column of `series` to at most `max_points` points by averaging
+    consecutive buckets. Timestamps keep the last value of each bucket.
+    """
+    length = len(series["timestamps"])
+    if length <= max_points:
+        return series
+
+    bucket = -(-length // max_points)
+    result = {}
+    for field, values in series.items():
+        if field == "timestamps":
+            result[field] = [
+                values[min(i + bucket, length) - 1] for i in range(0, length, bucket)
+            ]
+        else:
+            result[field] = [
+                sum(values[i : i + bucket]) / len(values[i : i + bucket])
+                for i in range(0, length, bucket)
+            ]
+    return result
+
+
+class SampleRingBuffer:
+    """
+    Fixed-size ring buffer of resource samples for one lab.
+    Each field is stored in a preallocated `array.array('d')`, so appending a
+    sample never allocates.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._columns = {
+            field: array.array("d", bytes(8 * capacity)) for field in SAMPLE_FIELDS
+        }
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, *values: float) -> None:
+        for field, value in zip(SAMPLE_FIELDS, values):
+            self._columns[field][self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def column(self, field: str) -> List[float]:
+        """Returns the samples of `field`, oldest first."""
+        values = self._columns[field]
+        if self._count < self.capacity:
+            return values[: self._count].tolist()
+        return values[self._next :].tolist() + values[: self._next].tolist()
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        if not self._count:
+            return None
+        index = (self._next - 1) % self.capacity
+        return {field: self._columns[field][index] for field in SAMPLE_FIELDS}
+
+    def series(self, max_points: Optional[int] = None) -> Dict[str, List[float]]:
+        series = {field: self.column(field) for field in SAMPLE_FIELDS}
+        if max_points:
+            series = downsample_series(series, max_points)
+        return series
+
+
+def list_lab_containers() -> Dict[str, List[str]]:
+    """
+    Maps each lab (compose project) on this host to its full container IDs,
+    using a single labeled `docker ps` call.
+    """
+    result = subprocess.run(
+        [
+            "docker",
+            "ps",
+            "--no-trunc",
+            "--filter",
+            f"label={COMPOSE_PROJECT_LABEL}",
+            "--format",
+            f'{{{{.ID}}}} {{{{.Label "{COMPOSE_PROJECT_LABEL}"}}}}',
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=30,
+    )
+
+    containers: Dict[str, List[str]] = {}
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) != 2 or not _lab_uid_re.match(parts[1]):
+            continue
+        containers.setdefault(parts[1], []).append(parts[0])
+    return containers
+
+
+def resolve_container_cgroup(container_id: str, cgroup_root: Path) -> Optional[Path]:
+    """
+    Finds the cgroup v2 directory of a container, for both the systemd and
+    the cgroupfs cgroup drivers.
+    """
+    for candidate in (
+        cgroup_root / "system.slice" / f"docker-{container_id}.scope",
+        cgroup_root / "docker" / container_id,
+    ):
+        if candidate.is_dir():
+            return candidate
+    return None
+
+
+def _read_small_file(path: str) -> bytes:
+    # os.open/os.read skip the buffered file object; these files are tiny
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+
+def read_cgroup_stats(cgroup_dir: str) -> Optional[tuple]:
+    """
+    Reads (cpu usage in usec, memory bytes, io read bytes, io write bytes)
+    from the cgroup v2 files of a container.
+    Returns None when the container went away between discovery and sampling.
+    """
+    try:
+        cpu_stat = _read_small_file(f"{cgroup_dir}/cpu.stat")
+        start = cpu_stat.index(b"usage_usec ") + 11
+        cpu_usage_usec = int(cpu_stat[start : cpu_stat.index(b"\n", start)])
+
+        memory_bytes = int(_read_small_file(f"{cgroup_dir}/memory.current"))
+
+        io_read_bytes = io_write_bytes = 0
+        try:
+            io_stat = _read_small_file(f"{cgroup_dir}/io.stat")
+        except FileNotFoundError:
+            # io controller not enabled for this cgroup
+            io_stat = b""
+        for token in io_stat.split():
+            if token.startswith(b"rbytes="):
+                io_read_bytes += int(token[7:])
+            elif token.startswith(b"wbytes="):
+                io_write_bytes += int(token[7:])
+
+        return cpu_usage_usec, memory_bytes, io_read_bytes, io_write_bytes
+    except (OSError, ValueError):
+        return None
+
+
+class LabResourceSampler:
+    """
+    Samples cgroup v2 counters for every lab container on this host and keeps
+    a ring buffer of derived rates per lab.
+
+    Container discovery (one `docker ps`) runs on its own, slower cadence;
+    each sample only reads three small files per container.
+    """
+
+    def __init__(
+        self,
+        cgroup_root: Path = CGROUP_ROOT,
+        buffer_size: int = LAB_METRICS_BUFFER_SIZE,
+        discover: Callable[[], Dict[str, List[str]]] = list_lab_containers,
+        hostname: Optional[str] = None,
+    ):
+        self.cgroup_root = Path(cgroup_root)
+        self.buffer_size = buffer_size
+        self.discover = discover
+        self.hostname = hostname or NODE_NAME
+        self.buffers: Dict[str, SampleRingBuffer] = {}
+        self._cgroups: Dict[str, List[str]] = {}
+        self._previous: Dict[str, tuple] = {}
+        # Last sample in which each lab was busy, since the last publish
+        self._active_at: Dict[str, float] = {}
+        self._sampling_cpu_seconds = 0.0
+        self._started_at = time.monotonic()
+
+    def refresh_containers(self) -> None:
+        """Re-discovers lab containers and drops state for labs that are gone."""
+        cgroups = {}
+        for uid, container_ids in self.discover().items():
+            dirs = [
+                str(path)
+                for path in (
+                    resolve_container_cgroup(container_id, self.cgroup_root)
+                    for container_id in container_ids
+                )
+                if path is not None
+            ]
+            if dirs:
+                cgroups[uid] = dirs
+
+        for uid in (set(self.buffers) | set(self._previous)) - set(cgroups):
+            self.buffers.pop(uid, None)
+            self._previous.pop(uid, None)
+            self._active_at.pop(uid, None)
+        self._cgroups = cgroups
+
+    def sample_once(self, now: Optional[float] = None) -> None:
+        """Takes one sample of every known lab and appends the derived rates."""
+        cpu_start = time.thread_time()
+        now = time.time() if now is None else now
+
+        for uid, dirs in self._cgroups.items():
+            cpu_usage_usec = memory_bytes = io_read_bytes = io_write_bytes = 0
+            for cgroup_dir in dirs:
+                stats = read_cgroup_stats(cgroup_dir)
+                if stats is None:
+                    continue
+                cpu_usage_usec += stats[0]
+                memory_bytes += stats[1]
+                io_read_bytes += stats[2]
+                io_write_bytes += stats[3]
+
+            previous = self._previous.get(uid)
+            self._previous[uid] = (now, cpu_usage_usec, io_read_bytes, io_write_bytes)
+            if previous is None or now <= previous[0]:
+                # Rates need two samples
+                continue
+
+            elapsed = now - previous[0]
+            buffer = self.buffers.get(uid)
+            if buffer is None:
+                buffer = self.buffers[uid] = SampleRingBuffer(self.buffer_size)
+            # Counters go backwards when a container is recreated; clamp to 0.
+            cpu_percent = max(cpu_usage_usec - previous[1], 0) / (elapsed * 1e6) * 100
+            if cpu_percent >= LAB_ACTIVITY_CPU_PERCENT:
+                self._active_at[uid] = now
+            buffer.append(
+                now,
+                cpu_percent,
+                memory_bytes,
+                max(io_read_bytes - previous[2], 0) / elapsed,
+                max(io_write_bytes - previous[3], 0) / elapsed,
+            )
+
+        self._sampling_cpu_seconds += time.thread_time() - cpu_start
+
+    def host_summary(self) -> dict:
+        """Totals of the latest sample of every lab on this host."""
+        summary = {
+            "host": self.hostname,
+            "labs": len(self.buffers),
+            "containers": sum(len(dirs) for dirs in self._cgroups.values()),
+            "cpu_percent": 0.0,
+            "memory_bytes": 0.0,
+            "io_read_bps": 0.0,
+            "io_write_bps": 0.0,
+            "sampler_cpu_percent": self._sampling_cpu_seconds
+            / max(time.monotonic() - self._started_at, 1e-9)
+            * 100,
+            "updated_at": time.time(),
+        }
+        for buffer in self.buffers.values():
+            latest = buffer.latest()
+            if latest is None:
+                continue
+            for field in ("cpu_percent", "memory_bytes", "io_read_bps", "io_write_bps"):
+                summary[field] += latest[field]
+        return summary
+
+    def publish(self, redis_client, max_points: int = LAB_METRICS_MAX_POINTS) -> None:
+        """
+        Publishes downsampled per-lab series and the host summary to Redis,
+        where the API reads them. Keys expire if this host stops publishing.
+        Labs that were busy are reported to the reaper, which restarts their
+        idle timeout.
+        """
+        expire_seconds = int(LAB_METRICS_PUBLISH_INTERVAL_SECONDS * 3)
+        pipe = redis_client.pipeline(transaction=False)
+        for uid, buffer in self.buffers.items():
+            payload = {
+                "uid": uid,
+                "host": self.hostname,
+                "interval_seconds": LAB_METRICS_SAMPLE_INTERVAL_SECONDS,
+                **buffer.series(max_points),
+            }
+            pipe.set(
+                f"{LAB_METRICS_KEY_PREFIX}{uid}", json.dumps(payload), ex=expire_seconds
+            )
+        pipe.hset(HOST_METRICS_KEY, self.hostname, json.dumps(self.host_summary()))
+        if self._active_at:
+            pipe.zadd(LAB_ACTIVITY_KEY, self._active_at, gt=True)
+        pipe.execute()
+        self._active_at = {}
+
+    def run(self, redis_client, stop_event: threading.Event) -> None:
+        next_discovery = next_publish = 0.0
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                if started >= next_discovery:
+                    self.refresh_containers()
+                    next_discovery = started + LAB_METRICS_DISCOVERY_INTERVAL_SECONDS
+                self.sample_once()
+                if started >= next_publish:
+                    self.publish(redis_client)
+                    next_publish = started + LAB_METRICS_PUBLISH_INTERVAL_SECONDS
+            except Exception as e:
+                logger.error(f"Lab sampler: Sampling failed on {self.hostname}: {e}")
+            stop_event.wait(
+                max(
+                    LAB_METRICS_SAMPLE_INTERVAL_SECONDS - (time.monotonic() - started),
+                    0,
+                )
+            )
+
+
+_sampler_stop = threading.Event()
+
+
+def start_lab_sampler() -> threading.Thread:
+    """Starts the resource sampler in a daemon thread of the current process."""
+    sampler = LabResourceSampler()
+    thread = threading.Thread(
+        target=sampler.run,
+        args=(get_redis(), _sampler_stop),
+        name="lab-resource-sampler",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def stop_lab_sampler() -> None:
+    _sampler_stop.set()
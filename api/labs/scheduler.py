@@ -0,0 +1,299 @@
+import os
+import logging
+import json
+import time
+import threading
+import subprocess
+from typing import Dict, List, Optional, Set
+
+import redis
+import yaml
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from redis_client import get_redis
+from config import (
+    LAB_PLACEMENT_ENABLED,
+    LAB_PLACEMENT_POLICY,
+    LAB_PLACEMENT_CACHE_AFFINITY,
+    NODE_NAME,
+    NODE_HEARTBEAT_INTERVAL_SECONDS,
+    NODE_HEARTBEAT_TTL_SECONDS,
+    NODE_MAX_LABS,
+    NODE_MIN_FREE_MEMORY_BYTES,
+    NODE_PORT_RANGE,
+)
+from labs.enum import LAB_BUILD_STATUS
+from labs.models import Lab
+from labs.prefetch import (
+    COMPOSE_FILE_NAME,
+    get_stored_template_dir,
+    list_stored_templates,
+)
+from labs.utils import is_port_in_use
+from labs.constants import NODES_KEY, NODE_RESERVATIONS_KEY, NODE_QUEUE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Labs that hold (or are about to hold) resources on their node
+ACTIVE_LAB_STATUSES = (
+    LAB_BUILD_STATUS.QUEUED.value,
+    LAB_BUILD_STATUS.PROCESSING.value,
+    LAB_BUILD_STATUS.BUILDING.value,
+    LAB_BUILD_STATUS.COMPLETED.value,
+    LAB_BUILD_STATUS.RESETTING.value,
+)
+
+
+def node_queue_name(node: str) -> str:
+    return f"{NODE_QUEUE_PREFIX}{node}"
+
+
+def read_memory_info(meminfo_path: str = "/proc/meminfo") -> tuple:
+    """Returns (total, available) memory in bytes, or (0, 0) if unknown."""
+    values = {}
+    try:
+        with open(meminfo_path, "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    values[key] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return 0, 0
+    return values.get("MemTotal", 0), values.get("MemAvailable", 0)
+
+
+def count_free_ports(port_range: tuple = NODE_PORT_RANGE) -> int:
+    first, last = port_range
+    return sum(1 for port in range(first, last + 1) if not is_port_in_use(port))
+
+
+def list_local_images() -> Set[str]:
+    """`repository:tag` of every image on this node, from a single `docker image ls`."""
+    try:
+        result = subprocess.run(
+            ["docker", "image", "ls", "--format", "{{.Repository}}:{{.Tag}}"],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Node heartbeat: Could not list local images: {e}")
+        return set()
+    return set(result.stdout.split())
+
+
+# Images of each template in the store, per store version
+_template_images: Dict[str, Dict[str, Set[str]]] = {}
+
+
+def _stored_template_images() -> Dict[str, Set[str]]:
+    version, template_names = list_stored_templates()
+    if version is None:
+        return {}
+    if version not in _template_images:
+        images = {}
+        for template_name in template_names:
+            template_dir = get_stored_template_dir(template_name)
+            if template_dir is None:
+                continue
+            try:
+                compose = yaml.safe_load(
+                    (template_dir / COMPOSE_FILE_NAME).read_text(encoding="utf-8")
+                )
+                services = (compose or {}).get("services") or {}
+            except (OSError, yaml.YAMLError):
+                continue
+            images[template_name] = {
+                (
+                    service["image"]
+                    if ":" in service["image"]
+                    else f"{service['image']}:latest"
+                )
+                for service in services.values()
+                if "image" in service
+            }
+        _template_images.clear()
+        _template_images[version] = images
+    return _template_images[version]
+
+
+def warm_templates() -> List[str]:
+    """
+    Templates this node can provision without network access: the template is
+    in the local store and all its images are already pulled.
+    """
+    local_images = list_local_images()
+    return sorted(
+        template_name
+        for template_name, images in _stored_template_images().items()
+        if images <= local_images
+    )
+
+
+def collect_node_status(db: Session, node: str = NODE_NAME) -> dict:
+    """Capacity of this node, as announced in its heartbeat."""
+    memory_total, memory_available = read_memory_info()
+    labs = (
+        db.query(func.count(Lab.uid))
+        .filter(Lab.host == node, Lab.status.in_(ACTIVE_LAB_STATUSES))
+        .scalar()
+    )
+    return {
+        "name": node,
+        "queue": node_queue_name(node),
+        "labs": labs,
+        "max_labs": NODE_MAX_LABS,
+        "cpu_count": os.cpu_count() or 1,
+        "load_1m": os.getloadavg()[0],
+        "memory_total_bytes": memory_total,
+        "memory_available_bytes": memory_available,
+        "port_range": list(NODE_PORT_RANGE),
+        "free_ports": count_free_ports(),
+        "warm_templates": warm_templates(),
+        "updated_at": time.time(),
+    }
+
+
+def publish_node_heartbeat(redis_client: redis.Redis, node: str = NODE_NAME) -> dict:
+    """
+    Publishes the node's capacity. Its lab count now includes every lab placed
+    on it so far, so the placements counted since the last heartbeat are reset.
+    """
+    db = SessionLocal()
+    try:
+        node_status = collect_node_status(db, node)
+    finally:
+        db.close()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(NODES_KEY, node, json.dumps(node_status))
+    pipe.hdel(NODE_RESERVATIONS_KEY, node)
+    pipe.execute()
+    return node_status
+
+
+def run_node_heartbeat(
+    redis_client: redis.Redis, stop_event: threading.Event, node: str = NODE_NAME
+) -> None:
+    while not stop_event.is_set():
+        try:
+            publish_node_heartbeat(redis_client, node)
+        except Exception as e:
+            logger.error(
+                f"Node heartbeat: Failed to publish the heartbeat of {node}: {e}"
+            )
+        stop_event.wait(NODE_HEARTBEAT_INTERVAL_SECONDS)
+    try:
+        # Stop receiving placements right away instead of after the TTL
+        redis_client.hdel(NODES_KEY, node)
+    except redis.RedisError:
+        pass
+
+
+_heartbeat_stop = threading.Event()
+
+
+def start_node_heartbeat() -> threading.Thread:
+    """Starts the node heartbeat in a daemon thread of the current process."""
+    thread = threading.Thread(
+        target=run_node_heartbeat,
+        args=(get_redis(), _heartbeat_stop),
+        name="node-heartbeat",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def stop_node_heartbeat() -> None:
+    _heartbeat_stop.set()
+
+
+def list_nodes(now: Optional[float] = None) -> List[dict]:
+    """
+    Returns the last heartbeat of every known node, with the number of labs
+    placed on it since (`reserved`) and whether it is still `alive`.
+    """
+    now = time.time() if now is None else now
+    redis_client = get_redis()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(NODES_KEY)
+    pipe.hgetall(NODE_RESERVATIONS_KEY)
+    heartbeats, reservations = pipe.execute()
+
+    nodes = []
+    for name, payload in sorted(heartbeats.items()):
+        node = json.loads(payload)
+        node["reserved"] = int(reservations.get(name, 0))
+        node["alive"] = now - node["updated_at"] <= NODE_HEARTBEAT_TTL_SECONDS
+        nodes.append(node)
+    return nodes
+
+
+def node_load(node: dict) -> float:
+    """Utilization of the node's scarcest resource (0 idle, 1 full)."""
+    load = [
+        (node["labs"] + node["reserved"]) / max(node["max_labs"], 1),
+        node["load_1m"] / max(node["cpu_count"], 1),
+    ]
+    if node["memory_total_bytes"]:
+        load.append(1 - node["memory_available_bytes"] / node["memory_total_bytes"])
+    return max(load)
+
+
+def _has_capacity(node: dict) -> bool:
+    return (
+        node["alive"]
+        and node["labs"] + node["reserved"] < node["max_labs"]
+        and node["free_ports"] > 0
+        and (
+            not node["memory_total_bytes"]
+            or node["memory_available_bytes"] >= NODE_MIN_FREE_MEMORY_BYTES
+        )
+    )
+
+
+def score_node(
+    node: dict, template_name: str, policy: str = LAB_PLACEMENT_POLICY
+) -> float:
+    """
+    Placement score of a node for a lab of `template_name`; lower is better.
+    `least_loaded` prefers the emptiest node, `bin_packing` the fullest node
+    that still fits. Nodes with the template warm get a bonus either way.
+    """
+    load = node_load(node)
+    score = 1 - load if policy == "bin_packing" else load
+    if template_name in node["warm_templates"]:
+        score -= LAB_PLACEMENT_CACHE_AFFINITY
+    return score
+
+
+def place_lab(template_name: str) -> Optional[str]:
+    """
+    Picks the node for a new lab and counts the placement against it until its
+    next heartbeat. Returns None when placement is disabled or no node is
+    known to have capacity, in which case any worker may take the lab.
+    """
+    if not LAB_PLACEMENT_ENABLED:
+        return None
+    try:
+        candidates = [node for node in list_nodes() if _has_capacity(node)]
+        if not candidates:
+            return None
+        # Ties (e.g. on CPU load, for nodes sharing a host) go by lab count
+        direction = -1 if LAB_PLACEMENT_POLICY == "bin_packing" else 1
+        node = min(
+            candidates,
+            key=lambda node: (
+                score_node(node, template_name),
+                direction * (node["labs"] + node["reserved"]),
+                node["name"],
+            ),
+        )
+        get_redis().hincrby(NODE_RESERVATIONS_KEY, node["name"], 1)
+    except redis.RedisError as e:
+        logger.warning(f"Lab placement unavailable, using the shared queue: {e}")
+        return None
+    return node["name"]
@@ -1,4 +1,5 @@
-from typing import Optional
+from datetime import datetime
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 
@@ -15,12 +16,33 @@ class LabResponse(BaseModel):
     name: str
     description: str
     status: str
+    expires_at: Optional[datetime] = None
+
+
+class LabExpiryResponse(BaseModel):
+    uid: str
+    ttl_minutes: Optional[int] = None
+    idle_timeout_minutes: Optional[int] = None
+    deadline_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
 
 class CreateLabResponse(BaseModel):
     message: str
     uid: str
     status: str = "accepted"
+    estimated_wait_seconds: Optional[float] = None
+
+
+class CancelLabsRequest(BaseModel):
+    uids: List[str] = []
+    template_name: Optional[str] = None
+
+
+class CancelLabsResponse(BaseModel):
+    cancelled: List[str]
+    cancelling: List[str]
+    skipped: List[str] = []
 
 
 class TemplateResponse(BaseModel):
@@ -29,3 +51,189 @@ class TemplateResponse(BaseModel):
     description: str
     logo: Optional[str] = None
     category: str
+
+
+class LabMetricsResponse(BaseModel):
+    uid: str
+    host: str
+    interval_seconds: float
+    timestamps: List[float]
+    cpu_percent: List[float]
+    memory_bytes: List[float]
+    io_read_bps: List[float]
+    io_write_bps: List[float]
+
+
+class HostMetricsResponse(BaseModel):
+    host: str
+    labs: int
+    containers: int
+    cpu_percent: float
+    memory_bytes: float
+    io_read_bps: float
+    io_write_bps: float
+    sampler_cpu_percent: float
+    updated_at: float
+
+
+class BuildStageResponse(BaseModel):
+    id: str
+    name: str
+    status: str
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_seconds: Optional[float] = None
+    bytes_transferred: Optional[int] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class BuildResponse(BaseModel):
+    id: str
+    lab_uid: str
+    template_name: Optional[str] = None
+    status: str
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_seconds: Optional[float] = None
+    stages: List[BuildStageResponse] = []
+
+
+class StageStatsResponse(BaseModel):
+    stage: str
+    count: int
+    failures: int
+    p50_seconds: Optional[float] = None
+    p95_seconds: Optional[float] = None
+
+
+class TemplateBuildStatsResponse(BaseModel):
+    template: str
+    builds: int
+    stages: List[StageStatsResponse]
+
+
+class TemplateLabSummary(BaseModel):
+    template_name: str
+    total: int
+    by_status: Dict[str, int]
+
+
+class LabSummaryResponse(BaseModel):
+    total: int
+    by_status: Dict[str, int]
+    templates: List[TemplateLabSummary]
+
+
+class TemplateSyncResponse(BaseModel):
+    status: str = "never_synced"
+    sha: Optional[str] = None
+    error: Optional[str] = None
+    interval_seconds: int
+    last_checked_at: Optional[float] = None
+    last_changed_at: Optional[float] = None
+    last_synced_at: Optional[float] = None
+    duration_seconds: Optional[float] = None
+    templates: Optional[int] = None
+    images_pulled: Optional[int] = None
+    images_failed: Optional[int] = None
+    failed_templates: List[str] = []
+
+
+class NodeResponse(BaseModel):
+    name: str
+    queue: str
+    alive: bool
+    labs: int
+    reserved: int
+    max_labs: int
+    cpu_count: int
+    load_1m: float
+    memory_total_bytes: int
+    memory_available_bytes: int
+    port_range: List[int]
+    free_ports: int
+    warm_templates: List[str] = []
+    updated_at: float
+
+
+class DiskEntryResponse(BaseModel):
+    kind: str
+    name: str
+    bytes: int
+    last_used: float
+
+
+class FilesystemUsageResponse(BaseModel):
+    total_bytes: int
+    used_bytes: int
+    free_bytes: int
+    used_percent: float
+    updated_at: float
+
+
+class NodeDiskUsageResponse(BaseModel):
+    node: str
+    total_bytes: int
+    by_kind: Dict[str, int] = {}
+    filesystem: Optional[FilesystemUsageResponse] = None
+    high_watermark_percent: float
+    low_watermark_percent: float
+    entries: List[DiskEntryResponse] = []
+
+
+class AdmissionStatsResponse(BaseModel):
+    queued: int
+    free_slots: Optional[int] = None
+    throughput_per_minute: Optional[float] = None
+    estimated_wait_seconds: Optional[float] = None
+    max_queued: int
+    priority_max_queued: int
+    client_quota: int
+    client_quota_window_seconds: int
+    decisions: Dict[str, int] = {}
+    updated_at: float
+
+
+class ProfileSummaryResponse(BaseModel):
+    id: str
+    kind: str
+    name: str
+    node: str
+    pid: int
+    started_at: float
+    duration_seconds: float
+    samples: int
+    status: Optional[int] = None
+    state: Optional[str] = None
+    request_id: Optional[str] = None
+    task_id: Optional[str] = None
+    lab_uid: Optional[str] = None
+
+
+class ProfileFunctionResponse(BaseModel):
+    function: str
+    self_samples: int
+    samples: int
+
+
+class ProfileResponse(ProfileSummaryResponse):
+    interval_seconds: float
+    top_functions: List[ProfileFunctionResponse] = []
+    stacks: Dict[str, int] = {}
+
+
+class LabEventResponse(BaseModel):
+    id: str
+    uid: str
+    event: str
+    ts: float
+    build_id: Optional[str] = None
+    stage: Optional[str] = None
+    status: Optional[str] = None
+    percent: Optional[int] = None
+    bytes: Optional[int] = None
+    duration_seconds: Optional[float] = None
+    error: Optional[str] = None
@@ -1 +1,504 @@
+import time
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config import (
+    LAB_DEFAULT_TTL_MINUTES,
+    LAB_DEFAULT_IDLE_TIMEOUT_MINUTES,
+    LAB_TEARDOWN_LEASE_SECONDS,
+    LAB_SUMMARY_FROM_COUNTERS,
+)
+from helpers import utcnow, utcfromtimestamp
+from instrumentation import (
+    LAB_STATUS_TRANSITIONS,
+    PROVISION_STAGE_DURATION,
+    observe_stage,
+)
+from labs.constants import LAB_ACTIVITY_KEY
+from labs.enum import LAB_BUILD_STATUS, LAB_EVENT_TYPE, PROVISION_STAGE, TASK_STATUS
+from labs.models import Lab, LabCounter, Build, BuildStage
+from labs.events import STAGE_PROGRESS, publish_lab_event
+from labs.admission import record_provision_finished
+from labs.cancellation import LabCancelled, request_lab_cancellation
+import labs.cache  # noqa: F401  (bumps the labs version on lab changes)
+import labs.counters  # noqa: F401  (keeps lab_counters up to date)
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_lab_lifetime(
+    template_details: dict,
+    ttl_minutes: Optional[int] = None,
+    idle_timeout_minutes: Optional[int] = None,
+) -> tuple:
+    """
+    Resolves the TTL and idle timeout for a new lab.
+    Per-lab overrides win over the template defaults, which win over the
+    global defaults from config. A value of 0 disables the limit.
+    """
+    if ttl_minutes is None:
+        ttl_minutes = template_details.get("ttl_minutes", LAB_DEFAULT_TTL_MINUTES)
+    if idle_timeout_minutes is None:
+        idle_timeout_minutes = template_details.get(
+            "idle_timeout_minutes", LAB_DEFAULT_IDLE_TIMEOUT_MINUTES
+        )
+
+    return (int(ttl_minutes) or None, int(idle_timeout_minutes) or None)
+
+
+def _compute_expires_at(
+    deadline_at: Optional[datetime], idle_timeout_minutes: Optional[int], now: datetime
+) -> Optional[datetime]:
+    candidates = []
+    if deadline_at is not None:
+        candidates.append(deadline_at)
+    if idle_timeout_minutes:
+        candidates.append(now + timedelta(minutes=idle_timeout_minutes))
+    return min(candidates) if candidates else None
+
+
+def init_lab_expiry(lab: Lab, now: Optional[datetime] = None) -> None:
+    """Sets the TTL deadline and the effective expiry of a freshly created lab."""
+    now = now or utcnow()
+    ttl_minutes = lab.ttl_minutes
+
+    deadline_at = now + timedelta(minutes=ttl_minutes) if ttl_minutes else None
+    setattr(lab, "deadline_at", deadline_at)
+    setattr(
+        lab,
+        "expires_at",
+        _compute_expires_at(deadline_at, lab.idle_timeout_minutes, now),
+    )
+
+
+def touch_lab_expiry(lab: Lab, now: Optional[datetime] = None) -> None:
+    """
+    Records activity on a lab, restarting its idle timeout.
+    The expiry never moves past the TTL deadline.
+    """
+    now = now or utcnow()
+    setattr(
+        lab,
+        "expires_at",
+        _compute_expires_at(lab.deadline_at, lab.idle_timeout_minutes, now),
+    )
+
+
+def extend_lab_expiry(lab: Lab, minutes: int, now: Optional[datetime] = None) -> None:
+    """
+    Pushes out the TTL deadline of a lab by `minutes` and counts as activity.
+    An already passed deadline is extended from `now`.
+    """
+    now = now or utcnow()
+    deadline_at = lab.deadline_at
+    if deadline_at is not None:
+        setattr(lab, "deadline_at", max(deadline_at, now) + timedelta(minutes=minutes))
+    touch_lab_expiry(lab, now)
+
+
+def set_lab_status(lab: Lab, new_status: LAB_BUILD_STATUS) -> None:
+    """
+    Moves a lab to `new_status`, counting the transition and restarting the
+    idle timeout. The caller commits.
+    """
+    LAB_STATUS_TRANSITIONS.labels(
+        from_status=lab.status or "none", to_status=new_status.value
+    ).inc()
+    setattr(lab, "status", new_status.value)
+    touch_lab_expiry(lab)
+
+
+CANCELLABLE_LAB_STATUSES = (
+    LAB_BUILD_STATUS.QUEUED.value,
+    LAB_BUILD_STATUS.PROCESSING.value,
+    LAB_BUILD_STATUS.BUILDING.value,
+)
+
+# Labs the reaper leaves alone: a task is working on them (a teardown would
+# remove their directory from under it), or there is nothing left to tear down
+UNREAPABLE_LAB_STATUSES = CANCELLABLE_LAB_STATUSES + (
+    LAB_BUILD_STATUS.RESETTING.value,
+    LAB_BUILD_STATUS.CANCELLED.value,
+    LAB_BUILD_STATUS.EXPIRED.value,
+)
+
+
+def claim_expired_labs(
+    db: Session, batch_size: int, now: Optional[datetime] = None
+) -> List[tuple]:
+    """
+    Claims a batch of expired labs for teardown; returns their (uid, host).
+    Uses the index on `expires_at`. Claimed rows keep their expiry and get a
+    `teardown_claimed_at` lease instead, so the next reaper runs skip them
+    while teardown is in flight, but claim them again once the lease lapses
+    (e.g. the teardown task was lost).
+    """
+    now = now or utcnow()
+    lease_expired_at = now - timedelta(seconds=LAB_TEARDOWN_LEASE_SECONDS)
+    query = (
+        db.query(Lab.uid, Lab.host)
+        .filter(Lab.expires_at <= now)
+        .filter(Lab.status.notin_(UNREAPABLE_LAB_STATUSES))
+        .filter(
+            (Lab.teardown_claimed_at.is_(None))
+            | (Lab.teardown_claimed_at <= lease_expired_at)
+        )
+        .order_by(Lab.expires_at.asc())
+        .limit(batch_size)
+    )
+    if db.bind is not None and db.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+
+    claimed = [(uid, host) for uid, host in query.all()]
+    if claimed:
+        db.query(Lab).filter(Lab.uid.in_([uid for uid, _ in claimed])).update(
+            {Lab.teardown_claimed_at: now}, synchronize_session=False
+        )
+    db.commit()
+    return claimed
+
+
+def refresh_lab_activity(db: Session, redis_client) -> int:
+    """
+    Restarts the idle timeout of the labs the resource samplers saw active
+    (see LAB_ACTIVITY_KEY), from the time they were last active. Returns the
+    number of labs whose expiry moved. Commits.
+    """
+    activity = dict(redis_client.zrange(LAB_ACTIVITY_KEY, 0, -1, withscores=True))
+    if not activity:
+        return 0
+
+    refreshed = 0
+    labs = (
+        db.query(Lab)
+        .filter(Lab.uid.in_(list(activity)))
+        .filter(Lab.status == LAB_BUILD_STATUS.COMPLETED.value)
+        .filter(Lab.expires_at.isnot(None))
+        .all()
+    )
+    for lab in labs:
+        expires_at = _compute_expires_at(
+            lab.deadline_at,
+            lab.idle_timeout_minutes,
+            utcfromtimestamp(activity[lab.uid]),
+        )
+        if expires_at is not None and expires_at > lab.expires_at:
+            setattr(lab, "expires_at", expires_at)
+            refreshed += 1
+    db.commit()
+    # Activity published meanwhile is dropped too; a lab that is still active
+    # is reported again at the next publish
+    redis_client.zrem(LAB_ACTIVITY_KEY, *activity)
+    return refreshed
+
+
+def cancel_lab_provisions(labs: List[Lab]) -> dict:
+    """
+    Cancels the provisions of `labs`. All are flagged in one Redis round trip,
+    before any status changes, so a provision starting meanwhile still stops.
+    Queued labs are marked cancelled right away; running ones stop at their
+    next check and clean up after themselves. Labs not being provisioned are
+    skipped. The caller locks the lab rows (SELECT ... FOR UPDATE), so that
+    no provision completes meanwhile, and commits.
+    """
+    cancellable = [lab for lab in labs if lab.status in CANCELLABLE_LAB_STATUSES]
+    if cancellable:
+        request_lab_cancellation(str(lab.uid) for lab in cancellable)
+    result = {"cancelled": [], "cancelling": [], "skipped": []}
+    for lab in labs:
+        if lab.status == LAB_BUILD_STATUS.QUEUED.value:
+            set_lab_status(lab, LAB_BUILD_STATUS.CANCELLED)
+            result["cancelled"].append(str(lab.uid))
+        elif lab.status in CANCELLABLE_LAB_STATUSES:
+            result["cancelling"].append(str(lab.uid))
+        else:
+            result["skipped"].append(str(lab.uid))
+    return result
+
+
+def start_build(db: Session, lab: Lab) -> Build:
+    """Creates and commits the Build row for a provisioning run of `lab`."""
+    uid, build_id = str(lab.uid), uuid.uuid4().hex
+    build = Build(
+        id=build_id,
+        lab_uid=uid,
+        template_name=lab.name,
+        status=TASK_STATUS.RUNNING.value,
+        started_at=utcnow(),
+    )
+    db.add(build)
+    db.commit()
+    publish_lab_event(uid, LAB_EVENT_TYPE.BUILD_STARTED, build_id=build_id, percent=0)
+    return build
+
+
+def finish_build(db: Session, build: Build, outcome: TASK_STATUS) -> None:
+    """Marks a build as finished with `outcome` and commits."""
+    finished_at = utcnow()
+    duration = (finished_at - build.started_at).total_seconds()
+    uid, build_id = str(build.lab_uid), build.id
+    setattr(build, "status", outcome.value)
+    setattr(build, "finished_at", finished_at)
+    setattr(build, "duration_seconds", duration)
+    db.commit()
+    record_provision_finished()
+    publish_lab_event(
+        uid,
+        LAB_EVENT_TYPE.BUILD_FINISHED,
+        build_id=build_id,
+        status=outcome.value,
+        percent=100 if outcome == TASK_STATUS.SUCCESS else None,
+        duration_seconds=duration,
+    )
+
+
+def record_queue_wait(db: Session, build: Build, enqueued_at: float) -> None:
+    """Records the time the provisioning task spent in the queue as a stage."""
+    now = utcnow()
+    started_at = min(utcfromtimestamp(enqueued_at), now)
+    duration = (now - started_at).total_seconds()
+    uid, build_id = str(build.lab_uid), build.id
+    db.add(
+        BuildStage(
+            id=uuid.uuid4().hex,
+            build_id=build_id,
+            name=PROVISION_STAGE.QUEUE_WAIT.value,
+            status=TASK_STATUS.SUCCESS.value,
+            started_at=started_at,
+            finished_at=now,
+            duration_seconds=duration,
+        )
+    )
+    db.commit()
+    PROVISION_STAGE_DURATION.labels(
+        stage=PROVISION_STAGE.QUEUE_WAIT.value, outcome="success"
+    ).observe(duration)
+    publish_lab_event(
+        uid,
+        LAB_EVENT_TYPE.STAGE_FINISHED,
+        build_id=build_id,
+        stage=PROVISION_STAGE.QUEUE_WAIT.value,
+        status=TASK_STATUS.SUCCESS.value,
+        percent=STAGE_PROGRESS[PROVISION_STAGE.QUEUE_WAIT][1],
+        duration_seconds=duration,
+    )
+
+
+@contextmanager
+def record_build_stage(db: Session, build: Build, stage: PROVISION_STAGE):
+    """
+    Persists a BuildStage row around one provisioning step, times it in
+    Prometheus and publishes its start and end as progress events. The stage
+    row is yielded so the step can set `bytes_transferred`. Exceptions
+    propagate after the stage is marked failed (or cancelled).
+    """
+    # Read before any commit expires them: publishing must not hit the database
+    uid, build_id = str(build.lab_uid), build.id
+    build_stage = BuildStage(
+        id=uuid.uuid4().hex,
+        build_id=build_id,
+        name=stage.value,
+        status=TASK_STATUS.RUNNING.value,
+        started_at=utcnow(),
+    )
+    db.add(build_stage)
+    db.commit()
+    start_percent, end_percent = STAGE_PROGRESS[stage]
+    publish_lab_event(
+        uid,
+        LAB_EVENT_TYPE.STAGE_STARTED,
+        build_id=build_id,
+        stage=stage.value,
+        percent=start_percent,
+    )
+
+    start = time.perf_counter()
+    try:
+        with observe_stage(stage.value):
+            yield build_stage
+    except Exception as e:
+        outcome = (
+            TASK_STATUS.CANCELLED if isinstance(e, LabCancelled) else TASK_STATUS.FAILED
+        )
+        _finish_build_stage(db, build_stage, outcome, start, str(e))
+        _publish_stage_finished(uid, build_id, stage, outcome, start, error=str(e))
+        raise
+    bytes_transferred = build_stage.bytes_transferred
+    _finish_build_stage(db, build_stage, TASK_STATUS.SUCCESS, start)
+    _publish_stage_finished(
+        uid,
+        build_id,
+        stage,
+        TASK_STATUS.SUCCESS,
+        start,
+        percent=end_percent,
+        bytes_transferred=bytes_transferred,
+    )
+
+
+def _publish_stage_finished(
+    uid: str,
+    build_id: str,
+    stage: PROVISION_STAGE,
+    outcome: TASK_STATUS,
+    start: float,
+    percent: Optional[int] = None,
+    bytes_transferred: Optional[int] = None,
+    error: Optional[str] = None,
+) -> None:
+    publish_lab_event(
+        uid,
+        LAB_EVENT_TYPE.STAGE_FINISHED,
+        build_id=build_id,
+        stage=stage.value,
+        status=outcome.value,
+        percent=percent,
+        bytes=bytes_transferred,
+        duration_seconds=time.perf_counter() - start,
+        error=error,
+    )
+
+
+def _finish_build_stage(
+    db: Session,
+    build_stage: BuildStage,
+    outcome: TASK_STATUS,
+    start: float,
+    error: Optional[str] = None,
+) -> None:
+    try:
+        if outcome != TASK_STATUS.SUCCESS:
+            # The step may have left the session in a failed transaction
+            db.rollback()
+        setattr(build_stage, "status", outcome.value)
+        setattr(build_stage, "finished_at", utcnow())
+        setattr(build_stage, "duration_seconds", time.perf_counter() - start)
+        setattr(build_stage, "error", error)
+        db.commit()
+    except SQLAlchemyError as e:
+        # Bookkeeping must never mask the outcome of the step itself
+        db.rollback()
+        logger.error(f"Build stage: Failed to record stage '{build_stage.name}': {e}")
+
+
+def list_lab_builds(db: Session, uid: str, limit: int) -> List[dict]:
+    """Returns the latest builds of a lab with their stages, newest first."""
+    builds = (
+        db.query(Build)
+        .filter(Build.lab_uid == uid)
+        .order_by(Build.started_at.desc())
+        .limit(limit)
+        .all()
+    )
+    stages_by_build: Dict[str, List[BuildStage]] = {build.id: [] for build in builds}
+    if builds:
+        stages = (
+            db.query(BuildStage)
+            .filter(BuildStage.build_id.in_(list(stages_by_build)))
+            .order_by(BuildStage.started_at.asc())
+            .all()
+        )
+        for stage in stages:
+            stages_by_build[stage.build_id].append(stage)
+
+    return [{"build": build, "stages": stages_by_build[build.id]} for build in builds]
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """Linear-interpolated percentile of an already sorted, non-empty list."""
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        position - lower
+    )
+
+
+def template_build_stats(db: Session, template_name: str, limit: int) -> dict:
+    """
+    Computes p50/p95 duration per stage over the latest `limit` builds of a
+    template. Only the (stage, status, duration) columns are loaded.
+    """
+    build_ids = (
+        db.query(Build.id)
+        .filter(Build.template_name == template_name)
+        .order_by(Build.started_at.desc())
+        .limit(limit)
+        .subquery()
+    )
+    rows = (
+        db.query(BuildStage.name, BuildStage.status, BuildStage.duration_seconds)
+        .filter(BuildStage.build_id.in_(build_ids.select()))
+        .all()
+    )
+    builds = db.query(build_ids).count()
+
+    durations: Dict[str, List[float]] = {}
+    failures: Dict[str, int] = {}
+    for name, stage_status, duration in rows:
+        if stage_status == TASK_STATUS.FAILED.value:
+            failures[name] = failures.get(name, 0) + 1
+        if stage_status == TASK_STATUS.SUCCESS.value and duration is not None:
+            durations.setdefault(name, []).append(duration)
+
+    stages = []
+    for stage in PROVISION_STAGE:
+        values = sorted(durations.get(stage.value, []))
+        stages.append(
+            {
+                "stage": stage.value,
+                "count": len(values),
+                "failures": failures.get(stage.value, 0),
+                "p50_seconds": _percentile(values, 0.5) if values else None,
+                "p95_seconds": _percentile(values, 0.95) if values else None,
+            }
+        )
+
+    return {"template": template_name, "builds": builds, "stages": stages}
+
+
+def lab_summary(db: Session) -> dict:
+    """
+    Counts labs by status and by template.
+    Reads the incrementally maintained `lab_counters` table (one row per
+    template and status) unless LAB_SUMMARY_FROM_COUNTERS is disabled, in
+    which case a single GROUP BY runs over the 'labs' table.
+    """
+    if LAB_SUMMARY_FROM_COUNTERS:
+        rows = db.query(
+            LabCounter.template_name, LabCounter.status, LabCounter.count
+        ).all()
+    else:
+        rows = (
+            db.query(Lab.name, Lab.status, func.count())
+            .group_by(Lab.name, Lab.status)
+            .all()
+        )
+
+    by_status = {lab_status.value: 0 for lab_status in LAB_BUILD_STATUS}
+    templates: Dict[str, dict] = {}
+    for template_name, lab_status, count in rows:
+        if not count:
+            continue
+        by_status[lab_status] = by_status.get(lab_status, 0) + count
+        template = templates.setdefault(
+            template_name,
+            {"template_name": template_name, "total": 0, "by_status": {}},
+        )
+        template["total"] += count
+        template["by_status"][lab_status] = count
+
+    return {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "templates": sorted(
+            templates.values(), key=lambda template: template["template_name"]
+        ),
+    }
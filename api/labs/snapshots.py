@@ -0,0 +1,232 @@
+import json
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from config import (
+    LAB_SNAPSHOT_DIR,
+    LAB_SNAPSHOT_REPOSITORY,
+    LAB_SNAPSHOT_HELPER_IMAGE,
+    NODE_NAME,
+)
+from labs.enum import DISK_USAGE_KIND
+from labs.models import LabSnapshot
+from labs.disk import forget_disk_usage, record_disk_usage
+from labs.constants import COMPOSE_PROJECT_LABEL
+from labs.utils import run_docker_compose_command
+
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+COMPOSE_VOLUME_LABEL = "com.docker.compose.volume"
+# Compose override that swaps every service's image for its snapshot
+SNAPSHOT_OVERRIDE_FILE = "compose.snapshot.yml"
+
+
+def _run_docker(args: List[str], timeout: int = 600) -> str:
+    try:
+        return subprocess.run(
+            ["docker"] + args,
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=timeout,
+        ).stdout
+    except subprocess.CalledProcessError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Docker command '{' '.join(args[:2])}' failed with exit code {e.returncode}: {e.stderr}",
+        )
+    except subprocess.TimeoutExpired:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Docker command '{' '.join(args[:2])}' timed out after {timeout} seconds.",
+        )
+
+
+def _project_containers(uid: str) -> Dict[str, str]:
+    """Maps each service of a lab's compose project to its container ID."""
+    output = _run_docker(
+        [
+            "ps",
+            "--all",
+            "--filter",
+            f"label={COMPOSE_PROJECT_LABEL}={uid}",
+            "--format",
+            f'{{{{.Label "{COMPOSE_SERVICE_LABEL}"}}}} {{{{.ID}}}}',
+        ],
+        timeout=30,
+    )
+    return dict(line.split() for line in output.splitlines() if len(line.split()) == 2)
+
+
+def _project_volumes(uid: str) -> List[str]:
+    """Names of the named volumes of a lab's compose project."""
+    output = _run_docker(
+        [
+            "volume",
+            "ls",
+            "--filter",
+            f"label={COMPOSE_PROJECT_LABEL}={uid}",
+            "--format",
+            "{{.Name}}",
+        ],
+        timeout=30,
+    )
+    return output.split()
+
+
+def snapshot_image_tag(uid: str, service_name: str) -> str:
+    return f"{LAB_SNAPSHOT_REPOSITORY}/{uid}-{service_name}:base".lower()
+
+
+def _snapshot_compose_args() -> List[str]:
+    return ["-f", "compose.yml", "-f", SNAPSHOT_OVERRIDE_FILE]
+
+
+def take_lab_snapshot(
+    db: Session, uid: str, lab_dir: str, snapshot_root: Path = LAB_SNAPSHOT_DIR
+) -> LabSnapshot:
+    """
+    Snapshots a running lab: commits every container to an image and archives
+    every named volume. The project is paused meanwhile, so the images and
+    archives are consistent with each other. Commits the LabSnapshot row.
+    """
+    snapshot_dir = snapshot_root / uid
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    containers = _project_containers(uid)
+    images: Dict[str, str] = {}
+    volumes: Dict[str, str] = {}
+    size_bytes = 0
+
+    run_docker_compose_command("", ["pause"], project_name=uid, working_dir=lab_dir)
+    try:
+        for service_name, container_id in containers.items():
+            # Size of the container's writable layer: what the commit adds
+            size_bytes += int(
+                _run_docker(
+                    ["inspect", "--size", "--format", "{{.SizeRw}}", container_id],
+                    timeout=60,
+                ).strip()
+                or 0
+            )
+            tag = snapshot_image_tag(uid, service_name)
+            _run_docker(["commit", "--pause=false", container_id, tag])
+            images[service_name] = tag
+
+        for volume_name in _project_volumes(uid):
+            archive_path = snapshot_dir / f"{volume_name}.tar"
+            _run_docker(
+                [
+                    "run",
+                    "--rm",
+                    "-v",
+                    f"{volume_name}:/volume:ro",
+                    "-v",
+                    f"{snapshot_dir}:/snapshot",
+                    LAB_SNAPSHOT_HELPER_IMAGE,
+                    "tar",
+                    "-cf",
+                    f"/snapshot/{archive_path.name}",
+                    "-C",
+                    "/volume",
+                    ".",
+                ]
+            )
+            volumes[volume_name] = str(archive_path)
+            size_bytes += archive_path.stat().st_size
+    finally:
+        run_docker_compose_command(
+            "", ["unpause"], project_name=uid, working_dir=lab_dir
+        )
+
+    override = "services:\n" + "".join(
+        f"  {json.dumps(service_name)}:\n    image: {json.dumps(tag)}\n"
+        for service_name, tag in images.items()
+    )
+    Path(lab_dir, SNAPSHOT_OVERRIDE_FILE).write_text(override, encoding="utf-8")
+
+    snapshot = db.get(LabSnapshot, uid) or LabSnapshot(lab_uid=uid)
+    setattr(snapshot, "host", NODE_NAME)
+    setattr(snapshot, "images", json.dumps(images))
+    setattr(snapshot, "volumes", json.dumps(volumes))
+    setattr(snapshot, "size_bytes", size_bytes)
+    db.add(snapshot)
+    db.commit()
+    record_disk_usage(DISK_USAGE_KIND.SNAPSHOT, uid, snapshot_dir, size_bytes)
+    return snapshot
+
+
+def restore_lab_snapshot(uid: str, lab_dir: str, snapshot: LabSnapshot) -> None:
+    """
+    Resets a lab to its snapshot: removes its containers and volumes,
+    recreates them from the snapshot images, refills the volumes from their
+    archives, then starts the lab. Nothing is downloaded or built.
+    """
+    compose_args = _snapshot_compose_args()
+    run_docker_compose_command(
+        "",
+        compose_args + ["down", "--volumes", "--remove-orphans"],
+        project_name=uid,
+        working_dir=lab_dir,
+    )
+    # Creates the containers and (empty) volumes without starting anything
+    run_docker_compose_command(
+        "",
+        compose_args + ["up", "--no-start", "--pull", "never"],
+        project_name=uid,
+        working_dir=lab_dir,
+    )
+    for volume_name, archive_path in json.loads(str(snapshot.volumes)).items():
+        archive = Path(archive_path)
+        _run_docker(
+            [
+                "run",
+                "--rm",
+                "-v",
+                f"{volume_name}:/volume",
+                "-v",
+                f"{archive.parent}:/snapshot:ro",
+                LAB_SNAPSHOT_HELPER_IMAGE,
+                "tar",
+                "-xf",
+                f"/snapshot/{archive.name}",
+                "-C",
+                "/volume",
+            ]
+        )
+    run_docker_compose_command(
+        "",
+        compose_args + ["up", "-d", "--pull", "never"],
+        project_name=uid,
+        working_dir=lab_dir,
+    )
+
+
+def delete_lab_snapshot(
+    db: Session, uid: str, snapshot_root: Path = LAB_SNAPSHOT_DIR
+) -> int:
+    """
+    Removes the snapshot images and volume archives of a lab on this node and
+    its LabSnapshot row. Returns the bytes freed (as recorded).
+    """
+    snapshot = db.get(LabSnapshot, uid)
+    images = json.loads(str(snapshot.images)) if snapshot is not None else {}
+    if images:
+        # Fails for images still used by containers; teardown removes them first
+        subprocess.run(
+            ["docker", "image", "rm", "--force"] + list(images.values()),
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+    shutil.rmtree(snapshot_root / uid, ignore_errors=True)
+    forget_disk_usage(DISK_USAGE_KIND.SNAPSHOT, uid)
+    if snapshot is None:
+        return 0
+    freed = snapshot.size_bytes or 0
+    db.delete(snapshot)
+    db.commit()
+    return freed
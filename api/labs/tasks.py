@@ -1,179 +1,751 @@
 import os
+import logging
+import time
 import yaml
+import shutil
 import asyncio
+import subprocess
+from typing import List, Optional
+
+import redis
 from fastapi import HTTPException, status
 from workers import celery_app
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import or_
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session
 from db import SessionLocal
-from labs.models import Lab
-from labs.utils import run_docker_compose_command, download_github_template_files
-from labs.enum import LAB_TASK_TYPE, LAB_BUILD_STATUS
-from labs.schemas import LabProvisionObject
-from config import LABS_DATA_DIR
+from helpers import utcnow
+from redis_client import get_redis
+from instrumentation import LAB_CANCELLATION_DURATION
+from logs import log_context
+from labs.models import Build, Lab, LabSnapshot
+from labs.services import (
+    UNREAPABLE_LAB_STATUSES,
+    claim_expired_labs,
+    refresh_lab_activity,
+    set_lab_status,
+    start_build,
+    finish_build,
+    record_queue_wait,
+    record_build_stage,
+)
+from labs.utils import (
+    run_docker_compose_command,
+    download_github_template_files,
+    parse_compose_ports,
+    is_port_in_use,
+)
+from labs.prefetch import (
+    copy_stored_template,
+    get_stored_template_dir,
+    sync_template_store,
+)
+from labs.scheduler import ACTIVE_LAB_STATUSES, list_nodes, node_queue_name
+from labs.reconciler import reconcile_node
+from labs.disk import (
+    forget_disk_usage,
+    publish_filesystem_usage,
+    record_disk_usage,
+    touch_disk_usage,
+)
+from labs.eviction import (
+    ensure_disk_space,
+    evict_cached_template_data,
+    refresh_disk_index,
+    remove_stale_lab_dirs,
+)
+from labs.cancellation import (
+    LabCancelled,
+    cancellation_requested_at,
+    clear_lab_cancellation,
+    raise_if_cancelled,
+    run_cancellable,
+)
+from labs.partitions import drop_expired_log_partitions, ensure_log_partitions
+from labs.images import build_template_images, needs_compose_build
+from labs.snapshots import (
+    delete_lab_snapshot,
+    restore_lab_snapshot,
+    take_lab_snapshot,
+)
+from labs.enum import (
+    DISK_USAGE_KIND,
+    LAB_TASK_TYPE,
+    LAB_BUILD_STATUS,
+    PROVISION_STAGE,
+    TASK_STATUS,
+)
+from config import (
+    LABS_DATA_DIR,
+    LAB_REAPER_BATCH_SIZE,
+    LAB_REAPER_MAX_BATCHES,
+    LAB_RECONCILER_INTERVAL_SECONDS,
+    DISK_MAINTENANCE_INTERVAL_SECONDS,
+    LAB_SNAPSHOTS_ENABLED,
+    LAB_START_CONTAINERS,
+    NODE_NAME,
+)
+
+logger = logging.getLogger(__name__)
 
 
-@celery_app.task(bind=True, name="task_manager", queue="controller_queue")
-def lab_task_manager(self, uid: str, type: str = LAB_TASK_TYPE.PROVISION):
+@celery_app.task(
+    bind=True, name="task_manager", queue="controller_queue", ignore_result=True
+)
+def lab_task_manager(
+    self,
+    uid: str,
+    type: str = LAB_TASK_TYPE.PROVISION,
+    enqueued_at: Optional[float] = None,
+):
     """
     Task manager for handling lab provisioning and control tasks.
     This module defines Celery tasks for creating, starting, stopping, and removing labs.
+    `enqueued_at` (epoch seconds) is set by the producer to measure queue wait.
+    Nobody waits on the result: progress is published to the lab's event stream.
+    Everything logged meanwhile carries the lab's uid.
     """
-    if type == LAB_TASK_TYPE.PROVISION:
-        print(f"Starting provisioning task for lab {uid}...")
-        return provision_lab_task(uid)
-    # elif type == LAB_TASK_TYPE.CONTROL:
-    #     print(f"Starting control task for lab {uid}...")
-    #     return control_lab_task(uid, command_type="start")
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Unknown task type: {type}",
-        )
+    with log_context(lab_uid=uid):
+        if type == LAB_TASK_TYPE.PROVISION:
+            logger.info(f"Starting provisioning task for lab {uid}...")
+            return provision_lab_task(uid, enqueued_at=enqueued_at)
+        elif type == LAB_TASK_TYPE.TEARDOWN:
+            logger.info(f"Starting teardown task for lab {uid}...")
+            return teardown_lab_task(uid)
+        elif type == LAB_TASK_TYPE.RESET:
+            logger.info(f"Starting reset task for lab {uid}...")
+            return reset_lab_task(uid)
+        # elif type == LAB_TASK_TYPE.CONTROL:
+        #     print(f"Starting control task for lab {uid}...")
+        #     return control_lab_task(uid, command_type="start")
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown task type: {type}",
+            )
 
 
-def provision_lab_task(uid: str):
+def dispatch_lab_task(
+    uid: str,
+    type: str,
+    host: Optional[str] = None,
+    priority: Optional[int] = None,
+    **kwargs,
+):
+    """
+    Enqueues a lab task on the queue of the node the lab is placed on, or on
+    the shared controller_queue for labs without a node. A lower `priority`
+    is consumed first.
+    """
+    options = {"queue": node_queue_name(host)} if host else {}
+    if priority is not None:
+        options["priority"] = priority
+    return lab_task_manager.apply_async(
+        args=(uid,), kwargs={"type": type, **kwargs}, **options
+    )
+
+
+def provision_lab_task(uid: str, enqueued_at: Optional[float] = None):
     """
     Celery task for the full lab provisioning process from a GitHub template.
     Steps:
     1. Create local lab directory.
-    2. Download template files from GitHub.
+    2. Copy template files from the local template store, or download them from GitHub.
     3. Load and validate docker-compose.yml.
-    4. Build Docker Compose services.
+    4. Build the template's images, or reuse those of the same content hash.
     5. Perform port checks.
     6. Start Docker Compose services.
+    7. Snapshot the lab, so it can be reset without provisioning it again.
+    Steps 4 to 7 only run with LAB_START_CONTAINERS.
+    Every run is recorded as a Build with one BuildStage per step. A cancelled
+    lab is checked for between the steps and while downloading or running
+    Docker, and rolled back as soon as it is seen.
     """
     db = SessionLocal()
     lab = None
+    build = None
     lab_dir = os.path.join(LABS_DATA_DIR, uid)
     try:
         lab = db.query(Lab).filter(Lab.uid == uid).first()
         if not lab:
-            print(f"Provisioning task: Lab {uid} not found in DB. Cannot provision.")
+            logger.warning(
+                f"Provisioning task: Lab {uid} not found in DB. Cannot provision."
+            )
             return
+        if (
+            lab.status == LAB_BUILD_STATUS.CANCELLED.value
+            or cancellation_requested_at(uid) is not None
+        ):
+            # Cancelled while queued: nothing was started yet
+            stop_cancelled_provision(db, lab, None, lab_dir)
+            return
+
+        if lab.host is None:
+            # Not placed (no node heartbeats): the lab lives where it is built
+            setattr(lab, "host", NODE_NAME)
+        build = start_build(db, lab)
+        if enqueued_at is not None:
+            record_queue_wait(db, build, enqueued_at)
 
-        setattr(lab, "status", LAB_BUILD_STATUS.PROCESSING.value)
+        set_lab_status(lab, LAB_BUILD_STATUS.PROCESSING)
         db.commit()
-        print(f"Lab {uid} status updated to 'building'.")
+        logger.info(f"Lab {uid} status updated to 'processing'.")
+        raise_if_cancelled(uid)
 
         # Step 1: Create a unique local directory for the lab's files
+        ensure_disk_space()
         os.makedirs(lab_dir, exist_ok=True)
-        print(f"Task: Created local lab directory: {lab_dir}")
+        logger.debug(f"Task: Created local lab directory: {lab_dir}")
 
-        # Step 2: Download all files for the specified template from GitHub
+        # Step 2: Copy the template from the local store, or download it from GitHub
+        raise_if_cancelled(uid)
         template_name = lab.uid.split("-")[0]
-        print(
-            f"Task: Downloading template '{template_name}' files from GitHub to {lab_dir}..."
-        )
-        asyncio.run(download_github_template_files(template_name, lab_dir))
-        print(f"Task: Finished downloading template '{template_name}' files.")
+        with record_build_stage(db, build, PROVISION_STAGE.TEMPLATE_DOWNLOAD) as stage:
+            downloaded_bytes = None
+            stored_template_dir = get_stored_template_dir(template_name)
+            if stored_template_dir is not None:
+                try:
+                    downloaded_bytes = copy_stored_template(
+                        stored_template_dir, lab_dir
+                    )
+                    touch_disk_usage(DISK_USAGE_KIND.TEMPLATE, template_name)
+                    logger.debug(
+                        f"Task: Copied template '{template_name}' from the template store to {lab_dir}."
+                    )
+                except OSError as e:
+                    # The store was refreshed mid-copy; fall back to GitHub
+                    logger.warning(
+                        f"Task: Could not copy template '{template_name}' from the template store: {e}"
+                    )
+
+            if downloaded_bytes is None:
+                logger.debug(
+                    f"Task: Downloading template '{template_name}' files from GitHub to {lab_dir}..."
+                )
+                downloaded_bytes = asyncio.run(
+                    run_cancellable(
+                        download_github_template_files(template_name, lab_dir), uid
+                    )
+                )
+                logger.debug(
+                    f"Task: Finished downloading template '{template_name}' files."
+                )
+            setattr(stage, "bytes_transferred", downloaded_bytes)
 
         # Step 3: Load and validate the downloaded 'docker-compose.yml' file
-        compose_file_path = os.path.join(lab_dir, "compose.yml")
-        if not os.path.exists(compose_file_path):
-            raise Exception(
-                f"Downloaded template '{template_name}' does not contain a compose.yml file."
-            )
+        with record_build_stage(db, build, PROVISION_STAGE.COMPOSE_VALIDATION):
+            compose_file_path = os.path.join(lab_dir, "compose.yml")
+            if not os.path.exists(compose_file_path):
+                raise Exception(
+                    f"Downloaded template '{template_name}' does not contain a compose.yml file."
+                )
 
-        with open(compose_file_path, "r", encoding="utf-8") as f:
-            docker_compose_content = f.read()
+            with open(compose_file_path, "r", encoding="utf-8") as f:
+                docker_compose_content = f.read()
 
-        # Validate compose content by attempting to load it
-        yaml.safe_load(docker_compose_content)
-        print(f"Task: Validated compose.yml for lab {uid}.")
+            # Validate compose content by attempting to load it
+            yaml.safe_load(docker_compose_content)
+        logger.debug(f"Task: Validated compose.yml for lab {uid}.")
 
         # Update status to building as we proceed
-        setattr(lab, "status", LAB_BUILD_STATUS.BUILDING.value)
+        set_lab_status(lab, LAB_BUILD_STATUS.BUILDING)
         db.commit()
-        print(f"Task: Lab {uid} status updated to 'building'.")
-
-        # # Step 1: Build Docker Compose services
-        # print(f"Provisioning task: Building services for lab {uid}...")
-        # build_result = run_docker_compose_command(
-        #     str(docker_compose_content), ["build"], capture_output=True
-        # )
-        # lab_build_logs = LabProvisionObject(
-        #     uid=str(lab.uid),
-        #     status=LAB_BUILD_STATUS.COMPLETED.value,
-        #     build_logs=(
-        #         getattr(build_result, "stdout", "") if build_result is not None else ""
-        #     ),
-        # )
-        # db.add(lab_build_logs)
-        # db.commit()
-        # print(
-        #     f"Build for lab {uid} completed. Output:\n{getattr(build_result, 'stdout', '') if build_result is not None else ''}"
-        # )
-
-        # lab_starting_status = LabProvisionObject(
-        #     uid=str(lab.uid),
-        #     status=LAB_STATUS.STARTING.value,
-        # )
-        # db.add(lab_starting_status)
-        # db.commit()
-        # print(f"Lab {uid} status updated to 'starting'.")
-
-        # # Step 2: Perform port check before starting
-        # host_ports = parse_compose_ports(
-        #     str(docker_compose_content) if docker_compose_content is not None else ""
-        # )
-        # has_conflict = False
-        # for port in host_ports:
-        #     if is_port_in_use(port):
-        #         has_conflict = True
-        #         print(
-        #             f"Provisioning task: Port {port} in use for lab {uid}. Cannot start."
-        #         )
-        #         break
-
-        # if has_conflict:
-        #     lab_failed_status = LabProvisionObject(
-        #         uid=str(lab.uid),
-        #         status=LAB_STATUS.FAILED.value,
-        #         run_logs="Failed to start due to port conflict.",
-        #     )
-        #     db.add(lab_failed_status)
-        #     db.commit()
-        #     print(
-        #         f"Provisioning task: Port conflict detected for lab {uid}. Lab status 'failed_port_conflict'."
-        #     )
-        #     return
-
-        # # Step 3: Start Docker Compose services
-        # print(f"Provisioning task: Starting lab {uid}...")
-        # start_result = run_docker_compose_command(
-        #     str(docker_compose_content), ["up", "-d"], capture_output=True
-        # )
-        # lab_running_status = LabProvisionObject(
-        #     uid=str(lab.uid),
-        #     status=LAB_STATUS.RUNNING.value,
-        #     run_logs=getattr(start_result, "stdout", "") if start_result is not None else "",
-        # )
-        # db.add(lab_running_status)
-        # db.commit()
-        # print(
-        #     f"Lab {uid} started. Status 'running'. Output:\n{getattr(start_result, 'stdout', '') if start_result is not None else ''}"
-        # )
+        logger.info(f"Task: Lab {uid} status updated to 'building'.")
+        raise_if_cancelled(uid)
+
+        if not LAB_START_CONTAINERS:
+            finish_build(db, build, TASK_STATUS.SUCCESS)
+            logger.info(
+                f"Task: Lab {uid} prepared; starting containers is disabled "
+                "(LAB_START_CONTAINERS)."
+            )
+            return
+
+        # Step 4: Build (or reuse) the template's images
+        with record_build_stage(db, build, PROVISION_STAGE.BUILD):
+            docker_compose_content, image_counts = build_template_images(
+                template_name, lab_dir, docker_compose_content, cancel_uid=uid
+            )
+            if needs_compose_build(docker_compose_content):
+                run_docker_compose_command(
+                    docker_compose_content,
+                    ["build"],
+                    project_name=uid,
+                    working_dir=lab_dir,
+                    cancel_uid=uid,
+                )
+        logger.info(
+            f"Task: Build for lab {uid} completed "
+            f"({image_counts['built']} image(s) built, {image_counts['cached']} reused)."
+        )
+        record_disk_usage(DISK_USAGE_KIND.LAB, uid, lab_dir)
+        raise_if_cancelled(uid)
+
+        with record_build_stage(db, build, PROVISION_STAGE.START):
+            # Step 5: Perform port check before starting
+            for port in parse_compose_ports(docker_compose_content):
+                if is_port_in_use(port):
+                    raise Exception(
+                        f"Port {port} required by lab {uid} is already in use."
+                    )
 
+            # Step 6: Start Docker Compose services
+            run_docker_compose_command(
+                docker_compose_content,
+                ["up", "-d"],
+                project_name=uid,
+                working_dir=lab_dir,
+                cancel_uid=uid,
+            )
+        raise_if_cancelled(uid)
+
+        # Step 7: Snapshot the freshly started lab
+        if LAB_SNAPSHOTS_ENABLED:
+            try:
+                with record_build_stage(db, build, PROVISION_STAGE.SNAPSHOT) as stage:
+                    snapshot = take_lab_snapshot(db, uid, lab_dir)
+                    setattr(stage, "bytes_transferred", snapshot.size_bytes)
+                logger.info(f"Task: Snapshot of lab {uid} taken.")
+            except Exception as e:
+                # The lab works without a snapshot; only resetting it does not
+                logger.warning(
+                    f"Task: Could not snapshot lab {uid}: {getattr(e, 'detail', e)}"
+                )
+
+        # Last chance to cancel. Cancel requests lock the lab row before they
+        # flag it, so either the flag is seen here or the request finds the
+        # lab completed and does not report it as being cancelled.
+        db.refresh(lab, with_for_update=True)
+        raise_if_cancelled(uid)
+        set_lab_status(lab, LAB_BUILD_STATUS.COMPLETED)
+        finish_build(db, build, TASK_STATUS.SUCCESS)
+        # A flag left by a cancel request that failed after setting it
+        clear_lab_cancellation(uid)
+        logger.info(f"Task: Lab {uid} started. Status updated to 'completed'.")
+
+    except LabCancelled:
+        db.rollback()
+        stop_cancelled_provision(db, lab, build, lab_dir)
     except OperationalError as e:
         db.rollback()
-        print(f"Provisioning task: Database error for {uid}: {e}")
+        logger.error(f"Provisioning task: Database error for {uid}: {e}")
+        discard_lab_dir(uid, lab_dir)
         if lab:
-            setattr(lab, "status", LAB_BUILD_STATUS.FAILED.value)
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
             db.commit()
+        if build:
+            finish_build(db, build, TASK_STATUS.FAILED)
     except HTTPException as e:
-        print(f"Provisioning task: Docker command failed for {uid}: {e.detail}")
+        logger.error(f"Provisioning task: Docker command failed for {uid}: {e.detail}")
+        discard_lab_dir(uid, lab_dir)
         if lab:
-            setattr(lab, "status", LAB_BUILD_STATUS.FAILED.value)
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
             db.commit()
+        if build:
+            finish_build(db, build, TASK_STATUS.FAILED)
     except Exception as e:
         db.rollback()
-        print(
+        logger.exception(
             f"Provisioning task: An unexpected error occurred during provisioning for {uid}: {e}"
         )
+        discard_lab_dir(uid, lab_dir)
         if lab:
 
-            setattr(lab, "status", LAB_BUILD_STATUS.FAILED.value)
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
+            db.commit()
+        if build:
+            finish_build(db, build, TASK_STATUS.FAILED)
+    finally:
+        db.close()
+
+
+def stop_cancelled_provision(
+    db: Session, lab: Lab, build: Optional[Build], lab_dir: str
+) -> None:
+    """
+    Rolls back a cancelled provision: removes the containers it started and
+    the lab directory, marks the lab (and its build) cancelled, and records
+    the time from the cancel request until the worker is free again. A
+    cancelled lab holds nothing to tear down, so it no longer expires.
+    """
+    uid = str(lab.uid)
+    requested_at = cancellation_requested_at(uid)
+    discard_lab_dir(uid, lab_dir)
+    if build and db.get(LabSnapshot, uid) is not None:
+        # Cancelled after the snapshot was taken
+        delete_lab_snapshot(db, uid)
+    if lab.status != LAB_BUILD_STATUS.CANCELLED.value:
+        set_lab_status(lab, LAB_BUILD_STATUS.CANCELLED)
+    setattr(lab, "expires_at", None)
+    db.commit()
+    if build:
+        finish_build(db, build, TASK_STATUS.CANCELLED)
+    clear_lab_cancellation(uid)
+    if requested_at is None:
+        logger.info(f"Provisioning task: Lab {uid} cancelled.")
+        return
+    elapsed = max(time.time() - requested_at, 0.0)
+    LAB_CANCELLATION_DURATION.labels(phase="running" if build else "queued").observe(
+        elapsed
+    )
+    logger.info(
+        f"Provisioning task: Lab {uid} cancelled, stopped {elapsed:.2f}s after the request."
+    )
+
+
+def discard_lab_dir(uid: str, lab_dir: str) -> None:
+    """
+    Removes what a failed provision left behind: any started containers, then
+    the lab directory, which nothing uses once the lab failed to provision.
+    """
+    if os.path.exists(os.path.join(lab_dir, "compose.yml")):
+        try:
+            run_docker_compose_command(
+                "",
+                ["down", "--volumes", "--remove-orphans"],
+                project_name=uid,
+                working_dir=lab_dir,
+            )
+        except HTTPException as e:
+            logger.warning(f"Provisioning task: Could not stop lab {uid}: {e.detail}")
+    shutil.rmtree(lab_dir, ignore_errors=True)
+    forget_disk_usage(DISK_USAGE_KIND.LAB, uid)
+
+
+def teardown_lab_task(uid: str):
+    """
+    Tears down an expired lab.
+    Steps:
+    1. Stop and remove the lab's Docker Compose project, if one was started.
+    2. Remove the local lab directory and the lab's snapshot.
+    3. Mark the lab as expired.
+    A lab that was extended, became busy again or is being worked on by
+    another task since it was claimed is left alone, and its claim released.
+    """
+    db = SessionLocal()
+    lab_dir = os.path.join(LABS_DATA_DIR, uid)
+    try:
+        lab = db.query(Lab).filter(Lab.uid == uid).first()
+        if not lab:
+            logger.warning(
+                f"Teardown task: Lab {uid} not found in DB. Nothing to tear down."
+            )
+            return
+        if (
+            lab.status in UNREAPABLE_LAB_STATUSES
+            or lab.expires_at is None
+            or lab.expires_at > utcnow()
+        ):
+            setattr(lab, "teardown_claimed_at", None)
+            db.commit()
+            logger.info(
+                f"Teardown task: Lab {uid} is no longer expired ('{lab.status}'). Skipped."
+            )
+            return
+
+        compose_file_path = os.path.join(lab_dir, "compose.yml")
+        if os.path.exists(compose_file_path):
+            with open(compose_file_path, "r", encoding="utf-8") as f:
+                docker_compose_content = f.read()
+            try:
+                run_docker_compose_command(
+                    docker_compose_content,
+                    ["down", "--volumes", "--remove-orphans"],
+                    project_name=uid,
+                )
+            except HTTPException as e:
+                # Removing the directory and expiring the row still frees disk
+                # and stops the reaper from retrying a lab that never started.
+                logger.error(
+                    f"Teardown task: Docker command failed for {uid}: {e.detail}"
+                )
+
+        shutil.rmtree(lab_dir, ignore_errors=True)
+        forget_disk_usage(DISK_USAGE_KIND.LAB, uid)
+        delete_lab_snapshot(db, uid)
+
+        set_lab_status(lab, LAB_BUILD_STATUS.EXPIRED)
+        setattr(lab, "expires_at", None)
+        setattr(lab, "teardown_claimed_at", None)
+        db.commit()
+        logger.info(f"Teardown task: Lab {uid} torn down and marked 'expired'.")
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"Teardown task: Database error for {uid}: {e}")
+    finally:
+        db.close()
+
+
+def reset_lab_task(uid: str):
+    """
+    Resets a lab to the snapshot taken after its first start: its containers
+    and volumes are recreated from the snapshot, without downloading or
+    building anything. Recorded as a build with a single 'reset' stage.
+    """
+    db = SessionLocal()
+    lab = None
+    build = None
+    lab_dir = os.path.join(LABS_DATA_DIR, uid)
+    try:
+        lab = db.query(Lab).filter(Lab.uid == uid).first()
+        if not lab:
+            logger.warning(f"Reset task: Lab {uid} not found in DB. Cannot reset.")
+            return
+        snapshot = db.get(LabSnapshot, uid)
+        if snapshot is None:
+            logger.warning(f"Reset task: Lab {uid} has no snapshot. Cannot reset.")
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
+            db.commit()
+            return
+
+        build = start_build(db, lab)
+        with record_build_stage(db, build, PROVISION_STAGE.RESET):
+            restore_lab_snapshot(uid, lab_dir, snapshot)
+
+        set_lab_status(lab, LAB_BUILD_STATUS.COMPLETED)
+        finish_build(db, build, TASK_STATUS.SUCCESS)
+        logger.info(f"Reset task: Lab {uid} reset to its snapshot.")
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"Reset task: Database error for {uid}: {e}")
+        if lab:
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
             db.commit()
+        if build:
+            finish_build(db, build, TASK_STATUS.FAILED)
+    except HTTPException as e:
+        logger.error(f"Reset task: Docker command failed for {uid}: {e.detail}")
+        if lab:
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
+            db.commit()
+        if build:
+            finish_build(db, build, TASK_STATUS.FAILED)
+    except Exception as e:
+        db.rollback()
+        logger.exception(
+            f"Reset task: An unexpected error occurred during reset for {uid}: {e}"
+        )
+        if lab:
+            set_lab_status(lab, LAB_BUILD_STATUS.FAILED)
+            db.commit()
+        if build:
+            finish_build(db, build, TASK_STATUS.FAILED)
+    finally:
+        db.close()
+
+
+@celery_app.task(name="reap_expired_labs", queue="controller_queue", ignore_result=True)
+def reap_expired_labs():
+    """
+    Periodic (Celery beat) task that finds expired labs and schedules their teardown.
+    The idle timeout of labs the resource samplers saw busy is restarted first.
+    Labs are claimed in batches of LAB_REAPER_BATCH_SIZE, at most
+    LAB_REAPER_MAX_BATCHES per run, so one run never floods the queue.
+    """
+    db = SessionLocal()
+    reaped = 0
+    try:
+        try:
+            refresh_lab_activity(db, get_redis())
+        except redis.RedisError as e:
+            logger.warning(f"Reaper task: Lab activity unavailable: {e}")
+        for _ in range(LAB_REAPER_MAX_BATCHES):
+            claimed = claim_expired_labs(db, LAB_REAPER_BATCH_SIZE)
+            for uid, host in claimed:
+                dispatch_lab_task(uid, LAB_TASK_TYPE.TEARDOWN, host)
+            reaped += len(claimed)
+            if len(claimed) < LAB_REAPER_BATCH_SIZE:
+                break
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"Reaper task: Database error while claiming expired labs: {e}")
+    finally:
+        db.close()
+
+    if reaped:
+        logger.info(f"Reaper task: Scheduled teardown for {reaped} expired lab(s).")
+    return reaped
+
+
+def _live_hosts() -> List[str]:
+    """Nodes that hold live labs or sent a recent heartbeat."""
+    db = SessionLocal()
+    try:
+        hosts = {
+            host
+            for (host,) in db.query(Lab.host)
+            .filter(Lab.host.isnot(None), Lab.status.in_(ACTIVE_LAB_STATUSES))
+            .distinct()
+            .all()
+        }
+    except OperationalError as e:
+        logger.error(f"Task: Database error while listing nodes: {e}")
+        return []
+    finally:
+        db.close()
+    try:
+        hosts |= {node["name"] for node in list_nodes() if node["alive"]}
+    except redis.RedisError as e:
+        logger.warning(f"Task: Node heartbeats unavailable: {e}")
+    return sorted(hosts)
+
+
+@celery_app.task(name="reconcile_labs", queue="controller_queue", ignore_result=True)
+def reconcile_labs():
+    """
+    Periodic (Celery beat) task that schedules a reconciliation of lab statuses
+    against actual containers on every node that has live labs or a heartbeat.
+    """
+    hosts = _live_hosts()
+    for host in hosts:
+        # A run that waited past the next one is superseded by it
+        reconcile_node_labs.apply_async(
+            queue=node_queue_name(host),
+            expires=LAB_RECONCILER_INTERVAL_SECONDS or None,
+        )
+    return len(hosts)
+
+
+@celery_app.task(name="reconcile_node_labs", ignore_result=True)
+def reconcile_node_labs():
+    """Reconciles the labs of the node running this task (see labs/reconciler.py)."""
+    db = SessionLocal()
+    try:
+        return reconcile_node(db, NODE_NAME)
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"Reconciler task: Database error on {NODE_NAME}: {e}")
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(
+            f"Reconciler task: Could not list containers on {NODE_NAME}: {e}"
+        )
+    finally:
+        db.close()
+
+
+@celery_app.task(name="manage_disk", queue="controller_queue", ignore_result=True)
+def manage_disk():
+    """
+    Periodic (Celery beat) task that schedules disk maintenance on every node
+    with live labs or a heartbeat.
+    """
+    hosts = _live_hosts()
+    for host in hosts:
+        manage_node_disk.apply_async(
+            queue=node_queue_name(host),
+            expires=DISK_MAINTENANCE_INTERVAL_SECONDS or None,
+        )
+    return len(hosts)
+
+
+@celery_app.task(name="manage_node_disk", ignore_result=True)
+def manage_node_disk():
+    """
+    Disk maintenance of the node running this task: brings the disk index up
+    to date, removes stale lab directories, publishes the filesystem usage
+    and evicts cached template data above the high watermark.
+    """
+    db = SessionLocal()
+    try:
+        refreshed = refresh_disk_index()
+        stale = remove_stale_lab_dirs(db)
+        evicted = evict_cached_template_data()
+        publish_filesystem_usage()
+        return {"index": refreshed, "stale_labs": stale, "evicted": evicted}
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"Disk task: Database error on {NODE_NAME}: {e}")
+    except (OSError, redis.RedisError) as e:
+        logger.error(f"Disk task: Maintenance failed on {NODE_NAME}: {e}")
+    finally:
+        db.close()
+
+
+@celery_app.task(
+    name="sync_template_store", queue="controller_queue", ignore_result=True
+)
+def sync_template_store_task(force: bool = False):
+    """
+    Periodic (Celery beat) task that refreshes the local template store when
+    the templates changed upstream, so provisioning never waits on GitHub.
+    """
+    sync_template_store(force=force)
+
+
+@celery_app.task(
+    name="maintain_build_log_partitions",
+    queue="controller_queue",
+    ignore_result=True,
+)
+def maintain_build_log_partitions():
+    """
+    Periodic (Celery beat) task that creates the build log partitions ahead of
+    time and drops those past BUILD_LOG_RETENTION_DAYS.
+    """
+    db = SessionLocal()
+    try:
+        created = ensure_log_partitions(db)
+        db.commit()
+        dropped = drop_expired_log_partitions(db)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Build log task: Could not maintain the log partitions: {e}")
+        return None
+    finally:
+        db.close()
+
+    if created or dropped:
+        logger.info(
+            f"Build log task: Created partitions {created or 'none'}, "
+            f"dropped {dropped or 'none'}."
+        )
+    return {"created": created, "dropped": dropped}
+
+
+@celery_app.task(name="gc_lab_snapshots", queue="controller_queue", ignore_result=True)
+def gc_lab_snapshots():
+    """
+    Periodic (Celery beat) task that cleans up snapshots left behind by labs
+    that expired or no longer exist (e.g. a teardown that failed), on the node
+    holding each snapshot.
+    """
+    db = SessionLocal()
+    try:
+        orphans = (
+            db.query(LabSnapshot.lab_uid, LabSnapshot.host)
+            .outerjoin(Lab, Lab.uid == LabSnapshot.lab_uid)
+            .filter(
+                or_(Lab.uid.is_(None), Lab.status == LAB_BUILD_STATUS.EXPIRED.value)
+            )
+            .all()
+        )
+    except OperationalError as e:
+        logger.error(f"Snapshot GC task: Database error while listing snapshots: {e}")
+        return 0
+    finally:
+        db.close()
+
+    for uid, host in orphans:
+        options = {"queue": node_queue_name(host)} if host else {}
+        delete_lab_snapshot_task.apply_async(args=(uid,), **options)
+    if orphans:
+        logger.info(
+            f"Snapshot GC task: Scheduled removal of {len(orphans)} snapshot(s)."
+        )
+    return len(orphans)
+
+
+@celery_app.task(name="delete_lab_snapshot", ignore_result=True)
+def delete_lab_snapshot_task(uid: str):
+    """Removes the snapshot of a lab on the node that holds it."""
+    db = SessionLocal()
+    try:
+        freed = delete_lab_snapshot(db, uid)
+        logger.info(f"Snapshot GC task: Removed snapshot of {uid} ({freed} bytes).")
+    except OperationalError as e:
+        db.rollback()
+        logger.error(f"Snapshot GC task: Database error for {uid}: {e}")
     finally:
         db.close()
 
@@ -1,4 +1,5 @@
 import os
+import logging
 import json
 import yaml
 import shutil
@@ -7,7 +8,7 @@ import socket
 import tempfile
 import httpx
 from pathlib import Path
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from functools import lru_cache
 from typing import Optional, List, Union
 from fastapi import HTTPException, status
@@ -23,8 +24,10 @@ from .constants import (
     GITHUB_TEMPLATES_BASE_PATH,
     GITHUB_TEMPLATES_INDEX_FILE,
 )
+from .github import get_github_client, github_get
+from .cancellation import LabCancelled, run_cancellable_process
 
-github_client = httpx.AsyncClient()
+logger = logging.getLogger(__name__)
 
 
 def is_port_in_use(port: int) -> bool:
@@ -112,8 +115,8 @@ def _extract_host_port(
         return None
 
     except (ValueError, TypeError) as e:
-        print(
-            f"Warning: Could not parse port '{port_mapping}' for service '{service_name}': {e}"
+        logger.warning(
+            f"Could not parse port '{port_mapping}' for service '{service_name}': {e}"
         )
         return None
 
@@ -173,9 +176,13 @@ def run_docker_compose_command(
     capture_output: bool = True,
     stream_output: bool = False,
     timeout: int = 300,
+    project_name: Optional[str] = None,
+    working_dir: Optional[str] = None,
+    cancel_uid: Optional[str] = None,
 ) -> Optional[Union[subprocess.CompletedProcess, subprocess.Popen]]:
     """
-    Runs a docker-compose command in a temporary directory.
+    Runs a docker-compose command in a temporary directory, or in `working_dir`
+    when the compose file (and any build context) is already on disk there.
 
     Args:
         docker_compose_content: YAML content for docker-compose.yml
@@ -183,31 +190,46 @@ def run_docker_compose_command(
         capture_output: Whether to capture command output
         stream_output: Whether to stream output (returns Popen object)
         timeout: Command timeout in seconds
+        project_name: Compose project name; defaults to the directory name
+        working_dir: Directory containing the compose file to run against
+        cancel_uid: Lab whose cancellation kills the command (see labs/cancellation.py)
 
     Returns:
         CompletedProcess for regular execution, Popen for streaming
 
     Raises:
         HTTPException: For various Docker Compose execution errors
+        LabCancelled: When the lab `cancel_uid` was cancelled meanwhile
     """
     try:
         docker_compose_cmd = _get_docker_compose_command()
+        if project_name:
+            docker_compose_cmd = docker_compose_cmd + ["-p", project_name]
         full_command = docker_compose_cmd + command
 
-        with _temporary_compose_file(docker_compose_content) as temp_dir:
+        compose_dir = (
+            nullcontext(working_dir)
+            if working_dir
+            else _temporary_compose_file(docker_compose_content)
+        )
+        with compose_dir as cwd:
             if stream_output:
                 return subprocess.Popen(
                     full_command,
-                    cwd=temp_dir,
+                    cwd=cwd,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.STDOUT,
                     text=True,
                     bufsize=1,
                 )
+            elif cancel_uid is not None:
+                return run_cancellable_process(
+                    full_command, cancel_uid, timeout, cwd=cwd
+                )
             else:
                 return subprocess.run(
                     full_command,
-                    cwd=temp_dir,
+                    cwd=cwd,
                     capture_output=capture_output,
                     text=True,
                     check=True,
@@ -224,6 +246,8 @@ def run_docker_compose_command(
             status_code=status.HTTP_504_GATEWAY_TIMEOUT,
             detail=f"Docker Compose command timed out after {timeout} seconds.",
         )
+    except LabCancelled:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -234,16 +258,10 @@ def run_docker_compose_command(
 async def fetch_github_file_content(file_url: str) -> str:
     """
     Fetches the raw content of a file from a GitHub raw content URL, for use directly by API endpoints.
-    Uses the shared github_client instance.
+    Goes through the shared GitHub fetcher (conditional requests, retries, cache fallback).
     """
-    headers = {}
-    # if GITHUB_TOKEN:
-    #     headers["Authorization"] = f"token {GITHUB_TOKEN}"
-
     try:
-        response = await github_client.get(
-            file_url, headers=headers, follow_redirects=True
-        )
+        response = await github_get(file_url, "raw")
         response.raise_for_status()
         return response.text
     except httpx.HTTPStatusError as e:
@@ -258,39 +276,63 @@ async def fetch_github_file_content(file_url: str) -> str:
         )
 
 
-async def fetch_template_metadata_list() -> list:
+def _templates_index_url() -> str:
+    return (
+        f"{GITHUB_RAW_BASE}/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/{GITHUB_BRANCH}/"
+        f"{GITHUB_TEMPLATES_INDEX_FILE}"
+    )
+
+
+async def check_template_source() -> None:
     """
-    Fetches the list of templates from the GitHub repository's metadata file.
-    Returns a list of TemplateResponse objects.
+    Checks that the templates index is reachable, without downloading it.
+    Raises on network errors and non-success responses.
     """
-    if not GITHUB_REPO_OWNER or not GITHUB_REPO_NAME:
+    response = await get_github_client().head(
+        _templates_index_url(), follow_redirects=True
+    )
+    response.raise_for_status()
+
+
+def parse_template_index(index_content: str) -> list:
+    """Parses the templates index file, which must hold a JSON list."""
+    try:
+        templates_data = json.loads(index_content)
+    except json.JSONDecodeError:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="GitHub repository owner, name, or base templates path not configured.",
+            detail=f"Invalid JSON format in templates index file: {_templates_index_url()}",
         )
 
-    try:
-        templates_index_url = (
-            f"{GITHUB_RAW_BASE}/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/{GITHUB_BRANCH}/"
-            f"{GITHUB_TEMPLATES_INDEX_FILE}"
+    if not isinstance(templates_data, list):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Unexpected format for templates index file. Expected a list of templates.",
         )
 
-        index_content = await fetch_github_file_content(templates_index_url)
-        templates_data = json.loads(index_content)
+    return templates_data
 
-        if not isinstance(templates_data, list):
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Unexpected format for templates index file. Expected a list of templates.",
-            )
 
-        return templates_data
-    except json.JSONDecodeError:
+async def fetch_template_index_content() -> str:
+    """
+    Fetches the raw content of the templates index file from the GitHub repository.
+    """
+    if not GITHUB_REPO_OWNER or not GITHUB_REPO_NAME:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Invalid JSON format in templates index file: {templates_index_url}",
+            detail="GitHub repository owner, name, or base templates path not configured.",
         )
 
+    return await fetch_github_file_content(_templates_index_url())
+
+
+async def fetch_template_metadata_list() -> list:
+    """
+    Fetches the list of templates from the GitHub repository's metadata file.
+    Returns a list of TemplateResponse objects.
+    """
+    return parse_template_index(await fetch_template_index_content())
+
 
 async def fetch_template_details(template_name: str) -> dict:
     """
@@ -309,10 +351,41 @@ async def fetch_template_details(template_name: str) -> dict:
     )
 
 
-async def download_github_template_files(template_name: str, local_target_dir: str):
+async def fetch_templates_revision() -> tuple:
+    """
+    Returns (commit SHA, ETag) of the latest commit touching the templates
+    directory. The GitHub fetcher revalidates its cached copy, so when nothing
+    changed GitHub answers 304, which does not count against the rate limit.
+    """
+    commits_api_url = (
+        f"{GITHUB_API_BASE}/repos/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/commits"
+    )
+    response = await github_get(
+        commits_api_url,
+        "commits",
+        params={
+            "sha": GITHUB_BRANCH,
+            "path": GITHUB_TEMPLATES_BASE_PATH,
+            "per_page": 1,
+        },
+    )
+    response.raise_for_status()
+    commits = response.json()
+    if not isinstance(commits, list) or not commits:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"No commits found for '{GITHUB_TEMPLATES_BASE_PATH}' in GitHub repository '{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}'.",
+        )
+    return commits[0]["sha"], response.headers.get("etag")
+
+
+async def download_github_template_files(
+    template_name: str, local_target_dir: str
+) -> int:
     """
     Downloads all files from a specific template directory in the GitHub repository
     to a local target directory.
+    Returns the number of bytes written.
     """
 
     # GitHub API endpoint to list contents of a specific template directory
@@ -322,7 +395,7 @@ async def download_github_template_files(template_name: str, local_target_dir: s
     )
 
     try:
-        response = await github_client.get(contents_api_url)
+        response = await github_get(contents_api_url, "contents")
         response.raise_for_status()
         contents = response.json()
 
@@ -334,24 +407,34 @@ async def download_github_template_files(template_name: str, local_target_dir: s
 
         os.makedirs(local_target_dir, exist_ok=True)
 
+        total_bytes = 0
         for item in contents:
             if item["type"] == "file":
                 file_name = item["name"]
                 download_url = item["download_url"]  # This is the raw content URL
                 local_file_path = os.path.join(local_target_dir, file_name)
 
-                print(
-                    f"Downloading {file_name} to {local_file_path} from {download_url}"
+                # Once per file: lazy formatting, so it costs nothing when off
+                logger.debug(
+                    "Downloading %s to %s from %s",
+                    file_name,
+                    local_file_path,
+                    download_url,
                 )
                 file_content = await fetch_github_file_content(download_url)
                 with open(local_file_path, "w", encoding="utf-8") as f:
                     f.write(file_content)
+                total_bytes += len(file_content.encode("utf-8"))
             elif item["type"] == "dir":
-                print(
-                    f"Skipping subdirectory: {item['path']} within template {template_name}"
+                logger.debug(
+                    "Skipping subdirectory: %s within template %s",
+                    item["path"],
+                    template_name,
                 )
                 pass
 
+        return total_bytes
+
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             raise HTTPException(
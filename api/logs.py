@@ -0,0 +1,198 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_LEVELS, LOG_QUEUE_SIZE, LOG_SAMPLING
+from instrumentation import LOG_RECORDS_DROPPED
+
+# Attached to every record emitted while they are set
+lab_uid_var: ContextVar[Optional[str]] = ContextVar("lab_uid", default=None)
+task_id_var: ContextVar[Optional[str]] = ContextVar("task_id", default=None)
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+CONTEXT_VARS = {
+    "lab_uid": lab_uid_var,
+    "task_id": task_id_var,
+    "request_id": request_id_var,
+}
+
+# Attributes every LogRecord has; anything else was passed with `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_traceback_formatter = logging.Formatter()
+_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@contextmanager
+def log_context(**values):
+    """Sets context vars (lab_uid, task_id, request_id) for the enclosed code."""
+    tokens = [
+        (CONTEXT_VARS[name], CONTEXT_VARS[name].set(value))
+        for name, value in values.items()
+    ]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the context vars onto the record. Runs in the emitting thread,
+    before the record is queued, since the writer thread has no context.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in CONTEXT_VARS.items():
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records below WARNING of the modules in
+    `rates` (the longest matching module prefix wins); warnings and errors
+    are always kept.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._cache: dict = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate, length = 1.0, -1
+            for prefix, prefix_rate in self.rates.items():
+                if (name == prefix or name.startswith(prefix + ".")) and len(
+                    prefix
+                ) > length:
+                    rate, length = prefix_rate, len(prefix)
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.labels(reason="sampled").inc()
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the writer thread; drops them when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback while their objects are alive, but
+        # keep them apart, so the writer can lay them out as JSON
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, context and extras."""
+
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_VARS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in CONTEXT_VARS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == "text":
+        return logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(lab_uid)s] %(message)s"
+        )
+    return JsonFormatter()
+
+
+def _start_listener() -> None:
+    global _listener
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(_formatter())
+    _listener = logging.handlers.QueueListener(
+        _handler.queue, stream, respect_handler_level=False
+    )
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    if _listener is not None:
+        # Writes what is still queued before the process exits
+        _listener.stop()
+
+
+def _restart_after_fork() -> None:
+    # Threads do not survive fork (Celery prefork pool, gunicorn workers):
+    # the child gets a fresh queue and writer thread of its own
+    if _handler is not None:
+        _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        _start_listener()
+
+
+def configure_logging() -> None:
+    """
+    Routes all logging through a queue: emitting a record only formats its
+    message and enqueues it, while a background thread writes it to stdout.
+    Sets the per-module levels and sampling from config. Idempotent.
+    """
+    global _handler
+    if _handler is not None:
+        return
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(ContextFilter())
+    _handler.addFilter(SamplingFilter(LOG_SAMPLING))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,36 @@
+"""Add lab TTL, idle timeout and expiry columns
+
+Revision ID: 7c1e9b4d2f60
+Revises: 25773d2caa8a
+Create Date: 2026-10-19 09:12:41.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e9b4d2f60'
+down_revision: Union[str, Sequence[str], None] = '25773d2caa8a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('labs', sa.Column('ttl_minutes', sa.Integer(), nullable=True))
+    op.add_column('labs', sa.Column('idle_timeout_minutes', sa.Integer(), nullable=True))
+    op.add_column('labs', sa.Column('deadline_at', sa.DateTime(), nullable=True))
+    op.add_column('labs', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_labs_expires_at'), 'labs', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_labs_expires_at'), table_name='labs')
+    op.drop_column('labs', 'expires_at')
+    op.drop_column('labs', 'deadline_at')
+    op.drop_column('labs', 'idle_timeout_minutes')
+    op.drop_column('labs', 'ttl_minutes')
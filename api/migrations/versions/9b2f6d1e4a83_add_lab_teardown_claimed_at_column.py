@@ -0,0 +1,35 @@
+"""Add lab teardown_claimed_at column
+
+Revision ID: 9b2f6d1e4a83
+Revises: f1c4e8a2d7b6
+Create Date: 2026-10-19 21:04:12.518330
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b2f6d1e4a83'
+down_revision: Union[str, Sequence[str], None] = 'f1c4e8a2d7b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('labs', sa.Column('teardown_claimed_at', sa.DateTime(), nullable=True))
+    # Labs claimed before this revision had their expiry cleared instead;
+    # give those that never finished tearing down a deadline again
+    op.execute(
+        "UPDATE labs SET expires_at = updated_at "
+        "WHERE expires_at IS NULL AND status <> 'expired' "
+        "AND (ttl_minutes IS NOT NULL OR idle_timeout_minutes IS NOT NULL)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('labs', 'teardown_claimed_at')
@@ -0,0 +1,30 @@
+"""Add lab host column
+
+Revision ID: a5d91f3c7e28
+Revises: e4a7c2f19b35
+Create Date: 2026-10-19 16:21:37.203954
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5d91f3c7e28'
+down_revision: Union[str, Sequence[str], None] = 'e4a7c2f19b35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('labs', sa.Column('host', sa.String(), nullable=True))
+    op.create_index(op.f('ix_labs_host'), 'labs', ['host'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_labs_host'), table_name='labs')
+    op.drop_column('labs', 'host')
@@ -0,0 +1,66 @@
+"""Create Build, BuildStage tables
+
+Revision ID: b3d58e0a91c4
+Revises: 7c1e9b4d2f60
+Create Date: 2026-10-19 11:03:27.518902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3d58e0a91c4'
+down_revision: Union[str, Sequence[str], None] = '7c1e9b4d2f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('builds',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('lab_uid', sa.String(), nullable=True),
+    sa.Column('template_name', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('duration_seconds', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['lab_uid'], ['labs.uid'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_builds_id'), 'builds', ['id'], unique=False)
+    op.create_index(op.f('ix_builds_lab_uid'), 'builds', ['lab_uid'], unique=False)
+    op.create_index(op.f('ix_builds_template_name'), 'builds', ['template_name'], unique=False)
+    op.create_table('build_stages',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('build_id', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('duration_seconds', sa.Float(), nullable=True),
+    sa.Column('bytes_transferred', sa.BigInteger(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['build_id'], ['builds.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_build_stages_id'), 'build_stages', ['id'], unique=False)
+    op.create_index(op.f('ix_build_stages_build_id'), 'build_stages', ['build_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_build_stages_build_id'), table_name='build_stages')
+    op.drop_index(op.f('ix_build_stages_id'), table_name='build_stages')
+    op.drop_table('build_stages')
+    op.drop_index(op.f('ix_builds_template_name'), table_name='builds')
+    op.drop_index(op.f('ix_builds_lab_uid'), table_name='builds')
+    op.drop_index(op.f('ix_builds_id'), table_name='builds')
+    op.drop_table('builds')
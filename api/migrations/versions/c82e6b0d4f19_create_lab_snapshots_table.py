@@ -0,0 +1,40 @@
+"""Create lab_snapshots table
+
+Revision ID: c82e6b0d4f19
+Revises: a5d91f3c7e28
+Create Date: 2026-10-19 17:08:52.917340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c82e6b0d4f19'
+down_revision: Union[str, Sequence[str], None] = 'a5d91f3c7e28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('lab_snapshots',
+    sa.Column('lab_uid', sa.String(), nullable=False),
+    sa.Column('host', sa.String(), nullable=True),
+    sa.Column('images', sa.Text(), nullable=False),
+    sa.Column('volumes', sa.Text(), nullable=False),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['lab_uid'], ['labs.uid'], ),
+    sa.PrimaryKeyConstraint('lab_uid')
+    )
+    op.create_index(op.f('ix_lab_snapshots_host'), 'lab_snapshots', ['host'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_lab_snapshots_host'), table_name='lab_snapshots')
+    op.drop_table('lab_snapshots')
@@ -0,0 +1,38 @@
+"""Create lab_counters table
+
+Revision ID: e4a7c2f19b35
+Revises: b3d58e0a91c4
+Create Date: 2026-10-19 15:42:08.114263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a7c2f19b35'
+down_revision: Union[str, Sequence[str], None] = 'b3d58e0a91c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('lab_counters',
+    sa.Column('template_name', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('template_name', 'status')
+    )
+    # Backfill from the existing labs; the application keeps them up to date from here on
+    op.execute(
+        "INSERT INTO lab_counters (template_name, status, count) "
+        "SELECT name, status, COUNT(*) FROM labs GROUP BY name, status"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('lab_counters')
@@ -0,0 +1,72 @@
+"""Replace build_logs with the logs table, range-partitioned on PostgreSQL
+
+Revision ID: f1c4e8a2d7b6
+Revises: c82e6b0d4f19
+Create Date: 2026-10-19 22:41:09.163524
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from labs.partitions import DEFAULT_LOG_PARTITION, ensure_log_partitions
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c4e8a2d7b6'
+down_revision: Union[str, Sequence[str], None] = 'c82e6b0d4f19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Never written to: superseded by logs, tied to build stages
+    op.drop_index(op.f('ix_build_logs_id'), table_name='build_logs')
+    op.drop_table('build_logs')
+
+    op.create_table('logs',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('logged_at', sa.DateTime(), nullable=False),
+    sa.Column('lab_uid', sa.String(), nullable=False),
+    sa.Column('build_id', sa.String(), nullable=True),
+    sa.Column('build_stage_id', sa.String(), nullable=True),
+    sa.Column('is_error', sa.Boolean(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['lab_uid'], ['labs.uid'], ),
+    sa.ForeignKeyConstraint(['build_id'], ['builds.id'], ),
+    sa.ForeignKeyConstraint(['build_stage_id'], ['build_stages.id'], ),
+    sa.PrimaryKeyConstraint('id', 'logged_at'),
+    postgresql_partition_by='RANGE (logged_at)'
+    )
+    # Created on the partitioned table, indexes apply to every partition
+    op.create_index('ix_logs_lab_uid_logged_at', 'logs', ['lab_uid', 'logged_at'], unique=False, postgresql_include=['id', 'build_id', 'build_stage_id', 'is_error'])
+    op.create_index('ix_logs_build_id_logged_at', 'logs', ['build_id', 'logged_at'], unique=False)
+
+    if op.get_context().dialect.name == 'postgresql':
+        # Catches rows outside every range partition, should creating them lag
+        op.execute(f'CREATE TABLE {DEFAULT_LOG_PARTITION} PARTITION OF logs DEFAULT')
+        if not context.is_offline_mode():
+            # Later ones are created by the maintain_build_log_partitions task
+            ensure_log_partitions(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Dropping the partitioned table drops its partitions
+    op.drop_index('ix_logs_build_id_logged_at', table_name='logs')
+    op.drop_index('ix_logs_lab_uid_logged_at', table_name='logs')
+    op.drop_table('logs')
+
+    op.create_table('build_logs',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('lab_uid', sa.String(), nullable=True),
+    sa.Column('log_content', sa.Text(), nullable=False),
+    sa.Column('is_error', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['lab_uid'], ['labs.uid'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_build_logs_id'), 'build_logs', ['id'], unique=False)
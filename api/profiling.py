@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import redis
+
+from redis_client import get_redis
+from config import (
+    NODE_NAME,
+    PROFILE_DIR,
+    PROFILE_INDEX_SIZE,
+    PROFILE_MAX_FILES,
+    PROFILE_SAMPLE_INTERVAL_SECONDS,
+    PROFILE_TASKS,
+    PROFILING_TOKENS,
+)
+from labs.constants import PROFILE_INDEX_KEY, PROFILE_SUMMARIES_KEY
+
+logger = logging.getLogger(__name__)
+
+# Stacks deeper than this are cut at the root end
+MAX_STACK_DEPTH = 128
+# Stacks and functions kept in a saved profile
+MAX_SAVED_STACKS = 500
+MAX_TOP_FUNCTIONS = 30
+
+# Runs per profiled Celery task name in this process
+_task_runs: Counter = Counter()
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every `interval` seconds from a background
+    thread, so the profiled code runs unmodified. The cost is one stack walk
+    per sample, independent of how many calls the code makes.
+
+    Profiling the event loop thread of the API also samples whatever other
+    requests run concurrently on it.
+    """
+
+    def __init__(
+        self,
+        thread_id: Optional[int] = None,
+        interval: float = PROFILE_SAMPLE_INTERVAL_SECONDS,
+    ):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._start = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="vlem-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self.duration = time.perf_counter() - self._start
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+                )
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self, limit: int = MAX_TOP_FUNCTIONS) -> List[dict]:
+        """Functions by samples spent in them (self) and under them (total)."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for function in set(frames):
+                total[function] += count
+        return [
+            {"function": function, "self_samples": own[function], "samples": samples}
+            for function, samples in total.most_common(limit)
+        ]
+
+
+def is_profiling_token(token: Optional[str]) -> bool:
+    return bool(token) and any(
+        hmac.compare_digest(token, profiling_token)
+        for profiling_token in PROFILING_TOKENS
+    )
+
+
+def should_profile_task(task_name: str) -> bool:
+    """True for every Nth run of a task listed in PROFILE_TASKS."""
+    every = PROFILE_TASKS.get(task_name)
+    if not every:
+        return False
+    _task_runs[task_name] += 1
+    return _task_runs[task_name] % every == 0
+
+
+def _prune_profiles(profile_dir: Path) -> None:
+    files = sorted(profile_dir.glob("*.json"), key=lambda path: path.stat().st_mtime)
+    for path in files[: max(len(files) - PROFILE_MAX_FILES, 0)]:
+        path.unlink(missing_ok=True)
+
+
+def _index_profile(summary: dict) -> None:
+    """Adds a profile to the index, keeping only the slowest PROFILE_INDEX_SIZE."""
+    redis_client = get_redis()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zadd(PROFILE_INDEX_KEY, {summary["id"]: summary["duration_seconds"]})
+    pipe.hset(PROFILE_SUMMARIES_KEY, summary["id"], json.dumps(summary))
+    pipe.zrange(PROFILE_INDEX_KEY, 0, -PROFILE_INDEX_SIZE - 1)
+    pipe.zremrangebyrank(PROFILE_INDEX_KEY, 0, -PROFILE_INDEX_SIZE - 1)
+    dropped = pipe.execute()[2]
+    if dropped:
+        redis_client.hdel(PROFILE_SUMMARIES_KEY, *dropped)
+
+
+def save_profile(
+    profiler: SamplingProfiler,
+    kind: str,
+    name: str,
+    profile_dir: Path = PROFILE_DIR,
+    **details,
+) -> str:
+    """
+    Writes a finished profile to `profile_dir` (dropping the oldest beyond
+    PROFILE_MAX_FILES) and indexes its summary by duration. Returns its id.
+    """
+    profile_id = f"{int(profiler.started_at)}-{uuid.uuid4().hex[:8]}"
+    summary = {
+        "id": profile_id,
+        "kind": kind,
+        "name": name,
+        "node": NODE_NAME,
+        "pid": os.getpid(),
+        "started_at": profiler.started_at,
+        "duration_seconds": profiler.duration,
+        "samples": profiler.samples,
+        **details,
+    }
+    profile = {
+        **summary,
+        "interval_seconds": profiler.interval,
+        "top_functions": profiler.top_functions(),
+        # Folded stacks ("root;...;leaf": samples), as flame graph tools take
+        "stacks": dict(profiler.stacks.most_common(MAX_SAVED_STACKS)),
+    }
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    path = profile_dir / f"{profile_id}.json"
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(profile))
+    tmp_path.replace(path)
+    _prune_profiles(profile_dir)
+    try:
+        _index_profile(summary)
+    except redis.RedisError as e:
+        logger.warning(f"Could not index profile {profile_id}: {e}")
+    logger.info(
+        f"Profiled {kind} '{name}' in {profiler.duration:.3f}s "
+        f"({profiler.samples} samples): {profile_id}"
+    )
+    return profile_id
+
+
+def list_slowest_profiles(limit: int = 20) -> List[dict]:
+    """Summaries of the slowest captured runs, of every node, slowest first."""
+    redis_client = get_redis()
+    ids = redis_client.zrevrange(PROFILE_INDEX_KEY, 0, limit - 1)
+    if not ids:
+        return []
+    summaries = redis_client.hmget(PROFILE_SUMMARIES_KEY, ids)
+    return [json.loads(summary) for summary in summaries if summary is not None]
+
+
+def load_profile(profile_id: str, profile_dir: Path = PROFILE_DIR) -> Optional[Dict]:
+    """A profile saved on this node, or None (unknown, pruned or elsewhere)."""
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    try:
+        return json.loads((profile_dir / f"{profile_id}.json").read_text())
+    except FileNotFoundError:
+        return None
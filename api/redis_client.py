@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+import redis
+
+from config import REDIS_URL
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> redis.Redis:
+    """
+    Returns the shared Redis client.
+    The client (and its connection pool) is created on first use, so importing
+    this module never opens a connection.
+    """
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
@@ -0,0 +1,136 @@
+import os
+
+# The tests run on SQLite; set before `db` creates its engine
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", "sqlite://")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import labs.admission
+import labs.cache
+import labs.cancellation
+import labs.disk
+import labs.events
+import labs.tasks
+from db import Base
+
+# Modules that talk to Redis through `get_redis()` on the paths under test
+REDIS_MODULES = (
+    labs.admission,
+    labs.cache,
+    labs.cancellation,
+    labs.disk,
+    labs.events,
+    labs.tasks,
+)
+
+
+class FakePipeline:
+    """Runs the queued commands on the fake and returns their results."""
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._results = []
+
+    def __getattr__(self, name):
+        command = getattr(self._redis, name)
+
+        def queue(*args, **kwargs):
+            self._results.append(command(*args, **kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        results, self._results = self._results, []
+        return results
+
+
+class FakeRedis:
+    """The few Redis commands the code under test uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+        return 1
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hdel(self, key, *fields):
+        values = self.data.get(key, {})
+        return sum(values.pop(field, None) is not None for field in fields)
+
+    def xadd(self, key, entry, maxlen=None, approximate=True):
+        stream = self.data.setdefault(key, [])
+        stream.append(entry)
+        return f"{len(stream)}-0"
+
+    def zadd(self, key, mapping, gt=False):
+        values = self.data.setdefault(key, {})
+        for member, score in mapping.items():
+            if not gt or score > values.get(member, float("-inf")):
+                values[member] = score
+        return len(mapping)
+
+    def zrange(self, key, start, end, withscores=False):
+        members = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        return members if withscores else [member for member, _ in members]
+
+    def zrem(self, key, *members):
+        values = self.data.get(key, {})
+        return sum(values.pop(member, None) is not None for member in members)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis_client = FakeRedis()
+    for module in REDIS_MODULES:
+        monkeypatch.setattr(module, "get_redis", lambda: redis_client)
+    return redis_client
+
+
+@pytest.fixture
+def db(monkeypatch, fake_redis):
+    """A session on an in-memory SQLite database, also used by the tasks."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(labs.tasks, "SessionLocal", session_factory)
+    session = session_factory()
+    yield session
+    session.close()
+    engine.dispose()
@@ -0,0 +1,212 @@
+import asyncio
+import subprocess
+import threading
+import time
+
+import pytest
+
+import labs.cancellation
+import labs.tasks
+from labs.cancellation import (
+    LabCancelled,
+    cancellation_requested_at,
+    request_lab_cancellation,
+    run_cancellable,
+    run_cancellable_process,
+)
+from labs.enum import LAB_BUILD_STATUS, TASK_STATUS
+from labs.models import Build, Lab, LabSnapshot
+from labs.services import cancel_lab_provisions, start_build
+from labs.tasks import provision_lab_task, stop_cancelled_provision
+
+UID = "web-0123456789ab"
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(labs.cancellation, "LAB_CANCEL_POLL_INTERVAL_SECONDS", 0.05)
+
+
+def cancel_later(uid, delay=0.2):
+    timer = threading.Timer(delay, request_lab_cancellation, args=([uid],))
+    timer.start()
+    return timer
+
+
+def add_lab(db, uid=UID, lab_status=LAB_BUILD_STATUS.QUEUED):
+    lab = Lab(uid=uid, name=uid.split("-")[0], status=lab_status.value, host="node-1")
+    db.add(lab)
+    db.commit()
+    return lab
+
+
+def test_process_runs_to_completion_without_a_cancel(fake_redis):
+    result = run_cancellable_process(["echo", "started"], UID, timeout=10)
+
+    assert result.stdout == "started\n"
+
+
+def test_process_group_is_killed_when_the_lab_is_cancelled(fake_redis):
+    cancel_later(UID)
+    started = time.monotonic()
+
+    # The shell forks `sleep`, which would keep stdout open if only the
+    # shell itself was killed
+    with pytest.raises(LabCancelled):
+        run_cancellable_process(["sh", "-c", "sleep 30; true"], UID, timeout=30)
+
+    assert time.monotonic() - started < 5
+
+
+def test_process_still_times_out(fake_redis):
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_cancellable_process(["sleep", "30"], UID, timeout=0.2)
+
+
+def test_coroutine_is_cancelled_with_the_lab(fake_redis):
+    outcome = {}
+
+    async def download():
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            outcome["cancelled"] = True
+            raise
+
+    cancel_later(UID)
+    with pytest.raises(LabCancelled):
+        asyncio.run(run_cancellable(download(), UID))
+
+    assert outcome == {"cancelled": True}
+
+
+def test_queued_lab_is_cancelled_right_away(db):
+    lab = add_lab(db)
+
+    result = cancel_lab_provisions([lab])
+    db.commit()
+
+    assert result == {"cancelled": [UID], "cancelling": [], "skipped": []}
+    assert lab.status == LAB_BUILD_STATUS.CANCELLED.value
+    # Flagged too, in case its provision already started
+    assert cancellation_requested_at(UID) is not None
+
+
+def test_running_lab_is_left_to_clean_up_after_itself(db, tmp_path):
+    lab = add_lab(db, lab_status=LAB_BUILD_STATUS.BUILDING)
+    build = start_build(db, lab)
+
+    result = cancel_lab_provisions([lab])
+    db.commit()
+
+    assert result == {"cancelled": [], "cancelling": [UID], "skipped": []}
+    assert lab.status == LAB_BUILD_STATUS.BUILDING.value
+    assert cancellation_requested_at(UID) is not None
+
+    # What the provision does once it sees the flag
+    lab_dir = tmp_path / UID
+    lab_dir.mkdir()
+    stop_cancelled_provision(db, lab, build, str(lab_dir))
+
+    assert lab.status == LAB_BUILD_STATUS.CANCELLED.value
+    assert lab.expires_at is None
+    assert db.get(Build, build.id).status == TASK_STATUS.CANCELLED.value
+    assert not lab_dir.exists()
+    assert cancellation_requested_at(UID) is None
+
+
+def test_labs_not_being_provisioned_are_skipped(db):
+    lab = add_lab(db, lab_status=LAB_BUILD_STATUS.COMPLETED)
+
+    result = cancel_lab_provisions([lab])
+
+    assert result == {"cancelled": [], "cancelling": [], "skipped": [UID]}
+    assert cancellation_requested_at(UID) is None
+
+
+@pytest.fixture
+def provision(monkeypatch, tmp_path):
+    """Runs provision_lab_task against a template store and a no-op Docker."""
+    store = tmp_path / "store"
+    store.mkdir()
+    (store / "compose.yml").write_text("services:\n  web:\n    image: nginx\n")
+
+    def copy_stored_template(source, destination):
+        (tmp_path / "labs" / UID / "compose.yml").write_text(
+            (store / "compose.yml").read_text()
+        )
+        return 1
+
+    steps = {
+        "LABS_DATA_DIR": str(tmp_path / "labs"),
+        "LAB_START_CONTAINERS": True,
+        "LAB_SNAPSHOTS_ENABLED": True,
+        "ensure_disk_space": lambda: None,
+        "get_stored_template_dir": lambda name: str(store),
+        "copy_stored_template": copy_stored_template,
+        "build_template_images": lambda name, lab_dir, content, cancel_uid: (
+            content,
+            {"built": 0, "cached": 1},
+        ),
+        "record_disk_usage": lambda kind, name, path: None,
+        "run_docker_compose_command": lambda *args, **kwargs: None,
+    }
+    for name, value in steps.items():
+        monkeypatch.setattr(labs.tasks, name, value)
+
+    def run(take_snapshot):
+        monkeypatch.setattr(labs.tasks, "take_lab_snapshot", take_snapshot)
+        provision_lab_task(UID)
+
+    return run
+
+
+def add_snapshot(db, uid, lab_dir=None):
+    snapshot = LabSnapshot(lab_uid=uid, images="{}", volumes="{}", size_bytes=1)
+    db.add(snapshot)
+    db.commit()
+    return snapshot
+
+
+def test_completed_provision_clears_a_leftover_flag(db, provision, monkeypatch):
+    add_lab(db)
+    finish_build = labs.tasks.finish_build
+
+    def finish_build_after_a_late_flag(build_db, build, outcome):
+        # E.g. set by a cancel request that failed after flagging the lab
+        request_lab_cancellation([UID])
+        finish_build(build_db, build, outcome)
+
+    monkeypatch.setattr(labs.tasks, "finish_build", finish_build_after_a_late_flag)
+
+    provision(add_snapshot)
+
+    db.expire_all()
+    assert db.get(Lab, UID).status == LAB_BUILD_STATUS.COMPLETED.value
+    assert db.get(LabSnapshot, UID) is not None
+    assert cancellation_requested_at(UID) is None
+
+
+def test_cancel_during_the_snapshot_is_honoured(db, provision, monkeypatch):
+    add_lab(db)
+    deleted = []
+
+    def delete_snapshot(snapshot_db, uid):
+        deleted.append(uid)
+        snapshot_db.delete(snapshot_db.get(LabSnapshot, uid))
+        snapshot_db.commit()
+
+    monkeypatch.setattr(labs.tasks, "delete_lab_snapshot", delete_snapshot)
+
+    def take_snapshot(snapshot_db, uid, lab_dir):
+        # Arrives after the checks around the Docker steps
+        request_lab_cancellation([uid])
+        return add_snapshot(snapshot_db, uid)
+
+    provision(take_snapshot)
+
+    db.expire_all()
+    assert db.get(Lab, UID).status == LAB_BUILD_STATUS.CANCELLED.value
+    assert deleted == [UID]
+    assert db.get(LabSnapshot, UID) is None
+    assert cancellation_requested_at(UID) is None
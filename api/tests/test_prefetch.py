@@ -0,0 +1,55 @@
+import os
+import time
+
+import pytest
+
+import labs.prefetch
+from labs.prefetch import _materialize, get_stored_template_dir
+
+COMPOSE = "services:\n  web:\n    image: nginx\n"
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path, fake_redis):
+    monkeypatch.setattr(labs.prefetch, "TEMPLATE_SYNC_PULL_IMAGES", False)
+    monkeypatch.setattr(labs.prefetch, "TEMPLATE_STORE_RETENTION_SECONDS", 3600)
+    return tmp_path
+
+
+def sync(store_dir, version):
+    template_dir = store_dir / f".{version}.partial" / "web"
+    template_dir.mkdir(parents=True)
+    (template_dir / "compose.yml").write_text(COMPOSE)
+    _materialize(version, [{"name": "web"}], store_dir)
+
+
+def replaced_long_ago(version_dir):
+    then = time.time() - 7200
+    os.utime(version_dir, (then, then))
+
+
+def test_replaced_versions_are_kept_for_the_retention_period(store):
+    sync(store, "v1")
+    sync(store, "v2")
+
+    # A provision that read CURRENT before the switch can still copy from v1
+    assert (store / "v1" / "web" / "compose.yml").is_file()
+    assert get_stored_template_dir("web", store) == store / "v2" / "web"
+
+    replaced_long_ago(store / "v1")
+    sync(store, "v3")
+
+    assert sorted(entry.name for entry in store.iterdir() if entry.is_dir()) == [
+        "v2",
+        "v3",
+    ]
+
+
+def test_forced_resync_sets_the_previous_copy_aside(store):
+    sync(store, "v1")
+    sync(store, "v1")
+
+    versions = sorted(entry.name for entry in store.iterdir() if entry.is_dir())
+    assert versions[0] == "v1"
+    assert len(versions) == 2 and versions[1].startswith("v1.")
+    assert get_stored_template_dir("web", store) == store / "v1" / "web"
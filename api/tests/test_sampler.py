@@ -0,0 +1,227 @@
+import pytest
+
+from labs.constants import LAB_ACTIVITY_KEY
+from labs.sampler import (
+    SAMPLE_FIELDS,
+    LabResourceSampler,
+    SampleRingBuffer,
+    downsample_series,
+)
+
+WEB_LAB = "web-0123456789ab"
+DB_LAB = "db-0123456789ab"
+
+
+class FakeCgroupTree:
+    """
+    A cgroup v2 hierarchy on disk with the files the sampler reads, laid out
+    like the systemd ("system.slice/docker-<id>.scope") or the cgroupfs
+    ("docker/<id>") cgroup driver.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def write(
+        self,
+        container_id,
+        cpu_usec=0,
+        memory=0,
+        rbytes=0,
+        wbytes=0,
+        driver="systemd",
+        io=True,
+    ):
+        if driver == "systemd":
+            path = self.root / "system.slice" / f"docker-{container_id}.scope"
+        else:
+            path = self.root / "docker" / container_id
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "cpu.stat").write_text(
+            f"usage_usec {cpu_usec}\nuser_usec {cpu_usec}\nsystem_usec 0\n"
+        )
+        (path / "memory.current").write_text(f"{memory}\n")
+        if io:
+            (path / "io.stat").write_text(
+                f"8:0 rbytes={rbytes} wbytes={wbytes} rios=1 wios=1 dbytes=0 dios=0\n"
+                f"8:16 rbytes={rbytes} wbytes={wbytes} rios=1 wios=1 dbytes=0 dios=0\n"
+            )
+
+
+@pytest.fixture
+def cgroups(tmp_path):
+    return FakeCgroupTree(tmp_path)
+
+
+def make_sampler(cgroups, containers, buffer_size=4):
+    sampler = LabResourceSampler(
+        cgroup_root=cgroups.root,
+        buffer_size=buffer_size,
+        discover=lambda: containers,
+        hostname="node-1",
+    )
+    sampler.refresh_containers()
+    return sampler
+
+
+def test_rates_are_derived_from_cgroup_counters(cgroups):
+    cgroups.write("c1", cpu_usec=1_000_000, memory=100, rbytes=0, wbytes=0)
+    cgroups.write("c2", cpu_usec=0, memory=50, driver="cgroupfs", io=False)
+    sampler = make_sampler(cgroups, {WEB_LAB: ["c1", "c2"]})
+
+    sampler.sample_once(now=100.0)
+    # The first sample only sets the baseline
+    assert WEB_LAB not in sampler.buffers
+
+    cgroups.write("c1", cpu_usec=3_000_000, memory=300, rbytes=1000, wbytes=500)
+    cgroups.write("c2", cpu_usec=1_000_000, memory=200, driver="cgroupfs", io=False)
+    sampler.sample_once(now=110.0)
+
+    assert sampler.buffers[WEB_LAB].latest() == {
+        "timestamps": 110.0,
+        # 3s of CPU time over 10s, summed over both containers
+        "cpu_percent": pytest.approx(30.0),
+        "memory_bytes": 500.0,
+        # Both devices of io.stat count
+        "io_read_bps": 200.0,
+        "io_write_bps": 100.0,
+    }
+
+
+def test_ring_buffer_wraps_around(cgroups):
+    cgroups.write("c1")
+    sampler = make_sampler(cgroups, {WEB_LAB: ["c1"]}, buffer_size=3)
+
+    for second in range(6):
+        cgroups.write("c1", cpu_usec=second * 100_000, memory=second)
+        sampler.sample_once(now=float(second))
+
+    buffer = sampler.buffers[WEB_LAB]
+    assert len(buffer) == 3
+    # Oldest first, only the last three of the five derived samples
+    assert buffer.column("timestamps") == [3.0, 4.0, 5.0]
+    assert buffer.column("memory_bytes") == [3.0, 4.0, 5.0]
+    assert buffer.column("cpu_percent") == pytest.approx([10.0, 10.0, 10.0])
+
+
+def test_counters_going_backwards_are_clamped(cgroups):
+    cgroups.write("c1", cpu_usec=5_000_000, rbytes=1000)
+    sampler = make_sampler(cgroups, {WEB_LAB: ["c1"]})
+    sampler.sample_once(now=0.0)
+
+    # The container was recreated: its counters restart from 0
+    cgroups.write("c1", cpu_usec=0, rbytes=0)
+    sampler.sample_once(now=1.0)
+
+    latest = sampler.buffers[WEB_LAB].latest()
+    assert latest["cpu_percent"] == 0
+    assert latest["io_read_bps"] == 0
+
+
+def test_downsample_series_averages_buckets():
+    series = {
+        "timestamps": [float(i) for i in range(10)],
+        "cpu_percent": [float(i) for i in range(10)],
+    }
+
+    result = downsample_series(series, 4)
+
+    # Buckets of 3 samples: [0, 1, 2], [3, 4, 5], [6, 7, 8], [9]
+    assert result["timestamps"] == [2.0, 5.0, 8.0, 9.0]
+    assert result["cpu_percent"] == [1.0, 4.0, 7.0, 9.0]
+    assert downsample_series(series, 10) is series
+
+
+def test_ring_buffer_series_is_downsampled_after_wraparound():
+    buffer = SampleRingBuffer(4)
+    for i in range(6):
+        buffer.append(*(float(i) for _ in SAMPLE_FIELDS))
+
+    series = buffer.series(max_points=2)
+
+    assert series["timestamps"] == [3.0, 5.0]
+    assert series["memory_bytes"] == [2.5, 4.5]
+
+
+def test_host_summary_totals_the_latest_sample_of_every_lab(cgroups):
+    cgroups.write("c1")
+    cgroups.write("c2")
+    cgroups.write("c3", driver="cgroupfs")
+    sampler = make_sampler(cgroups, {WEB_LAB: ["c1", "c2"], DB_LAB: ["c3"]})
+    sampler.sample_once(now=0.0)
+
+    cgroups.write("c1", cpu_usec=1_000_000, memory=1000, rbytes=100)
+    cgroups.write("c2", cpu_usec=500_000, memory=2000, wbytes=100)
+    cgroups.write("c3", cpu_usec=500_000, memory=4000, driver="cgroupfs")
+    sampler.sample_once(now=10.0)
+
+    summary = sampler.host_summary()
+    assert summary["host"] == "node-1"
+    assert summary["labs"] == 2
+    assert summary["containers"] == 3
+    assert summary["cpu_percent"] == pytest.approx(20.0)
+    assert summary["memory_bytes"] == 7000.0
+    assert summary["io_read_bps"] == pytest.approx(20.0)
+    assert summary["io_write_bps"] == pytest.approx(20.0)
+
+
+def test_labs_that_are_gone_are_dropped(cgroups):
+    containers = {WEB_LAB: ["c1"], DB_LAB: ["c2"]}
+    cgroups.write("c1")
+    cgroups.write("c2")
+    sampler = make_sampler(cgroups, containers)
+    sampler.sample_once(now=0.0)
+    sampler.sample_once(now=1.0)
+    assert set(sampler.buffers) == {WEB_LAB, DB_LAB}
+
+    del containers[DB_LAB]
+    sampler.refresh_containers()
+
+    assert set(sampler.buffers) == {WEB_LAB}
+    assert sampler.host_summary()["labs"] == 1
+
+
+def test_containers_without_a_cgroup_are_skipped(cgroups):
+    cgroups.write("c1")
+    sampler = make_sampler(cgroups, {WEB_LAB: ["c1", "missing"], DB_LAB: ["gone"]})
+
+    assert sampler.host_summary()["containers"] == 1
+    sampler.sample_once(now=0.0)
+    sampler.sample_once(now=1.0)
+    assert set(sampler.buffers) == {WEB_LAB}
+
+
+class RecordingRedis:
+    """Records the commands of a non-transactional pipeline."""
+
+    def __init__(self):
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return []
+
+
+def test_busy_labs_are_reported_as_activity(cgroups):
+    cgroups.write("c1")
+    cgroups.write("c2")
+    sampler = make_sampler(cgroups, {WEB_LAB: ["c1"], DB_LAB: ["c2"]})
+    sampler.sample_once(now=0.0)
+    # 50% CPU for the web lab, an idle database lab
+    cgroups.write("c1", cpu_usec=5_000_000)
+    sampler.sample_once(now=10.0)
+
+    redis_client = RecordingRedis()
+    sampler.publish(redis_client)
+    activity = [args for name, args, _ in redis_client.commands if name == "zadd"]
+    assert activity == [(LAB_ACTIVITY_KEY, {WEB_LAB: 10.0})]
+
+    # Reported once per busy period
+    redis_client = RecordingRedis()
+    sampler.publish(redis_client)
+    assert not [name for name, _, _ in redis_client.commands if name == "zadd"]
@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+import pytest
+
+import labs.tasks
+from config import LAB_TEARDOWN_LEASE_SECONDS
+from helpers import utcnow
+from labs.enum import LAB_BUILD_STATUS
+from labs.models import Lab
+from labs.services import claim_expired_labs, extend_lab_expiry
+from labs.tasks import teardown_lab_task
+
+
+@pytest.fixture
+def lab_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(labs.tasks, "LABS_DATA_DIR", str(tmp_path))
+    return tmp_path
+
+
+def add_lab(db, uid, lab_status=LAB_BUILD_STATUS.COMPLETED, expired_for=60):
+    deadline_at = utcnow() - timedelta(seconds=expired_for)
+    lab = Lab(
+        uid=uid,
+        name=uid.split("-")[0],
+        status=lab_status.value,
+        host="node-1",
+        ttl_minutes=60,
+        deadline_at=deadline_at,
+        expires_at=deadline_at,
+    )
+    db.add(lab)
+    db.commit()
+    return lab
+
+
+def test_only_expired_labs_nobody_works_on_are_claimed(db):
+    add_lab(db, "web-000000000001")
+    add_lab(db, "web-000000000002", expired_for=-60)
+    for number, lab_status in enumerate(
+        (
+            LAB_BUILD_STATUS.QUEUED,
+            LAB_BUILD_STATUS.BUILDING,
+            LAB_BUILD_STATUS.RESETTING,
+            LAB_BUILD_STATUS.CANCELLED,
+            LAB_BUILD_STATUS.EXPIRED,
+        ),
+        start=3,
+    ):
+        add_lab(db, f"web-00000000000{number}", lab_status)
+    add_lab(db, "web-000000000008", LAB_BUILD_STATUS.FAILED)
+
+    claimed = claim_expired_labs(db, batch_size=10)
+
+    assert sorted(uid for uid, _ in claimed) == [
+        "web-000000000001",
+        "web-000000000008",
+    ]
+    lab = db.get(Lab, "web-000000000001")
+    # Claimed labs keep their expiry
+    assert lab.teardown_claimed_at is not None
+    assert lab.expires_at is not None
+
+
+def test_claim_is_retaken_once_the_lease_lapses(db):
+    add_lab(db, "web-000000000001")
+    now = utcnow()
+
+    assert claim_expired_labs(db, batch_size=10, now=now) == [
+        ("web-000000000001", "node-1")
+    ]
+    # Teardown in flight: the next reaper runs leave the lab alone
+    assert claim_expired_labs(db, batch_size=10, now=now + timedelta(minutes=1)) == []
+
+    # The teardown task was lost
+    later = now + timedelta(seconds=LAB_TEARDOWN_LEASE_SECONDS + 1)
+    assert claim_expired_labs(db, batch_size=10, now=later) == [
+        ("web-000000000001", "node-1")
+    ]
+
+
+def test_teardown_releases_the_claim_of_an_extended_lab(db, lab_dirs):
+    lab = add_lab(db, "web-000000000001")
+    (lab_dirs / lab.uid).mkdir()
+    claim_expired_labs(db, batch_size=10)
+
+    extend_lab_expiry(lab, 30)
+    db.commit()
+    teardown_lab_task(lab.uid)
+
+    db.expire_all()
+    lab = db.get(Lab, "web-000000000001")
+    assert lab.status == LAB_BUILD_STATUS.COMPLETED.value
+    assert lab.teardown_claimed_at is None
+    assert lab.expires_at > utcnow()
+    assert (lab_dirs / lab.uid).exists()
+    # Not claimed again until it expires
+    assert claim_expired_labs(db, batch_size=10) == []
+
+
+def test_teardown_expires_the_lab_and_releases_the_claim(db, lab_dirs):
+    lab = add_lab(db, "web-000000000001")
+    (lab_dirs / lab.uid).mkdir()
+    claim_expired_labs(db, batch_size=10)
+
+    teardown_lab_task(lab.uid)
+
+    db.expire_all()
+    lab = db.get(Lab, "web-000000000001")
+    assert lab.status == LAB_BUILD_STATUS.EXPIRED.value
+    assert lab.teardown_claimed_at is None
+    assert lab.expires_at is None
+    assert not (lab_dirs / lab.uid).exists()
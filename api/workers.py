@@ -1,5 +1,38 @@
+import logging
+
 from celery import Celery
-from config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, CELERY_INCLUDE_MODULES
+from celery.signals import (
+    celeryd_after_setup,
+    setup_logging,
+    task_postrun,
+    task_prerun,
+    worker_ready,
+    worker_shutdown,
+    worker_process_shutdown,
+)
+from config import (
+    CELERY_BROKER_URL,
+    CELERY_RESULT_BACKEND,
+    CELERY_INCLUDE_MODULES,
+    LAB_REAPER_INTERVAL_SECONDS,
+    LAB_RECONCILER_INTERVAL_SECONDS,
+    DISK_MAINTENANCE_INTERVAL_SECONDS,
+    BUILD_LOG_MAINTENANCE_INTERVAL_SECONDS,
+    LAB_SNAPSHOTS_ENABLED,
+    LAB_SNAPSHOT_GC_INTERVAL_SECONDS,
+    TEMPLATE_SYNC_INTERVAL_SECONDS,
+    LAB_METRICS_ENABLED,
+    LAB_PLACEMENT_ENABLED,
+    NODE_NAME,
+    WORKER_METRICS_PORT,
+)
+from instrumentation import start_metrics_server, mark_process_dead
+from logs import configure_logging, task_id_var
+from profiling import SamplingProfiler, save_profile, should_profile_task
+from labs.sampler import start_lab_sampler, stop_lab_sampler
+from labs.scheduler import node_queue_name, start_node_heartbeat, stop_node_heartbeat
+
+logger = logging.getLogger(__name__)
 
 celery_app = Celery(
     "lab_manager",
@@ -13,3 +46,134 @@ celery_app.conf.task_queues = {
     "controller_queue": {"exchange": "controller_queue", "exchange_type": "direct"},
 }
 celery_app.conf.task_default_queue = "controller_queue"
+
+# Periodic tasks (run with `celery -A workers.celery_app beat`)
+celery_app.conf.beat_schedule = {
+    "reap-expired-labs": {
+        "task": "reap_expired_labs",
+        "schedule": LAB_REAPER_INTERVAL_SECONDS,
+    },
+}
+if LAB_RECONCILER_INTERVAL_SECONDS:
+    celery_app.conf.beat_schedule["reconcile-labs"] = {
+        "task": "reconcile_labs",
+        "schedule": LAB_RECONCILER_INTERVAL_SECONDS,
+    }
+if DISK_MAINTENANCE_INTERVAL_SECONDS:
+    celery_app.conf.beat_schedule["manage-disk"] = {
+        "task": "manage_disk",
+        "schedule": DISK_MAINTENANCE_INTERVAL_SECONDS,
+    }
+if LAB_SNAPSHOTS_ENABLED and LAB_SNAPSHOT_GC_INTERVAL_SECONDS:
+    celery_app.conf.beat_schedule["gc-lab-snapshots"] = {
+        "task": "gc_lab_snapshots",
+        "schedule": LAB_SNAPSHOT_GC_INTERVAL_SECONDS,
+    }
+if BUILD_LOG_MAINTENANCE_INTERVAL_SECONDS:
+    celery_app.conf.beat_schedule["maintain-build-log-partitions"] = {
+        "task": "maintain_build_log_partitions",
+        "schedule": BUILD_LOG_MAINTENANCE_INTERVAL_SECONDS,
+    }
+if TEMPLATE_SYNC_INTERVAL_SECONDS:
+    celery_app.conf.beat_schedule["sync-template-store"] = {
+        "task": "sync_template_store",
+        "schedule": TEMPLATE_SYNC_INTERVAL_SECONDS,
+    }
+
+
+@setup_logging.connect
+def setup_worker_logging(**kwargs):
+    """Use the queued JSON logging of the API instead of Celery's own setup."""
+    configure_logging()
+
+
+@task_prerun.connect
+def bind_task_id(task_id=None, **kwargs):
+    task_id_var.set(task_id)
+
+
+@task_postrun.connect
+def unbind_task_id(**kwargs):
+    task_id_var.set(None)
+
+
+# Profiler of the task this process is running, if it is being profiled
+_task_profiler = None
+
+
+@task_prerun.connect
+def start_task_profiler(task=None, **kwargs):
+    """Profile every Nth run of the tasks listed in PROFILE_TASKS."""
+    global _task_profiler
+    if task is not None and should_profile_task(task.name):
+        _task_profiler = SamplingProfiler().start()
+
+
+@task_postrun.connect
+def save_task_profile(
+    task=None, task_id=None, args=None, kwargs=None, state=None, **extra
+):
+    global _task_profiler
+    if _task_profiler is None:
+        return
+    profiler, _task_profiler = _task_profiler.stop(), None
+    name = task.name
+    if task.name == "task_manager":
+        # One name per kind of lab task (provision, teardown, reset)
+        name = f"{task.name}:{(kwargs or {}).get('type', 'provision')}"
+    try:
+        save_profile(
+            profiler,
+            "task",
+            name,
+            task_id=task_id,
+            lab_uid=(args or [None])[0] if task.name == "task_manager" else None,
+            state=state,
+        )
+    except OSError as e:
+        logger.warning(f"Could not save the profile of task {task_id}: {e}")
+
+
+@worker_ready.connect
+def start_worker_metrics_server(**kwargs):
+    """Expose the worker's Prometheus metrics (provisioning stages, GitHub fetches)."""
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+def cleanup_worker_process_metrics(pid=None, **kwargs):
+    mark_process_dead(pid)
+
+
+@worker_ready.connect
+def start_resource_sampler(**kwargs):
+    """Start the per-lab container resource sampler on this worker host."""
+    if LAB_METRICS_ENABLED:
+        start_lab_sampler()
+
+
+@worker_shutdown.connect
+def stop_resource_sampler(**kwargs):
+    stop_lab_sampler()
+
+
+@celeryd_after_setup.connect
+def consume_node_queue(sender, instance, **kwargs):
+    """
+    Besides the shared queue, consume the queue of this node: tasks for labs
+    on this node (teardown, reset, ...) go there even without placement.
+    """
+    instance.app.amqp.queues.select_add(node_queue_name(NODE_NAME))
+
+
+@worker_ready.connect
+def start_heartbeat(**kwargs):
+    """Announce this node's capacity to the placement scheduler."""
+    if LAB_PLACEMENT_ENABLED:
+        start_node_heartbeat()
+
+
+@worker_shutdown.connect
+def stop_heartbeat(**kwargs):
+    stop_node_heartbeat()